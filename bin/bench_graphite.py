@@ -0,0 +1,112 @@
+#!/bin/env python3
+# coding: utf8
+"""Graphite 推送的基准测试, 只连接本机的模拟服务端
+
+python bin/bench_graphite.py --points 100000
+"""
+import asyncio
+import time
+
+import _base  # noqa: F401 设置工作目录与 sys.path
+import typer
+
+from grafana.client_carbon import CarbonClient
+from grafana.client_graphite import AGraphiteClient
+
+app = typer.Typer()
+
+
+def sample_points(points: int) -> list[dict]:
+    now = int(time.time())
+    return [
+        {
+            "name": f"bench.metric_{i % 100}",
+            "interval": 10,
+            "value": i * 0.5,
+            "time": now,
+            "tags": ["host=bench", f"target=t{i % 10}"],
+        }
+        for i in range(points)
+    ]
+
+
+async def carbon_server() -> tuple[asyncio.Server, list]:
+    """只统计收到的字节数"""
+    received = [0]
+
+    async def handle(reader, writer):
+        while chunk := await reader.read(1 << 16):
+            received[0] += len(chunk)
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0), received
+
+
+async def http_server() -> tuple[asyncio.Server, list]:
+    """最简单的 HTTP/1.1 keep-alive 服务端, 对每个请求返回 200"""
+    received = [0]
+
+    async def handle(reader, writer):
+        while headers := await reader.readuntil(b"\r\n\r\n"):
+            length = 0
+            for line in headers.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            received[0] += len(headers) + len(await reader.readexactly(length))
+            writer.write(b"HTTP/1.1 200 OK\r\ncontent-length: 0\r\n\r\n")
+            await writer.drain()
+
+    async def handle_eof(reader, writer):
+        try:
+            await handle(reader, writer)
+        except asyncio.IncompleteReadError:
+            pass  # 客户端关闭连接
+
+    return await asyncio.start_server(handle_eof, "127.0.0.1", 0), received
+
+
+async def run_carbon(points: list[dict], protocol: str) -> tuple[float, int]:
+    server, received = await carbon_server()
+    client = CarbonClient("127.0.0.1", server.sockets[0].getsockname()[1], protocol)
+    start = time.perf_counter()
+    await client.pushes(points)
+    await client.join(600)
+    elapsed = time.perf_counter() - start
+    client.task.cancel()
+    await client.close()
+    await asyncio.sleep(0.1)  # 等待服务端读到 EOF
+    server.close()
+    return elapsed, received[0]
+
+
+async def run_http(points: list[dict]) -> tuple[float, int]:
+    server, received = await http_server()
+    port = server.sockets[0].getsockname()[1]
+    client = AGraphiteClient(f"http://127.0.0.1:{port}/metrics", "bench", "key")
+    start = time.perf_counter()
+    await client.pushes(points)
+    await client.join(600)
+    elapsed = time.perf_counter() - start
+    client.task.cancel()
+    await client.client.aclose()
+    await asyncio.sleep(0.1)
+    server.close()
+    return elapsed, received[0]
+
+
+@app.command()
+def main(points: int = 100_000):
+    """比较 HTTP JSON (每批 20 个点) 与 Carbon TCP 长连接的吞吐"""
+    data = sample_points(points)
+    print(f"points: {points}")
+    print(f"{'output':<18}{'seconds':>10}{'points/s':>12}{'bytes/point':>13}")
+    for name, run in (
+        ("http json", run_http),
+        ("carbon plaintext", lambda p: run_carbon(p, "plaintext")),
+        ("carbon pickle", lambda p: run_carbon(p, "pickle")),
+    ):
+        elapsed, size = asyncio.run(run(data))
+        print(f"{name:<18}{elapsed:>10.2f}{points / elapsed:>12.0f}{size / points:>13.1f}")
+
+
+if __name__ == "__main__":
+    app()
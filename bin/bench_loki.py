@@ -0,0 +1,149 @@
+#!/bin/env python3
+# coding: utf8
+"""Loki 推送相关的基准测试, 不访问网络
+
+python bin/bench_loki.py encoding --lines 10000
+python bin/bench_loki.py stream --lines 1000000
+"""
+import gc
+import json
+import random
+import time
+import tracemalloc
+from functools import partial
+
+import _base  # noqa: F401 设置工作目录与 sys.path
+import typer
+from pydantic import BaseModel
+
+from grafana.client_loki import LogValue, LokiClient, Stream
+from grafana.loki_proto import HAS_SNAPPY
+
+app = typer.Typer()
+
+
+@app.callback()
+def main():
+    """Loki 推送基准测试"""
+
+
+def sample_lines(lines: int) -> list[str]:
+    """生成类似 Clash traffic/tracing 的日志行"""
+    rnd = random.Random(42)
+    return [
+        json.dumps(
+            {
+                "type": "traffic",
+                "up": rnd.randint(0, 1 << 20),
+                "down": rnd.randint(0, 1 << 22),
+                "metadata_host": f"host-{rnd.randint(0, 300)}.example.com",
+            }
+        )
+        for _ in range(lines)
+    ]
+
+
+def sample_streams(lines: int, label_sets: int = 4) -> list[Stream]:
+    now = time.time_ns()
+    streams = [
+        Stream({"type": f"type_{i}", "reportNode": "bench"})
+        for i in range(label_sets)
+    ]
+    for n, line in enumerate(sample_lines(lines)):
+        streams[n % label_sets].append(now + n, line)
+    return streams
+
+
+def measure(func, data, repeat: int) -> tuple[int, float]:
+    """返回 (编码后的字节数, 每次调用的 CPU 时间 ms)"""
+    body, _ = func(data)
+    start = time.process_time()
+    for _ in range(repeat):
+        func(data)
+    return len(body), (time.process_time() - start) / repeat * 1000
+
+
+@app.command()
+def encoding(lines: int = 10000, repeat: int = 20, level: int = 9):
+    """比较 JSON+gzip 与 protobuf+snappy 的请求体大小与 CPU 耗时"""
+    streams = sample_streams(lines)
+    raw = sum(len(v[1]) for s in streams for v in s.values)
+    print(f"lines: {lines}, raw line bytes: {raw}, snappy installed: {HAS_SNAPPY}")
+    print(f"{'encoding':<10}{'bytes':>12}{'ratio':>10}{'cpu ms':>10}")
+    for name, func in (
+        ("json", partial(LokiClient.encode_json, level=level)),
+        ("protobuf", partial(LokiClient.encode_protobuf, level=level)),
+    ):
+        size, cpu = measure(func, streams, repeat)
+        print(f"{name:<10}{size:>12}{size / raw:>10.3f}{cpu:>10.2f}")
+
+
+class PydanticStream(BaseModel):
+    """优化前的 Stream 实现, 作为对照"""
+
+    stream: dict
+    values: list[LogValue]
+
+
+def build_pydantic(lines: list[str], label_sets: int) -> list[PydanticStream]:
+    now = time.time_ns()
+    values = [[] for _ in range(label_sets)]
+    for n, line in enumerate(lines):
+        values[n % label_sets].append([str(now + n), line])
+    return [
+        PydanticStream(stream={"type": f"type_{i}", "reportNode": "bench"}, values=v)
+        for i, v in enumerate(values)
+    ]
+
+
+def dump_pydantic(streams: list[PydanticStream]) -> bytes:
+    data = {"streams": [s.model_dump() for s in streams]}
+    return json.dumps(data, ensure_ascii=False).encode()
+
+
+def build_compact(lines: list[str], label_sets: int) -> list[Stream]:
+    now = time.time_ns()
+    streams = [
+        Stream({"type": f"type_{i}", "reportNode": "bench"})
+        for i in range(label_sets)
+    ]
+    for n, line in enumerate(lines):
+        streams[n % label_sets].append(now + n, line)
+    return streams
+
+
+def build_memory(build, lines: list[str], label_sets: int) -> int:
+    """构建批次额外占用的内存(不含日志行本身)"""
+    gc.collect()
+    tracemalloc.start()
+    streams = build(lines, label_sets)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del streams
+    return size
+
+
+@app.command()
+def stream(lines: int = 1_000_000, label_sets: int = 4):
+    """比较 pydantic Stream 与列式 Stream 的内存占用与吞吐"""
+    data = sample_lines(lines)
+    print(f"lines: {lines}, label sets: {label_sets}")
+    print(f"{'stream':<10}{'memory MiB':>12}{'build s':>10}{'dump s':>10}{'lines/s':>12}")
+    for name, build, dump in (
+        ("pydantic", build_pydantic, dump_pydantic),
+        ("compact", build_compact, LokiClient.serialize_json),
+    ):
+        memory = build_memory(build, data, label_sets)
+        start = time.perf_counter()
+        streams = build(data, label_sets)
+        built = time.perf_counter()
+        dump(streams)
+        dumped = time.perf_counter()
+        print(
+            f"{name:<10}{memory / 1024**2:>12.1f}{built - start:>10.2f}"
+            f"{dumped - built:>10.2f}{lines / (dumped - start):>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    app()
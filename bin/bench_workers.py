@@ -0,0 +1,145 @@
+#!/bin/env python3
+# coding: utf8
+"""多进程 Handler 的吞吐基准测试, 不访问网络
+
+每个进程运行一个完整的 Handler: 模拟的 Clash 输入 (JSON 解析 + transform)
+-> processors -> 编码压缩的空输出. 比较 1..N 个进程的总吞吐.
+加速比只有在多核机器上才有意义, 进程数超过 CPU 核心数时只测量调度开销.
+
+python bin/bench_workers.py --lines 200000 --max-workers 4
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import _base  # noqa: F401 设置工作目录与 sys.path
+import typer
+
+from grafana.clash import transform_tracing
+from grafana.client_loki import LokiClient, Stream
+from grafana.push import Handler, InputBase
+from grafana.workers import worker_config
+
+app = typer.Typer()
+
+
+def sample_messages(lines: int) -> list[str]:
+    """Clash /profile/tracing 推送的原始消息"""
+    rnd = random.Random(42)
+    return [
+        json.dumps(
+            {
+                "type": "RuleMatch",
+                "duration": rnd.randint(0, 10000),
+                "metadata": {
+                    "destinationIP": f"10.0.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}",
+                    "destinationPort": "443",
+                    "host": f"host-{rnd.randint(0, 300)}.example.com",
+                    "network": "tcp",
+                    "sourceIP": "192.168.1.2",
+                    "sourcePort": str(rnd.randint(1024, 65535)),
+                    "type": "HTTPS",
+                    "dnsMode": "normal",
+                },
+            }
+        )
+        for _ in range(lines)
+    ]
+
+
+class InputBench(InputBase):
+    __input_type__ = "bench"
+
+    def __init__(self, lines: int, batch: int = 1000):
+        self.messages = sample_messages(lines)
+        self.batch = batch
+
+    async def to_handle(self, queue: asyncio.Queue):
+        for start in range(0, len(self.messages), self.batch):
+            stream = Stream({"type": "rulematch"})
+            now = time.time_ns()
+            for n, m in enumerate(self.messages[start : start + self.batch]):
+                stream.append(now + n, json.dumps(transform_tracing(json.loads(m))))
+            await queue.put(stream)
+            await asyncio.sleep(0)
+
+
+class OutputNull:
+    """按 LokiBufferPush 的批次大小编码压缩后丢弃"""
+
+    __output_type__ = "null"
+
+    def __init__(self, expected: int, max_lines: int = 5000, level: int = 9):
+        self.expected = expected
+        self.max_lines = max_lines
+        self.level = level
+        self.buffer: list[Stream] = []
+        self.buffered = 0
+        self.lines = 0
+        self.bytes = 0
+        self.done = asyncio.Event()
+
+    async def put(self, data: Stream):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.max_lines or self.lines + self.buffered >= self.expected:
+            body, _ = LokiClient.encode_json(self.buffer, self.level)
+            self.bytes += len(body)
+            self.lines += self.buffered
+            self.buffer, self.buffered = [], 0
+        if self.lines >= self.expected:
+            self.done.set()
+
+
+def run_handler(args: tuple[int, int]) -> tuple[int, float]:
+    """子进程: 运行一个 Handler 直到全部数据输出, 返回 (输出的行数, 耗时)
+
+    生成模拟数据的时间不计入耗时
+    """
+    index, lines = args
+    Handler.input_class = {"bench": InputBench}
+    Handler.output_class = {"null": OutputNull}
+    config = worker_config(
+        {
+            "inputs": [],
+            "processors": [{"type": "project", "exclude": ["reportNode"]}],
+            "outputs": [{"type": "null", "expected": lines}],
+        },
+        index,
+        [{"type": "bench", "lines": lines}],
+    )
+
+    async def main():
+        handler = Handler.from_config(config)
+        start = time.perf_counter()
+        asyncio.create_task(handler.start())
+        await handler.outputs[0].done.wait()
+        return handler.outputs[0].lines, time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+@app.command()
+def main(lines: int = 200_000, max_workers: int = os.cpu_count()):
+    """每个进程处理 lines 行, 比较不同进程数下的总吞吐"""
+    print(f"lines per worker: {lines}, cpu count: {os.cpu_count()}")
+    if max_workers > (os.cpu_count() or 1):
+        print("warning: 进程数超过 CPU 核心数, 超出部分不能反映多核加速比")
+    print(f"{'workers':>8}{'seconds':>10}{'lines/s':>12}{'speedup':>10}")
+    ctx = multiprocessing.get_context("spawn")
+    base = None
+    for workers in range(1, max_workers + 1):
+        with ctx.Pool(workers) as pool:
+            res = pool.map(run_handler, [(i, lines) for i in range(workers)], 1)
+        total = sum(r[0] for r in res)
+        elapsed = max(r[1] for r in res)
+        rate = total / elapsed
+        base = base or rate
+        print(f"{workers:>8}{elapsed:>10.2f}{rate:>12.0f}{rate / base:>10.2f}")
+
+
+if __name__ == "__main__":
+    app()
@@ -10,59 +10,158 @@ from pathlib import Path
 import yaml
 
 import _base
+from grafana.config_reload import ConfigReloader
 from grafana.push import Handler
+from grafana.workers import WorkerPool
 from tools import gc_callback
 
 logger = logging.getLogger("host-service.bin.to-loki")
 
-_base.logging_configurator(
-    name="to-loki",
-    console_print=True,
-    console_level="INFO" if _base.IS_SYSTEMD else "DEBUG",
-    file_level="DEBUG" if _base.IS_SYSTEMD else "INFO",
-)
+
+def setup_logging(name: str = None):
+    _base.logging_configurator(
+        name=f"to-loki-{name}" if name else "to-loki",
+        console_print=True,
+        console_level="INFO" if _base.IS_SYSTEMD else "DEBUG",
+        file_level="DEBUG" if _base.IS_SYSTEMD else "INFO",
+    )
+
 
 config = """version: 1
 
+workers: 1  # 大于 1 时将 inputs 分配到多个进程, 每个进程运行独立的 processors 与 outputs
+worker_label: false  # 为 true 时各进程推送的日志带 worker 标签; 关闭时不同进程的 inputs 应产生不同的标签
+queue_size: 10000  # 输入与处理器之间的队列长度, 满时输入等待; 修改后需要重启
+reload_interval: 2  # 检查配置文件修改的间隔(秒), 0 为只响应 SIGHUP; workers 为 1 时生效
+
 inputs:
   - type: clash
     host: hostname
     token:
-  - type: ping
-    host: hostname:port
+  - type: ping  # 一个任务并发 Ping 所有目标
+    targets: [192.168.1.1, example.com]
+    interval: 10  # 每轮间隔(秒)
+    count: 3  # 每轮每个目标发送的请求数
+    timeout: 1  # 等待回复的时间(秒)
+  - type: tail  # 跟踪本地日志文件, 支持 glob; Linux 上使用 inotify, 否则按 poll_interval 轮询
+    paths: [logs/*.log]
+    checkpoint: spool/tail.json  # 已交给 Handler 的读取位置, 重启后从此处继续; 队列与缓存中未送达的行在异常退出时丢失
+    from_beginning: false  # 首次启动时已有的文件是否从头读取
+    labels: {app: host-service}
   - type: tailscale
     tsnet: tsnet
     api_key: api_key
 
+processors:  # 可选, 按顺序在分发到输出之前执行
+  - type: filter  # drop 丢弃匹配的行 | keep 只保留匹配的行
+    action: drop
+    labels: {type: logs}
+    fields: {level: [debug]}
+  - type: relabel
+    set: {env: home}
+    rename: {}
+    drop: []
+  - type: project  # 只保留 JSON 日志行中的字段, 或用 exclude 删除字段
+    exclude: [metadata_sourceIP]
+  - type: sample  # 每个标签集合每秒最多保留 rate 行
+    rate: 50
+  - type: dedup  # window 秒内标签与内容相同的行只保留第一行
+    window: 60
+    labels: {type: logs}  # 可选, 只对匹配的 Stream 去重
+
 outputs:
   - type: loki
     host: hostname
     user_id: user_id
     api_key: api_key
-  - type: file
-    filename: filename.log
+    encoding: json  # json | protobuf
+    compress_level: 9  # gzip 压缩级别, 越低 CPU 占用越少
+    offload_threshold: 65536  # 批次超过该字节数时在线程池中编码压缩
+    capacity: 40  # 每批最多的 Stream 数量
+    max_lines: 5000  # 每批最多的日志行数
+    max_bytes: 1048576  # 每批估算的最大字节数
+    flush_timeout: 5  # 数据在缓存中的最长停留时间(秒)
+    spool_dir: spool/loki  # 可选, 推送失败的批次保存在磁盘上等待重放
+    spool_max_bytes: 268435456
+    max_in_flight: 4  # 同时推送的批次上限; 同一标签集合的批次依次发送, 保证按顺序到达
+    keepalive_expiry: 30
+    http2: false  # 需要安装 h2
+    max_retries: 5  # 429/5xx 时以抖动退避重试同一批次
+    max_push_rate: 20  # 每秒最多推送次数, 被限流时自动降低
+    late_policy: nudge  # 迟到日志: nudge 调整时间戳 | route 发往 late="true" 的流 | drop 丢弃
+    max_label_values: 0  # 每个标签键的取值上限, 超出后折叠进日志行, 默认 0 为关闭
+    label_limits:  # 单独限制某些标签键, 配置后开启基数保护
+      target: 200
+    label_window: 3600  # 超过该秒数未出现的标签值过期, 不再占用名额
+    queue:  # 每个输出独立的发送队列, 一个输出阻塞不会拖慢其他输出
+      size: 10000
+      overflow: drop_oldest  # drop_oldest | drop_newest | block
+  - type: loki_sharded  # 按标签一致性哈希分发到多个端点/租户
+    encoding: protobuf  # 分片外的配置为所有分片的默认值
+    queue_size: 10000  # 每个分片的发送队列长度, 满了丢弃最旧的数据
+    shards:
+      - host: hostname-a
+        user_id: user_id
+        api_key: api_key
+      - host: hostname-b
+        user_id: user_id
+        api_key: api_key
+  - type: graphite  # 从日志中提取数值指标, 聚合后推送到 Graphite
+    url: https://graphite-prod.grafana.net/graphite/metrics  # Grafana Cloud HTTP 接口
+    user_id: user_id
+    api_key: api_key
+    # carbon_host: hostname  # 或使用自建 Carbon 的 TCP 接口
+    # carbon_port: 2003
+    # protocol: plaintext  # plaintext | pickle
+    interval: 10  # 聚合周期(秒), 每个周期每个指标只推送一个点
+    prefix: host-service
+    tags:
+      host: hostname
+    rules:
+      - match: {type: traffic}
+        name: clash.traffic
+        fields: [up, down]
+        kind: counter  # counter | gauge | timer | histogram
+      - match: {type: tailscale_ping}
+        name: tailscale.ping.ttl
+        fields: [.]  # . 表示整行
+        tags: [source, target]
+        kind: timer
+  - type: file  # NDJSON 本地归档
+    filename: logs/archive/to-loki.ndjson
     encoding: utf-8
-    mode: a+
+    mode: a+  # 包含 w 时启动时清空文件
+    buffer_size: 1048576  # 内存中累积到该大小后写入
+    flush_interval: 1  # 最长累积时间(秒)
+    fsync_interval: 10
+    max_bytes: 104857600  # 按大小轮转, 0 为关闭
+    rotate_interval: 86400  # 按时间轮转(秒), 可选
+    backup_count: 10
+    compress: true  # 轮转后的文件在后台 gzip 压缩
 """
 
 
 def to_loki(file: Path):
+    setup_logging()
     config_dict = yaml.safe_load(file.read_text(encoding="utf8"))
     logger.info("Loaded Config File Success.")
 
-    handle = Handler()
-    for i in config_dict["inputs"]:
-        i: dict
-        type_ = i.pop("type")
-        handle.register_input(type_, **i)
-        logger.info("注册输入: %s, %s", type_, i)
-    for o in config_dict["outputs"]:
-        o: dict
-        type_ = o.pop("type")
-        handle.register_output(type_, **o)
-        logger.info("注册输出: %s, %s", type_, o)
-
-    asyncio.run(handle.start())
+    workers = config_dict.get("workers") or 1
+    if workers > 1:
+        WorkerPool(config_dict, workers, setup=setup_logging).run()
+        return
+
+    async def main():
+        handle = Handler.from_config(config_dict)
+        # kill -HUP 或修改配置文件后, 只重启发生变化的输入/输出
+        reloader = ConfigReloader(file, handle, config_dict.get("reload_interval", 2))
+        reload_task = asyncio.create_task(reloader.run(), name="config_reload")
+        try:
+            await handle.start()
+        finally:
+            reload_task.cancel()
+
+    asyncio.run(main())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : aggregator.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/17 21:05
+
+statsd 风格的进程内指标聚合.
+
+counter / gauge / timer / histogram 按 (名称, 标签) 累积在内存中,
+每个刷新周期对每个指标的每个统计量只产生一个 Graphite 数据点.
+"""
+import asyncio
+import logging
+import math
+import random
+import time
+from array import array
+
+logger = logging.getLogger("host-service.grafana.aggregator")
+
+PERCENTILES = (50, 95, 99)
+
+
+def _tags_key(tags: dict | None) -> tuple:
+    return tuple(sorted(tags.items())) if tags else ()
+
+
+def percentile(sorted_values, p: float) -> float:
+    """最近秩法计算百分位, sorted_values 需已排序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Counter:
+    __slots__ = ("value",)
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0.0
+
+    def add(self, value: float):
+        self.value += value
+
+    def stats(self, interval: float) -> dict:
+        return {"count": self.value, "rate": self.value / interval}
+
+
+class Gauge:
+    __slots__ = ("value",)
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0.0
+
+    def add(self, value: float):
+        self.value = value
+
+    def stats(self, interval: float) -> dict:
+        return {"value": self.value}
+
+
+class Timer:
+    """记录精确的 sum/count/min/max, 百分位由固定大小的蓄水池采样计算"""
+
+    __slots__ = ("count", "sum", "min", "max", "samples", "reservoir")
+    kind = "timer"
+
+    def __init__(self, reservoir: int = 1024):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.samples = array("d")
+        self.reservoir = reservoir
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self.samples) < self.reservoir:
+            self.samples.append(value)
+        else:
+            i = random.randrange(self.count)
+            if i < self.reservoir:
+                self.samples[i] = value
+
+    def stats(self, interval: float) -> dict:
+        values = sorted(self.samples)
+        res = {
+            "sum": self.sum,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count,
+        }
+        for p in PERCENTILES:
+            res[f"p{p}"] = percentile(values, p)
+        return res
+
+
+class Histogram(Timer):
+    __slots__ = ()
+    kind = "histogram"
+
+
+class MetricAggregator:
+    def __init__(
+        self,
+        interval: float = 10,
+        prefix: str = "",
+        tags: dict = None,
+        reservoir: int = 1024,
+    ):
+        """
+        :param interval: 刷新周期(秒), 同时作为 Graphite 数据点的 interval
+        :param prefix: 指标名称前缀
+        :param tags: 附加到所有数据点的标签
+        :param reservoir: timer/histogram 用于计算百分位的采样数上限
+        """
+        self.interval = interval
+        self.prefix = prefix.rstrip(".") + "." if prefix else ""
+        self.tags = tags or {}
+        self.reservoir = reservoir
+        self._metrics: dict[tuple, Counter | Gauge | Timer] = {}
+        self.samples = 0  # 当前周期收到的样本数
+
+    def __len__(self):
+        return len(self._metrics)
+
+    def _get(self, cls, name: str, tags: dict | None):
+        key = (name, _tags_key(tags))
+        m = self._metrics.get(key)
+        if m is None:
+            m = self._metrics[key] = (
+                cls(self.reservoir) if issubclass(cls, Timer) else cls()
+            )
+        elif type(m) is not cls:
+            raise TypeError(f"指标 {name} 已注册为 {m.kind}, 不能再作为 {cls.kind} 使用")
+        self.samples += 1
+        return m
+
+    def counter(self, name: str, value: float = 1, tags: dict = None):
+        self._get(Counter, name, tags).add(value)
+
+    def gauge(self, name: str, value: float, tags: dict = None):
+        self._get(Gauge, name, tags).add(value)
+
+    def timer(self, name: str, value: float, tags: dict = None):
+        self._get(Timer, name, tags).add(value)
+
+    def histogram(self, name: str, value: float, tags: dict = None):
+        self._get(Histogram, name, tags).add(value)
+
+    def flush(self, now: float = None) -> list[dict]:
+        """取出当前周期的汇总数据点并清空累积器
+
+        时间戳向下对齐到 interval, 同一周期内多次刷新得到的点可以在 Graphite 中合并.
+        """
+        now = time.time() if now is None else now
+        ts = int(now // self.interval * self.interval)
+        metrics, self._metrics = self._metrics, {}
+        samples, self.samples = self.samples, 0
+        points = []
+        for (name, tags), m in metrics.items():
+            tags = [f"{k}={v}" for k, v in {**self.tags, **dict(tags)}.items()]
+            for stat, value in m.stats(self.interval).items():
+                points.append(
+                    {
+                        "name": f"{self.prefix}{name}.{stat}",
+                        "interval": int(self.interval),
+                        "value": value,
+                        "time": ts,
+                        "tags": tags,
+                    }
+                )
+        if points:
+            logger.debug("聚合 %d 个样本为 %d 个数据点", samples, len(points))
+        return points
+
+    async def run(self, client):
+        """周期性刷新到 GraphiteClient 或 AGraphiteClient"""
+        loop = asyncio.get_running_loop()
+        next_flush = loop.time() + self.interval
+        while True:
+            await asyncio.sleep(max(0.0, next_flush - loop.time()))
+            next_flush += self.interval
+            points = self.flush()
+            if not points:
+                continue
+            res = client.pushes(points)
+            if asyncio.iscoroutine(res):
+                await res
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : aggregator_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/17 21:25
+"""
+import asyncio
+
+import pytest
+
+from .aggregator import MetricAggregator, percentile
+
+
+def _points(points):
+    return {(p["name"], tuple(p["tags"])): p["value"] for p in points}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0
+
+
+def test_aggregate_flush():
+    agg = MetricAggregator(interval=10, prefix="host", tags={"host": "r1"})
+    for v in (1, 2, 3, 4):
+        agg.timer("ping.rtt", v, {"target": "a"})
+    agg.counter("clash.up", 100)
+    agg.counter("clash.up", 50)
+    agg.gauge("queue.size", 3)
+    agg.gauge("queue.size", 7)
+
+    points = agg.flush(now=1005)
+    assert {p["time"] for p in points} == {1000}
+    values = _points(points)
+    rtt = ("host=r1", "target=a")
+    assert values["host.ping.rtt.sum", rtt] == 10
+    assert values["host.ping.rtt.count", rtt] == 4
+    assert values["host.ping.rtt.min", rtt] == 1
+    assert values["host.ping.rtt.max", rtt] == 4
+    assert values["host.ping.rtt.p50", rtt] == 2
+    assert values["host.clash.up.count", ("host=r1",)] == 150
+    assert values["host.clash.up.rate", ("host=r1",)] == 15
+    assert values["host.queue.size.value", ("host=r1",)] == 7
+    assert agg.flush() == []
+
+
+def test_reservoir_bounded():
+    agg = MetricAggregator(reservoir=16)
+    for v in range(1000):
+        agg.histogram("h", v)
+    (m,) = agg._metrics.values()
+    assert len(m.samples) == 16
+    values = _points(agg.flush())
+    assert values["h.count", ()] == 1000
+    assert values["h.max", ()] == 999
+
+
+def test_kind_conflict():
+    agg = MetricAggregator()
+    agg.counter("x")
+    with pytest.raises(TypeError):
+        agg.gauge("x", 1)
+
+
+def test_run_async_client():
+    class Client:
+        def __init__(self):
+            self.points = []
+
+        async def pushes(self, points):
+            self.points.extend(points)
+
+    async def main():
+        task = asyncio.create_task(agg.run(client))
+        agg.counter("c")
+        await asyncio.sleep(0.08)
+        task.cancel()
+
+    agg = MetricAggregator(interval=0.05)
+    client = Client()
+    asyncio.run(main())
+    assert [p["name"] for p in client.points] == ["c.count", "c.rate"]
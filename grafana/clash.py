@@ -3,8 +3,6 @@ import logging
 import socket
 import time
 import asyncio
-from queue import Queue
-from collections import defaultdict
 
 from httpx import Client, AsyncClient, ConnectError
 from httpx_ws import (
@@ -15,6 +13,7 @@ from httpx_ws import (
 )
 
 from grafana.client_loki import LokiClient, Stream
+from tools import ABatchQueue, BatchQueue
 
 logger = logging.getLogger("host-service.grafana.clash")
 
@@ -62,8 +61,8 @@ class Clash:
             base_url=f"http://{host}",
             params={"token": token},
         )
-        self.queue_traffic = Queue()
-        self.queue_profile = Queue()
+        self.queue_traffic = BatchQueue()
+        self.queue_profile = BatchQueue()
 
     def ws_traffic(self):
         with connect_ws(
@@ -83,8 +82,8 @@ class AClash:
             base_url=f"http://{host}",
             params={"token": token},
         )
-        self.login_input = []
-        self.queue = asyncio.Queue()
+        self.ws_tasks: list[asyncio.Task] = []
+        self.queue = ABatchQueue()
 
     async def _ws(self, url, transform_callback, **kwargs):
         logger.info("Started receive %s ... ", url)
@@ -95,7 +94,7 @@ class AClash:
             while True:
                 data = await ws.receive_json()
                 data = transform_callback(data)
-                await self.queue.put([str(time.time_ns()), data])
+                await self.queue.put((time.time_ns(), data))
                 logger.debug("added %s: %s", data["type"], data)
 
     async def _try_ws(self, url, transform_callback, **kwargs):
@@ -131,11 +130,19 @@ class AClash:
                 )
                 await asyncio.sleep(5)
 
+    def _create_ws_task(self, coro, name: str = None) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self.ws_tasks.append(task)
+        return task
+
+    @property
+    def inputs_alive(self) -> bool:
+        return any(not t.done() for t in self.ws_tasks)
+
     async def ws_traffic(self):
         """实时流量"""
         name = f"ws_clash_{self.host}_traffic"
-        self.login_input.append(name)
-        return asyncio.create_task(
+        return self._create_ws_task(
             self._try_ws(
                 "/traffic",
                 transform_traffic,
@@ -146,8 +153,7 @@ class AClash:
     async def ws_profile_tracing(self):
         """创建一个task, 并持续的接受内容"""
         name = f"ws_clash_{self.host}_tracing"
-        self.login_input.append(name)
-        return asyncio.create_task(
+        return self._create_ws_task(
             self._try_ws(
                 "/profile/tracing",
                 transform_tracing,
@@ -158,54 +164,45 @@ class AClash:
     async def ws_logs(self):
         """日志信息"""
         name = f"ws_clash_{self.host}_logs"
-        self.login_input.append(name)
-        return asyncio.create_task(
+        return self._create_ws_task(
             self._try_ws("/logs", transform_logs, params={"level": "debug"}), name=name
         )
 
     async def ws_connections(self):
         """连接信息"""
         name = f"ws_clash_{self.host}_connections"
-        self.login_input.append(name)
-        return asyncio.create_task(self._try_ws("/connections", transform_connections))
-
-    async def create_streams(self) -> list[Stream]:
-        if self.queue.empty():
-            return []
-        streams = defaultdict(list)
-        for _ in range(self.queue.qsize()):
-            data = await self.queue.get()
-            label_type = data[1]["type"]
-            data[1] = json.dumps(data[1])
-            streams[label_type].append(data)
-
-        return [
-            Stream(
-                stream={
-                    "type": k,
-                },
-                values=v,
-            )
-            for k, v in streams.items()
-        ]
+        return self._create_ws_task(
+            self._try_ws("/connections", transform_connections), name=name
+        )
+
+    async def create_streams(
+        self, max_items=10000, max_wait: float = None, timeout: float = 0
+    ) -> list[Stream]:
+        """从队列中取出一批数据并按类型分组, 参数含义同 ABatchQueue.get_batch"""
+        streams: dict[str, Stream] = {}
+        batch = await self.queue.get_batch(max_items, max_wait=max_wait, timeout=timeout)
+        for time_ns, data in batch:
+            label_type = data["type"]
+            stream = streams.get(label_type)
+            if stream is None:
+                stream = streams[label_type] = Stream({"type": label_type})
+            stream.append(time_ns, json.dumps(data))
+        return list(streams.values())
 
     async def push(self, loki_client: LokiClient):
         while True:
-            await asyncio.sleep(5)
             logger.debug("Queue size: %d", self.queue.qsize())
-            streams = await self.create_streams()
+            streams = await self.create_streams(max_wait=5, timeout=5)
             if streams:
-                asyncio.create_task(loki_client.a_push(streams))
+                await loki_client.submit(streams)
 
             # Exit when input task down.
-            for task in asyncio.all_tasks():
-                if task.get_name() in self.login_input:
-                    break
-            else:
+            if not self.inputs_alive:
                 logger.error("Input Task all Down.")
                 return
 
     async def run(self):
+        self.ws_tasks = []
         await self.ws_traffic()
         await self.ws_profile_tracing()
         await self.ws_logs()
@@ -223,8 +220,7 @@ def test_aclash():
         await a.ws_traffic()
         await a.ws_profile_tracing()
         while True:
-            await asyncio.sleep(1)
-            print([a.model_dump() for a in await a.create_streams()])
+            print([a.model_dump() for a in await a.create_streams(max_wait=1)])
 
     logging.basicConfig(
         level="INFO",
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : client_carbon.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/18 20:30
+
+Carbon (自建 Graphite) TCP 推送, 支持 plaintext 与 pickle 协议.
+
+保持一条长连接, 断开时数据留在有界队列中, 按指数退避重连.
+数据点格式与 GraphiteClient 相同: {"name", "value", "time", "tags"}.
+"""
+import asyncio
+import logging
+import pickle
+import struct
+import time
+from typing import Iterable
+
+from tools import ABatchQueue
+from .client_graphite import backoff
+
+logger = logging.getLogger("host-service.grafana.carbon")
+
+
+def metric_path(point: dict) -> str:
+    """Graphite 1.1 的标签写法: name;tag1=value1;tag2=value2"""
+    tags = point.get("tags")
+    if not tags:
+        return point["name"]
+    if isinstance(tags, dict):
+        tags = [f"{k}={v}" for k, v in tags.items()]
+    return ";".join([point["name"], *tags])
+
+
+def _timestamp(point: dict) -> int:
+    ts = point.get("time") or time.time()
+    return int(ts / 1000 if ts > 1e11 else ts)  # 兼容毫秒时间戳
+
+
+def encode_plaintext(points: Iterable[dict]) -> list[bytes]:
+    return [
+        f"{metric_path(p)} {p['value']} {_timestamp(p)}\n".encode() for p in points
+    ]
+
+
+def encode_pickle(points: Iterable[dict]) -> list[bytes]:
+    payload = pickle.dumps(
+        [(metric_path(p), (_timestamp(p), p["value"])) for p in points], protocol=2
+    )
+    return [struct.pack("!L", len(payload)), payload]
+
+
+class CarbonClient:
+    ENCODERS = {"plaintext": encode_plaintext, "pickle": encode_pickle}
+    PORTS = {"plaintext": 2003, "pickle": 2004}
+
+    def __init__(
+        self,
+        host: str,
+        port: int = None,
+        protocol: str = "plaintext",
+        batch_size: int = 500,
+        max_queue: int = 100000,
+        connect_timeout: float = 5,
+    ):
+        if protocol not in self.ENCODERS:
+            raise ValueError(f"protocol 必须是 {list(self.ENCODERS)} 之一: {protocol}")
+        self.host = host
+        self.port = port or self.PORTS[protocol]
+        self.protocol = protocol
+        self.encode = self.ENCODERS[protocol]
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.connect_timeout = connect_timeout
+
+        self.queue = ABatchQueue(max_queue)
+        self.writer: asyncio.StreamWriter | None = None
+        self.total = 0  # 已写入的数据点
+        self.dropped = 0
+        self.reconnects = 0
+        self.task = asyncio.get_running_loop().create_task(self.post())
+
+    def metrics(self) -> dict:
+        return {
+            "queue": self.queue.qsize(),
+            "connected": self.writer is not None,
+            "total": self.total,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+        }
+
+    async def connect(self):
+        """连接失败时按指数退避重试, 直到连接成功"""
+        attempt = 0
+        while True:
+            try:
+                _, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.connect_timeout
+                )
+                logger.info("已连接 Carbon %s:%d (%s)", self.host, self.port, self.protocol)
+                return
+            except (OSError, asyncio.TimeoutError) as _e:
+                delay = backoff(attempt)
+                attempt += 1
+                self.reconnects += 1
+                logger.warning(
+                    "连接 Carbon %s:%d 失败: %r, %.1fs 后重试",
+                    self.host, self.port, _e, delay,
+                )
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.writer = None
+
+    async def post(self):
+        """从队列取出数据, 编码后一次 writelines 写入"""
+        pending = []
+        while True:
+            if not pending:
+                pending = await self.queue.get_batch(self.batch_size)
+            if self.writer is None:
+                await self.connect()
+            try:
+                self.writer.writelines(self.encode(pending))
+                await self.writer.drain()
+            except (OSError, ConnectionError) as _e:
+                # 写入失败时整批重发, Carbon 对重复的 (路径, 时间戳) 只保留最后一次写入
+                logger.warning("写入 Carbon 失败: %r, 重新连接", _e)
+                await self.close()
+                continue
+            self.total += len(pending)
+            for _ in pending:
+                self.queue.task_done()
+            pending = []
+
+    async def join(self, timeout: float = 30) -> bool:
+        """等待队列中的数据写入完成, 超时返回False"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def aclose(self, timeout: float = 30) -> None:
+        """等待队列中的数据写入完成后停止发送并断开连接"""
+        if not await self.join(timeout):
+            logger.warning("关闭时仍有 %d 个数据点未写入 Carbon", self.queue.qsize())
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        await self.close()
+
+    async def push(self, content: dict) -> None:
+        if dropped := self.queue.put_drop_oldest(content):
+            self.dropped += dropped
+            logger.warning("Carbon 队列已满 (%d), 丢弃最旧的数据点", self.max_queue)
+
+    async def pushes(self, contents: Iterable[dict], *args) -> None:
+        for c in contents:
+            await self.push(c)
+        for a in args:
+            if isinstance(a, dict):
+                await self.push(a)
+            elif isinstance(a, Iterable):
+                await self.pushes(a)
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : client_carbon_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/18 20:50
+"""
+import asyncio
+import pickle
+import struct
+
+import pytest
+
+from . import client_carbon
+from .client_carbon import CarbonClient, encode_pickle, encode_plaintext, metric_path
+
+
+def test_metric_path():
+    assert metric_path({"name": "a.b"}) == "a.b"
+    assert metric_path({"name": "a", "tags": ["x=1", "y=2"]}) == "a;x=1;y=2"
+    assert metric_path({"name": "a", "tags": {"x": 1}}) == "a;x=1"
+
+
+def test_encode():
+    points = [{"name": "a", "value": 1.5, "time": 1700000000000, "tags": ["t=1"]}]
+    assert encode_plaintext(points) == [b"a;t=1 1.5 1700000000\n"]
+    header, payload = encode_pickle(points)
+    assert struct.unpack("!L", header)[0] == len(payload)
+    assert pickle.loads(payload) == [("a;t=1", (1700000000, 1.5))]
+
+
+async def _server(received: list):
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            received.append(line)
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+@pytest.mark.parametrize("n", [1, 1200])
+def test_carbon_plaintext(n):
+    async def main():
+        received = []
+        server = await _server(received)
+        port = server.sockets[0].getsockname()[1]
+        client = CarbonClient("127.0.0.1", port, batch_size=500)
+        await client.pushes({"name": f"m{i}", "value": i, "time": 1} for i in range(n))
+        assert await client.join(5)
+        await client.close()
+        client.task.cancel()
+        await asyncio.sleep(0.05)
+        server.close()
+        return received, client.metrics()
+
+    received, metrics = asyncio.run(main())
+    assert len(received) == n
+    assert received[-1] == f"m{n - 1} {n - 1} 1\n".encode()
+    assert metrics["total"] == n
+
+
+def test_carbon_reconnect(monkeypatch):
+    """服务端未启动时数据保留在队列中, 启动后重连写入"""
+    monkeypatch.setattr(client_carbon, "backoff", lambda attempt: 0.02)
+
+    async def main():
+        received = []
+        probe = await _server([])
+        port = probe.sockets[0].getsockname()[1]
+        probe.close()
+        await probe.wait_closed()
+
+        client = CarbonClient("127.0.0.1", port)
+        await client.push({"name": "a", "value": 1, "time": 1})
+        await asyncio.sleep(0.1)
+        connected = client.metrics()["connected"]
+
+        async def handle(reader, writer):
+            while line := await reader.readline():
+                received.append(line)
+
+        server = await asyncio.start_server(handle, "127.0.0.1", port)
+        assert await client.join(5)
+        await client.close()
+        client.task.cancel()
+        await asyncio.sleep(0.05)
+        server.close()
+        return connected, received, client.metrics()
+
+    connected, received, metrics = asyncio.run(main())
+    assert connected is False
+    assert received == [b"a 1 1\n"]
+    assert metrics["reconnects"] > 0
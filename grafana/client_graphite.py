@@ -1,43 +1,67 @@
 import abc
 import asyncio
 import logging
+import random
 import threading
-import time
-from queue import Queue as _Queue
 from typing import Iterable
-from asyncio import Queue as _AQueue
 
-from httpx import AsyncClient, Client
+from httpx import AsyncClient, Client, HTTPError
 
-logger = logging.getLogger('host-service.grafana')
-
-
-class Queue(_Queue):
-    """"""
+from tools import ABatchQueue, BatchQueue
 
-    def get_all(self, lens=20, timeout=1):
-        """返回当前队列全部的对象，如果队列为空则等待 {timeout} s后重试"""
-        while self.empty():
-            time.sleep(timeout)
+logger = logging.getLogger('host-service.grafana')
 
-        if self.qsize() < lens:
-            lens = self.qsize()
-        return [self.get() for _ in range(lens)]
 
+def retryable(status_code: int) -> bool:
+    """网络错误(0)、429 与 5xx 可以重试, 其他 4xx 说明数据本身有问题"""
+    return status_code == 0 or status_code == 429 or status_code >= 500
 
-class AQueue(_AQueue):
-    """"""
 
-    async def get_all(self, lens=20, timeout=1) -> list:
-        """返回当前队列全部的对象，如果队列为空则等待 {timeout} s后重试"""
-        while self.empty():
-            await asyncio.sleep(timeout)
-        if self.qsize() < lens:
-            lens = self.qsize()
-        return [self.get() for _ in range(lens)]
+def backoff(attempt: int, base: float = 1, cap: float = 60) -> float:
+    """带抖动的指数退避"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
 
 
 class GraphiteBase(metaclass=abc.ABCMeta):
+    max_retries = 5
+    batch_size = 20
+
+    def _init_stats(self, max_retries, max_queue):
+        self.max_retries = max_retries
+        self.total = 0  # 成功推送的批次
+        self.dropped = 0  # 队列满时丢弃的最旧数据点
+        self.rejected = 0  # 被 4xx 拒绝的数据点
+        self.failed = 0  # 重试次数耗尽后放弃的数据点
+        self.max_queue = max_queue
+
+    def metrics(self) -> dict:
+        return {
+            'queue': self.queue.qsize(),
+            'total': self.total,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'failed': self.failed,
+        }
+
+    def _on_response(self, data: list, status_code: int, text: str) -> bool:
+        """处理响应, 返回是否需要拆分重发"""
+        if status_code // 100 == 2:
+            logger.debug("成功推送 %d 条数据", len(data))
+            self.total += 1
+            return False
+        logger.warning('推送失败：%d, %s', status_code, text[:500])
+        if retryable(status_code):
+            return False
+        if len(data) == 1:
+            self.rejected += 1
+            logger.warning('数据点被拒绝, 丢弃: %s', data[0])
+            return False
+        return True
+
+    def _shed(self, dropped: int):
+        if dropped:
+            self.dropped += dropped
+            logger.warning('Graphite 队列已满 (%d), 丢弃最旧的数据点', self.max_queue)
 
     @abc.abstractmethod
     def push(self, content: dict) -> None:
@@ -50,35 +74,67 @@ class GraphiteBase(metaclass=abc.ABCMeta):
 
 class AGraphiteClient(GraphiteBase):
 
-    def __init__(self, url, user_id, api_key):
+    def __init__(self, url, user_id, api_key, max_retries=5, max_queue=100000, **kwargs):
         self.client = AsyncClient(
             base_url=url,
             headers={
                 'Content-Type': 'application/json',
                 'Authorization': f'Bearer {user_id}:{api_key}'
             },
+            **kwargs
         )
-        self.total = 0
-        self.queue = AQueue()
-        asyncio.get_running_loop().create_task(self.post())
+        self._init_stats(max_retries, max_queue)
+        self.queue = ABatchQueue(max_queue)
+        self.task = asyncio.get_running_loop().create_task(self.post())
 
     async def post(self):
         """从队列中获取数据并推送至Grafana"""
         while True:
-            data = await self.queue.get_all()
-
-            resp = await self.client.post('', json=data)
-            if resp.status_code // 100 == 2:
-                logger.debug("成功推送 %d 条数据", len(data))
-                self.total += 1
-                continue
-
-            # 推送失败
-            logger.warning('推送失败：%s', resp.text)
-            await self.pushes(data)
+            data = await self.queue.get_batch(self.batch_size)
+            try:
+                await self._send(data)
+            finally:
+                for _ in data:
+                    self.queue.task_done()
+
+    async def _send(self, data: list):
+        """推送一批数据, 可重试的错误按指数退避重试, 4xx 时拆分批次找出有问题的数据点"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = await self.client.post('', json=data)
+                status_code, text = resp.status_code, resp.text
+            except HTTPError as _e:
+                status_code, text = 0, repr(_e)
+            if self._on_response(data, status_code, text):
+                mid = len(data) // 2
+                await self._send(data[:mid])
+                await self._send(data[mid:])
+                return
+            if not retryable(status_code):
+                return
+            if attempt < self.max_retries:
+                await asyncio.sleep(backoff(attempt))
+        self.failed += len(data)
+        logger.error('重试 %d 次后放弃 %d 条数据', self.max_retries, len(data))
+
+    async def join(self, timeout: float = 30) -> bool:
+        """等待队列中的数据推送完成, 超时返回False"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def aclose(self, timeout: float = 30) -> None:
+        """等待队列中的数据推送完成后停止推送并关闭连接"""
+        if not await self.join(timeout):
+            logger.warning('关闭时仍有 %d 条数据未推送', self.queue.qsize())
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        await self.client.aclose()
 
     async def push(self, content: dict) -> None:
-        return await self.queue.put(content)
+        self._shed(self.queue.put_drop_oldest(content))
 
     async def pushes(self, contents: Iterable[dict], *args) -> None:
         for c in contents:
@@ -92,48 +148,69 @@ class AGraphiteClient(GraphiteBase):
 
 class GraphiteClient(GraphiteBase):
 
-    def __init__(self, url, user_id, api_key):
+    def __init__(self, url, user_id, api_key, max_retries=5, max_queue=100000, **kwargs):
         self.url = url
         self.client = Client(
             headers={
                 'Content-Type': 'application/json',
                 'Authorization': f'Bearer {user_id}:{api_key}'
             },
-            verify=False
+            verify=False,
+            **kwargs
         )
-        self.queue = Queue()
-        self.total = 0
-        self._thead_exit = False
+        self._init_stats(max_retries, max_queue)
+        self.queue = BatchQueue(max_queue)
+        self._thead_exit = threading.Event()
         self.thread = threading.Thread(name='grafana-post',
                                        target=self.post,
                                        daemon=True
                                        )
         self.thread.start()
 
-    def join(self):
-        while not self.queue.empty():
-            time.sleep(0.5)
-        self._thead_exit = True
+    def join(self, timeout: float = 30) -> bool:
+        """等待队列中的数据推送完成后停止推送线程, 超时返回False"""
+        with self.queue.all_tasks_done:
+            drained = self.queue.all_tasks_done.wait_for(
+                lambda: not self.queue.unfinished_tasks, timeout
+            )
+        self._thead_exit.set()
+        return drained
 
     def post(self):
         """从队列中获取数据并推送至Grafana"""
-        while True:
-            if self._thead_exit:
+        while not self._thead_exit.is_set():
+            data = self.queue.get_batch(self.batch_size, timeout=1)
+            try:
+                self._send(data)
+            finally:
+                for _ in data:
+                    self.queue.task_done()
+
+    def _send(self, data: list):
+        """推送一批数据, 可重试的错误按指数退避重试, 4xx 时拆分批次找出有问题的数据点"""
+        if not data:
+            return
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = self.client.post(self.url, json=data)
+                status_code, text = resp.status_code, resp.text
+            except HTTPError as _e:
+                status_code, text = 0, repr(_e)
+            if self._on_response(data, status_code, text):
+                mid = len(data) // 2
+                self._send(data[:mid])
+                self._send(data[mid:])
+                return
+            if not retryable(status_code):
+                return
+            # join 超时后不再等待退避
+            if attempt < self.max_retries and self._thead_exit.wait(backoff(attempt)):
                 break
-            data = self.queue.get_all()
-
-            resp = self.client.post(self.url, json=data)
-            if resp.status_code // 100 == 2:
-                logger.debug("成功推送 %d 条数据", len(data))
-                self.total += 1
-                continue
-
-            # 推送失败
-            logger.warning('推送失败：%s', resp.text)
-            self.pushes(data)
+        self.failed += len(data)
+        logger.error('重试 %d 次后放弃 %d 条数据', self.max_retries, len(data))
 
     def push(self, content: dict) -> None:
-        return self.queue.put(content)
+        self._shed(self.queue.put_drop_oldest(content))
 
     def pushes(self, contents: Iterable[dict], *args) -> None:
         for c in contents:
@@ -34,3 +34,70 @@ def test_grafana_push():
 
 def test_grafana_pushes():
     assert False
+
+
+def _mock_client(monkeypatch, handler, **kwargs):
+    import httpx
+    from . import client_graphite
+
+    monkeypatch.setattr(client_graphite, "backoff", lambda attempt: 0)
+    return GraphiteClient(
+        "http://graphite.test/metrics", "1", "key",
+        transport=httpx.MockTransport(handler), **kwargs
+    )
+
+
+def test_grafana_retry_budget(monkeypatch):
+    import httpx
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    _g = _mock_client(monkeypatch, handler, max_retries=2)
+    _g.push({"name": "a", "value": 1})
+    assert _g.join(timeout=5)
+    assert len(calls) == 3
+    assert _g.metrics()["failed"] == 1
+
+
+def test_grafana_reject_isolated(monkeypatch):
+    import httpx
+
+    sent = []
+
+    def handler(request):
+        import json
+        data = json.loads(request.content)
+        if any(d["name"] == "bad" for d in data):
+            return httpx.Response(400, text="bad metric")
+        sent.extend(data)
+        return httpx.Response(200)
+
+    _g = _mock_client(monkeypatch, handler)
+    _g.pushes([{"name": n, "value": 1} for n in ("a", "bad", "b", "c")])
+    assert _g.join(timeout=5)
+    assert sorted(d["name"] for d in sent) == ["a", "b", "c"]
+    assert _g.metrics()["rejected"] == 1
+
+
+def test_grafana_drop_oldest(monkeypatch):
+    import httpx
+    import threading
+
+    gate = threading.Event()
+
+    def handler(request):
+        gate.wait(5)
+        return httpx.Response(200)
+
+    _g = _mock_client(monkeypatch, handler, max_queue=2)
+    _g.push({"name": "first", "value": 1})
+    time.sleep(0.1)  # 推送线程已取走第一条并阻塞在请求上
+    _g.pushes([{"name": str(i), "value": i} for i in range(5)])
+    assert _g.metrics()["dropped"] == 3
+    assert [d["name"] for d in _g.queue.queue] == ["3", "4"]
+    gate.set()
+    assert _g.join(timeout=5)
@@ -8,15 +8,25 @@
 
 import abc
 import asyncio
+import bisect
+import importlib.util
 import json
 import logging
 import time
+import zlib
+from array import array
 from gzip import compress
-from collections import namedtuple
+from collections import Counter, OrderedDict, namedtuple
+from functools import partial
+from typing import AsyncIterator, Callable, Iterable, Iterator
 
-from httpx import AsyncClient
+from httpx import AsyncClient, HTTPError, Limits
 from pydantic import BaseModel
 
+from .loki_proto import encode_push_request, snappy_block
+from .label_guard import LabelGuard, fold_line
+from .loki_spool import LokiSpool
+from .rate_control import AimdController, parse_retry_after
 
 logger = logging.getLogger("host-service.grafana.client-loki")
 
@@ -24,10 +34,96 @@ logger = logging.getLogger("host-service.grafana.client-loki")
 LogValue = namedtuple("log_value", ["time_ns", "line"])
 
 
-class Stream(BaseModel):
-    stream: dict
+class Stream:
+    """一组标签相同的日志, 时间戳与日志行分列存储, 生产者直接 append"""
+
+    __slots__ = ("stream", "timestamps", "lines")
+
+    def __init__(self, stream: dict, values: Iterable = ()):
+        self.stream = stream
+        self.timestamps = array("q")
+        self.lines: list[str] = []
+        for time_ns, line in values:
+            self.append(time_ns, line)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __repr__(self) -> str:
+        return f"Stream(stream={self.stream!r}, lines={len(self)})"
+
+    def append(self, time_ns: int | str, line: str) -> None:
+        self.timestamps.append(int(time_ns))
+        self.lines.append(line)
+
+    def extend(self, other: "Stream") -> None:
+        self.timestamps.extend(other.timestamps)
+        self.lines.extend(other.lines)
+
+    @property
+    def values(self) -> list[LogValue]:
+        return [LogValue(str(t), l) for t, l in zip(self.timestamps, self.lines)]
+
+    def sort(self) -> None:
+        """按时间戳排序, 已经有序时不做任何事"""
+        ts = self.timestamps
+        if all(ts[i] <= ts[i + 1] for i in range(len(ts) - 1)):
+            return
+        order = sorted(range(len(ts)), key=ts.__getitem__)
+        self.timestamps = array("q", (ts[i] for i in order))
+        self.lines = [self.lines[i] for i in order]
+
+    def model_dump(self) -> dict:
+        """Loki JSON 格式"""
+        return {
+            "stream": self.stream,
+            "values": [[str(t), l] for t, l in zip(self.timestamps, self.lines)],
+        }
+
+
+class StreamModel(BaseModel):
+    """API 边界上使用的 Stream 校验模型"""
+
+    stream: dict[str, str]
     values: list[LogValue]
 
+    def to_stream(self) -> Stream:
+        return Stream(self.stream, self.values)
+
+
+def label_fingerprint(labels: dict) -> tuple:
+    """标签集合的指纹, 相同的标签集合具有相同的指纹"""
+    return tuple(sorted(labels.items()))
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 9) -> Iterator[bytes]:
+    """流式 gzip 压缩, 不需要把完整的未压缩内容保存在内存中"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def estimate_size(stream: Stream) -> int:
+    """估算 Stream 编码后的字节数: 日志行 + 每行时间戳与分隔符 + 标签"""
+    return (
+        sum(map(len, stream.lines))
+        + 32 * len(stream)
+        + sum(len(k) + len(str(v)) + 6 for k, v in stream.stream.items())
+    )
+
+
+def retryable(status_code: int) -> bool:
+    """网络错误(0)、429 与 5xx 可以重试, 其他 4xx 重试也不会成功"""
+    return status_code == 0 or status_code == 429 or status_code >= 500
+
+
+def _data_size(data: list[Stream]) -> int:
+    """估算批次中日志行的字节数"""
+    return sum(len(l) for s in data if isinstance(s, Stream) for l in s.lines)
+
 
 class LokiClientBase(metaclass=abc.ABCMeta):
     @abc.abstractmethod
@@ -39,58 +135,569 @@ class LokiClientBase(metaclass=abc.ABCMeta):
 
 
 class LokiClient(LokiClientBase):
+    ENCODINGS = ("json", "protobuf")
+    LATE_POLICIES = ("nudge", "route", "drop")
+    JSON_HEADERS = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+
     def __init__(
-        self, host, user_id, api_key, verify=True, labels: dict = None, **kwargs
+        self,
+        host,
+        user_id,
+        api_key,
+        verify=True,
+        labels: dict = None,
+        encoding: str = "json",
+        spool_dir: str = None,
+        spool_max_bytes: int = 256 * 1024**2,
+        max_in_flight: int = 4,
+        max_connections: int = None,
+        max_keepalive_connections: int = None,
+        keepalive_expiry: float = 30,
+        http2: bool = False,
+        compress_level: int = 9,
+        offload_threshold: int = 64 * 1024,
+        max_retries: int = 5,
+        max_push_rate: float = 20,
+        min_push_rate: float = 0.2,
+        late_policy: str = "nudge",
+        max_label_values: int = 0,
+        label_limits: dict[str, int] = None,
+        label_window: float = 3600,
+        **kwargs,
     ):
+        if encoding not in self.ENCODINGS:
+            raise ValueError(f"不支持的编码格式: {encoding}, 可选: {self.ENCODINGS}")
+        if late_policy not in self.LATE_POLICIES:
+            raise ValueError(f"不支持的迟到策略: {late_policy}, 可选: {self.LATE_POLICIES}")
+        self.encoding = encoding
+        self.compress_level = compress_level
+        # 超过该字节数时在线程池中编码; JSON 格式同时以流的方式发送
+        self.offload_threshold = offload_threshold
+        self.spool = LokiSpool(spool_dir, spool_max_bytes) if spool_dir else None
+        self._replay_task: asyncio.Task | None = None
+        self._pushes: set[asyncio.Task] = set()  # submit / flush 创建的后台推送
         self._labels = dict()
+
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("未安装 h2, Loki 推送退回 HTTP/1.1")
+            http2 = False
+        kwargs.setdefault(
+            "limits",
+            Limits(
+                max_connections=max_connections or max_in_flight,
+                max_keepalive_connections=max_keepalive_connections or max_in_flight,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
         self.client = AsyncClient(
             base_url=f"https://{host}",
             auth=(str(user_id), api_key),
             verify=verify,
+            http2=http2,
             **kwargs,
         )
+
+        # 同时推送的批次上限, 达到上限时 submit 阻塞调用方
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.waiting = 0
+        self.queued_bytes = 0
+
+        # 429/5xx 时的重试次数与 AIMD 速率控制
+        self.max_retries = max_retries
+        self.rate = AimdController(max_rate=max_push_rate, min_rate=min_push_rate)
+        self.dropped_lines = 0  # 重试耗尽且没有 Spool, 或被 Loki 拒绝的日志行
         if labels:
             self._labels.update(labels)
+        # 原始标签指纹 -> (合并全局标签后的标签, 合并后的指纹)
+        self._label_cache: dict[tuple, tuple[dict, tuple]] = {}
+
+        # 每个标签集合已被接受的最大时间戳, 早于它的日志按 late_policy 处理;
+        # 超出 max_high_water 时淘汰最久未更新的标签集合
+        self.late_policy = late_policy
+        self._high_water: OrderedDict[tuple, int] = OrderedDict()
+        self.max_high_water = 65536
+        # 同一标签集合的批次依次发送, 不同标签集合之间并发
+        self._order_locks: dict[tuple, asyncio.Lock] = {}
+        self._order_users: Counter = Counter()
+        self.late_nudged = 0
+        self.late_routed = 0
+        self.late_dropped = 0
+
+        # 标签基数保护, 默认关闭; 配置 max_label_values 或 label_limits 后开启
+        self.label_guard = (
+            LabelGuard(max_label_values, label_limits, label_window)
+            if max_label_values or label_limits
+            else None
+        )
 
     def set_label(self, k: str, v: str) -> None:
         self._labels[k] = v
+        self._label_cache.clear()
 
     def set_labels(self, labels: dict) -> None:
         self._labels.update(labels)
+        self._label_cache.clear()
+
+    def _merged_labels(self, labels: dict) -> tuple[dict, tuple]:
+        fingerprint = label_fingerprint(labels)
+        cached = self._label_cache.get(fingerprint)
+        if cached is None:
+            if len(self._label_cache) > 4096:
+                self._label_cache.clear()
+            merged = {**labels, **self._labels}
+            cached = self._label_cache[fingerprint] = (
+                merged,
+                label_fingerprint(merged),
+            )
+        return cached
+
+    def _coalesce(self, data: list[Stream]) -> dict[tuple, Stream]:
+        merged: dict[tuple, Stream] = {}
+        for s in data:
+            if self.label_guard is not None:
+                s = self._guard(s)
+            labels, fingerprint = self._merged_labels(s.stream)
+            stream = merged.get(fingerprint)
+            if stream is None:
+                stream = merged[fingerprint] = Stream(labels)
+            stream.extend(s)
+        for stream in merged.values():
+            stream.sort()
+        return merged
+
+    def _guard(self, stream: Stream) -> Stream:
+        """超出基数上限的标签折叠进日志行"""
+        kept, folded = self.label_guard.apply(stream.stream, len(stream))
+        if not folded:
+            return stream
+        rest = Stream(kept)
+        rest.timestamps = stream.timestamps
+        rest.lines = [fold_line(line, folded) for line in stream.lines]
+        return rest
+
+    def coalesce(self, data: list[Stream]) -> list[Stream]:
+        """合并标签相同的Stream, 每个标签集合只保留一份, values按时间排序"""
+        return list(self._coalesce(data).values())
+
+    def _advance(self, fingerprint: tuple, stream: Stream, marks: dict) -> None:
+        """将早于高水位的日志时间戳调整为高水位, 新的高水位记入 marks"""
+        ts = stream.timestamps
+        high = self._high_water.get(fingerprint)
+        if high is not None:
+            late = bisect.bisect_left(ts, high)
+            ts[:late] = array("q", [high]) * late
+            self.late_nudged += late
+        if ts:
+            marks[fingerprint] = ts[-1]
+
+    def commit(self, marks: dict[tuple, int]) -> None:
+        """批次被 Loki 接受或写入 Spool 后更新高水位"""
+        for fingerprint, ts in marks.items():
+            self._high_water[fingerprint] = max(
+                ts, self._high_water.get(fingerprint, ts)
+            )
+            self._high_water.move_to_end(fingerprint)
+        while len(self._high_water) > self.max_high_water:
+            self._high_water.popitem(last=False)
+
+    def order(self, merged: dict[tuple, Stream], marks: dict = None) -> list[Stream]:
+        """按每个标签集合的高水位处理迟到的日志, 返回可以发送的Stream
+
+        marks 为 None 时立即更新高水位; 否则新的高水位写入 marks, 由调用方在批次被接受后 commit
+        """
+        pending = {} if marks is None else marks
+        rest = []
+        for fingerprint, stream in merged.items():
+            high = self._high_water.get(fingerprint)
+            late = 0 if high is None else bisect.bisect_left(stream.timestamps, high)
+            if late and self.late_policy != "nudge":
+                late_stream = Stream(stream.stream)
+                late_stream.timestamps = stream.timestamps[:late]
+                late_stream.lines = stream.lines[:late]
+                stream.timestamps = stream.timestamps[late:]
+                stream.lines = stream.lines[late:]
+                if self.late_policy == "drop":
+                    self.late_dropped += late
+                    logger.debug("丢弃迟到的日志 %d 条: %s", late, stream.stream)
+                else:
+                    self.late_routed += late
+                    late_stream.stream = {**stream.stream, "late": "true"}
+                    self._advance(
+                        label_fingerprint(late_stream.stream), late_stream, pending
+                    )
+                    rest.append(late_stream)
+            self._advance(fingerprint, stream, pending)
+            if stream:
+                rest.append(stream)
+        if marks is None:
+            self.commit(pending)
+        return rest
+
+    def metrics(self) -> dict:
+        rest = {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "queued_bytes": self.queued_bytes,
+            "dropped_lines": self.dropped_lines,
+            "late_nudged": self.late_nudged,
+            "late_routed": self.late_routed,
+            "late_dropped": self.late_dropped,
+        }
+        rest.update(self.rate.metrics())
+        if self.label_guard is not None:
+            rest.update(self.label_guard.metrics())
+        if self.spool:
+            rest.update(self.spool.metrics())
+        return rest
+
+    @property
+    def saturated(self) -> bool:
+        """推送并发已达上限, 包括已创建但仍在等待槽位的后台推送"""
+        return self._slots.locked() or len(self._pushes) >= self.max_in_flight
+
+    async def _acquire(self, size: int):
+        self.queued_bytes += size
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            self.queued_bytes -= size
+            raise
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def _release(self, size: int):
+        self.in_flight -= 1
+        self.queued_bytes -= size
+        self._slots.release()
+
+    async def _sleep_without_slot(self, delay: float):
+        """退避期间让出推送槽位, 其他批次可以继续发送; 结束后重新等待槽位"""
+        self.in_flight -= 1
+        self._slots.release()
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+
+    async def _lock_order(self, keys: list[tuple]):
+        """按固定顺序获取标签集合的锁, 同一标签集合的批次依次发送, 保证按顺序到达 Loki.
+
+        应在获取推送槽位之前调用: 持有槽位的批次不会再等待锁, 退避中的批次总能拿回槽位
+        """
+        for key in keys:
+            self._order_users[key] += 1
+            self._order_locks.setdefault(key, asyncio.Lock())
+        acquired = 0
+        try:
+            for key in keys:
+                await self._order_locks[key].acquire()
+                acquired += 1
+        except BaseException:
+            self._unlock_order(keys, acquired)
+            raise
+
+    def _unlock_order(self, keys: list[tuple], acquired: int = None):
+        for key in keys[:acquired]:
+            self._order_locks[key].release()
+        for key in keys:
+            self._order_users[key] -= 1
+            if not self._order_users[key]:
+                del self._order_users[key], self._order_locks[key]
 
     async def a_push(self, data: list[Stream | dict]) -> int:
         """Push消息, 返回成功推送的消息数量"""
+        size = _data_size(data)
+        merged = self._prepare(data)
+        keys = sorted(merged)
+        await self._lock_order(keys)
+        try:
+            await self._acquire(size)
+            try:
+                return await self._push_ordered(merged)
+            finally:
+                self._release(size)
+        finally:
+            self._unlock_order(keys)
+
+    async def submit(self, data: list[Stream]) -> asyncio.Task:
+        """等待前一个相同标签集合的批次与空闲的推送槽位后在后台推送, 达到并发上限时阻塞调用方"""
+        size = _data_size(data)
+        merged = self._prepare(data)
+        keys = sorted(merged)
+        await self._lock_order(keys)
+        try:
+            await self._acquire(size)
+        except BaseException:
+            self._unlock_order(keys)
+            raise
+
+        def done(_):
+            self._release(size)
+            self._unlock_order(keys)
+
+        task = asyncio.create_task(self._push_ordered(merged))
+        task.add_done_callback(done)
+        self._track(task)
+        return task
+
+    def push_nowait(self, data: list[Stream]) -> bool:
+        """不等待槽位的后台推送; 并发已达上限时不推送并返回 False, 由调用方保留或丢弃数据"""
+        if self.saturated:
+            return False
+        self._track(asyncio.create_task(self.a_push(data)))
+        return True
+
+    def _track(self, task: asyncio.Task):
+        self._pushes.add(task)
+        task.add_done_callback(self._pushes.discard)
+
+    async def close(self):
+        """等待进行中的推送完成, 停止 Spool 重放并关闭连接; 未推送成功的段保留在 Spool 中"""
+        if self._pushes:
+            await asyncio.gather(*self._pushes, return_exceptions=True)
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            await asyncio.gather(self._replay_task, return_exceptions=True)
+        await self.client.aclose()
+
+    def _prepare(self, data: list[Stream | dict]) -> dict[tuple, Stream]:
         if not data:
             logger.warning("没有数据 ...")
+            return {}
+        data = [
+            d if isinstance(d, Stream) else StreamModel.model_validate(d).to_stream()
+            for d in data
+            if isinstance(d, (Stream, dict))
+        ]
+        return self._coalesce(data)
+
+    async def _push_ordered(self, merged: dict[tuple, Stream]) -> int:
+        """在持有标签集合锁时编码并发送; 高水位在 Loki 返回 204 或写入 Spool 后才更新"""
+        marks = {}
+        data = self.order(merged, marks)
+        lens_data = sum(len(_) for _ in data)
+        if not lens_data:
             return 0
-        data = [d for d in data if isinstance(d, (Stream, dict))]
-        lens_data = sum(len(_.values) for _ in data)
-        if self._labels:
-            [s.stream.update(self._labels) for s in data]
-        data = {"streams": [i.model_dump() for i in data if isinstance(i, BaseModel)]}
-        data = json.dumps(data, ensure_ascii=False)
-        url = "/loki/api/v1/push"
-        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
-        resp = await self.client.post(
-            url,
-            content=compress(data.encode(), 9),
-            headers=headers,
+        size = _data_size(data)
+        streaming = self.encoding == "json" and size >= self.offload_threshold
+        if streaming:
+            # 大批次: 在线程池中逐块编码压缩, 不在内存中保存完整的请求体
+            headers = self.JSON_HEADERS
+        else:
+            body, headers = await self.a_encode(data, size)
+
+        if self.spool is None:
+            if streaming:
+                body = partial(self._stream_json, data)
+            status = await self._send(body, headers, lens_data)
+            if status == 204:
+                self.commit(marks)
+                return lens_data
+            self.dropped_lines += lens_data
+            return 0
+
+        self._start_replay()
+        segment = await asyncio.to_thread(
+            self.spool.write,
+            gzip_chunks(self.iter_json(data), self.compress_level)
+            if streaming
+            else body,
+            headers,
+            lens_data,
         )
+        # Spool 按写入顺序重放, 写入后即视为被接受
+        self.commit(marks)
+        if self.spool.depth > 1:
+            # 还有更早的段等待重放: 交给重放任务按顺序发送, 不越过它们
+            self.spool.release(segment)
+            return 0
+        if streaming:
+            body = partial(self.spool.aiter_body, segment)
+        status = await self._send(body, headers, lens_data)
+        if status == 204:
+            self.spool.remove(segment)
+            return lens_data
+        if retryable(status):
+            self.spool.release(segment)
+        else:
+            self.spool.remove(segment)
+            self.dropped_lines += lens_data
+        return 0
+
+    def _stream_json(self, data: list[Stream]) -> AsyncIterator[bytes]:
+        """每次调用都重新生成压缩后的 JSON 分块, 重试时可以再次发送"""
+        return self._iter_executor(gzip_chunks(self.iter_json(data), self.compress_level))
+
+    @staticmethod
+    async def _iter_executor(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+        """在线程池中逐块执行同步生成器"""
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def _send(
+        self,
+        body: bytes | Callable[[], AsyncIterator[bytes]],
+        headers: dict,
+        lens_data: int,
+    ) -> int:
+        """按照速率控制发送, 429/5xx/网络错误时以抖动退避重试同一批次, 返回最后的状态码
+
+        调用方持有一个推送槽位, 退避等待期间暂时让出
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.rate.wait()
+            status, retry_after = await self._post(body, headers, lens_data)
+            if status == 204:
+                self.rate.on_success()
+                return status
+            if not retryable(status):
+                return status
+            if status != 0:
+                self.rate.on_throttle(retry_after)
+            if attempt < self.max_retries:
+                self.rate.retries += 1
+                await self._sleep_without_slot(
+                    max(retry_after, self.rate.backoff(attempt))
+                )
+        return status
+
+    async def _post(
+        self,
+        body: bytes | Callable[[], AsyncIterator[bytes]],
+        headers: dict,
+        lens_data: int,
+    ) -> tuple[int, float]:
+        """发送已编码的请求体, body 为可调用对象时以流的方式发送.
+
+        返回 (状态码, Retry-After 秒数), 网络错误时状态码为0
+        """
+        url = "/loki/api/v1/push"
+        content = body if isinstance(body, bytes) else body()
+        try:
+            resp = await self.client.post(url, content=content, headers=headers)
+        except HTTPError as _e:
+            logger.warning("loki push Error: %r, lines: %d", _e, lens_data)
+            return 0, 0
         if resp.status_code == 204:
             logger.debug(
-                "Pushed Success: %d, data size: %d, compressed size: %d",
+                "Pushed Success: %d, encoding: %s, compressed size: %s",
                 lens_data,
-                len(data),
-                len(resp.request.content),
+                self.encoding,
+                len(body) if isinstance(body, bytes) else "stream",
             )
-            return lens_data
+            return 204, 0
         logger.warning(
-            "loki push Error, code %d, Msg: %s\n%s",
+            "loki push Error, code %d, Msg: %s, lines: %d",
             resp.status_code,
-            resp.text,
-            data,
+            resp.text[:500],
+            lens_data,
         )
-        return 0
+        return resp.status_code, parse_retry_after(resp.headers.get("Retry-After"))
+
+    def start(self):
+        """在事件循环中调用: Spool 中有上次退出时遗留的段时立即开始重放, 不等待新的推送"""
+        if self.spool is not None and self.spool.depth:
+            self._start_replay()
+
+    def _start_replay(self):
+        if self._replay_task is None or self._replay_task.done():
+            self._replay_task = asyncio.create_task(
+                self.replay_spool(), name=f"loki_spool_replay_{id(self)}"
+            )
+
+    async def replay_spool(self, retry_interval=5):
+        """重放Spool中推送失败的段, 成功时不等待直接处理下一个"""
+        logger.info("启动 Spool 重放: %s", self.spool.directory)
+        while True:
+            segments = self.spool.pending()
+            if not segments:
+                await self.spool.wait()
+                continue
+            for name in segments:
+                if not self.spool.acquire(name):
+                    continue
+                headers, lines = await asyncio.to_thread(self.spool.read_meta, name)
+                size = self.spool.segment_size(name)
+                await self._acquire(size)
+                try:
+                    body = partial(self.spool.aiter_body, name)
+                    status = await self._send(body, headers, lines)
+                finally:
+                    self._release(size)
+                if status == 204:
+                    self.spool.remove(name)
+                    continue
+                if not retryable(status):
+                    self.spool.remove(name)
+                    self.dropped_lines += lines
+                    continue
+                self.spool.release(name)
+                await asyncio.sleep(retry_interval)
+                break
+
+    @staticmethod
+    def iter_json(data: list[Stream], chunk_lines: int = 1000) -> Iterator[bytes]:
+        """分块生成 Loki JSON 格式的请求体(未压缩), 每块最多 chunk_lines 行"""
+        yield b'{"streams": ['
+        for i, s in enumerate(data):
+            head = json.dumps(s.stream, ensure_ascii=False)
+            yield f'{", " if i else ""}{{"stream": {head}, "values": ['.encode()
+            for j in range(0, len(s), chunk_lines):
+                values = zip(
+                    map(str, s.timestamps[j : j + chunk_lines]),
+                    s.lines[j : j + chunk_lines],
+                )
+                chunk = json.dumps(list(values), ensure_ascii=False)[1:-1]
+                yield (", " + chunk if j else chunk).encode()
+            yield b"]}"
+        yield b"]}"
+
+    @classmethod
+    def serialize_json(cls, data: list[Stream]) -> bytes:
+        """Loki JSON 格式的请求体(未压缩)"""
+        return b"".join(cls.iter_json(data))
+
+    @classmethod
+    def encode_json(cls, data: list[Stream], level: int = 9) -> tuple[bytes, dict]:
+        """JSON + gzip 编码, 返回 (请求体, 请求头)"""
+        return b"".join(gzip_chunks(cls.iter_json(data), level)), cls.JSON_HEADERS
+
+    @staticmethod
+    def encode_protobuf(data: list[Stream], level: int = 6) -> tuple[bytes, dict]:
+        """protobuf + snappy 编码, 没有安装 snappy 时外层再使用 gzip 压缩"""
+        body, compressed = snappy_block(
+            encode_push_request((s.stream, zip(s.timestamps, s.lines)) for s in data)
+        )
+        headers = {"Content-Type": "application/x-protobuf"}
+        if not compressed:
+            body = compress(body, level)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    def encode(self, data: list[Stream]) -> tuple[bytes, dict]:
+        """按照配置的编码格式与压缩级别编码"""
+        if self.encoding == "protobuf":
+            return self.encode_protobuf(data, self.compress_level)
+        return self.encode_json(data, self.compress_level)
+
+    async def a_encode(self, data: list[Stream], size: int) -> tuple[bytes, dict]:
+        """批次较大时在线程池中编码与压缩, 避免阻塞事件循环"""
+        if size < self.offload_threshold:
+            return self.encode(data)
+        return await asyncio.get_running_loop().run_in_executor(None, self.encode, data)
 
 
 class LokiPush(LokiClient):
@@ -104,35 +711,137 @@ class LokiPush(LokiClient):
 
 
 class LokiBufferPush(LokiClient):
-    def __init__(self, capacity, host, user_id, api_key, flush_timeout=5, **kwargs):
+    """按 Stream 数量、日志行数、估算字节数与最大等待时间分批推送"""
+
+    def __init__(
+        self,
+        capacity,
+        host,
+        user_id,
+        api_key,
+        flush_timeout=5,
+        max_lines=5000,
+        max_bytes=1024**2,
+        **kwargs,
+    ):
         super().__init__(host, user_id, api_key, **kwargs)
 
         self.capacity = capacity
-        self.last_flush = time.time()
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
         self.flush_timeout = flush_timeout
-        self.buffer = asyncio.Queue()
+        self.buffer: list[Stream] = []
+        self.buffer_lines = 0
+        self.buffer_bytes = 0
+        self.oldest = None  # 缓存中最早一条数据的写入时间 (monotonic)
+        self._not_empty = asyncio.Event()
+        self._flusher: asyncio.Task | None = None
+
+    def metrics(self) -> dict:
+        rest = super().metrics()
+        rest.update(
+            buffer_streams=len(self.buffer),
+            buffer_lines=self.buffer_lines,
+            buffer_bytes=self.buffer_bytes,
+        )
+        return rest
+
+    def _append(self, data: Stream) -> bool:
+        """加入缓存, 返回是否需要先推送已有的缓存"""
+        size = estimate_size(data)
+        overflow = bool(self.buffer) and (
+            self.buffer_bytes + size > self.batch_bytes
+            or self.buffer_lines + len(data) > self.batch_lines
+        )
+        if overflow:
+            return True
+        if not self.buffer:
+            self.oldest = time.monotonic()
+            self._not_empty.set()
+        self.buffer.append(data)
+        self.buffer_lines += len(data)
+        self.buffer_bytes += size
+        return False
 
     def put_nowait(self, data: Stream):
-        self.buffer.put_nowait(data)
+        """缓存已满且推送并发已达上限时抛出 asyncio.QueueFull, 由调用方丢弃或改用 put 等待"""
+        if self._append(data):
+            if not self.flush():
+                raise asyncio.QueueFull
+            self._append(data)
         if self.should_flush():
             self.flush()
 
     async def put(self, data: Stream):
-        await self.buffer.put(data)
+        self._start_flusher()
+        if self._append(data):
+            await self.a_flush()
+            self._append(data)
         if self.should_flush():
-            self.flush()
+            await self.a_flush()
+
+    @property
+    def batch_lines(self) -> int:
+        """被限流时按比例缩小的批次行数上限"""
+        return max(1, int(self.max_lines * self.rate.batch_scale))
+
+    @property
+    def batch_bytes(self) -> int:
+        return max(1, int(self.max_bytes * self.rate.batch_scale))
 
     def should_flush(self) -> bool:
-        return (
-            self.buffer.qsize() >= self.capacity
-            or time.time() - self.last_flush > self.flush_timeout
+        return bool(self.buffer) and (
+            len(self.buffer) >= self.capacity
+            or self.buffer_lines >= self.batch_lines
+            or self.buffer_bytes >= self.batch_bytes
+            or time.monotonic() - self.oldest >= self.flush_timeout
         )
 
     def get_buffer(self) -> list:
-        return [self.buffer.get_nowait() for _ in range(self.buffer.qsize())]
+        buffer, self.buffer = self.buffer, []
+        self.buffer_lines = self.buffer_bytes = 0
+        self.oldest = None
+        self._not_empty.clear()
+        return buffer
 
-    def flush(self):
+    def flush(self) -> bool:
+        """在后台推送缓存; 并发已达上限时保留缓存并返回 False"""
         try:
-            asyncio.create_task(self.a_push(self.get_buffer()))
+            asyncio.get_running_loop()
         except RuntimeError:
             self.push(self.get_buffer())
+            return True
+        if self.saturated:
+            return False
+        return self.push_nowait(self.get_buffer())
+
+    async def a_flush(self):
+        """推送缓存, 并发达到上限时等待"""
+        await self.submit(self.get_buffer())
+
+    async def close(self):
+        """推送缓存中剩余的数据后关闭"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        if self.buffer:
+            await self.a_flush()
+        await super().close()
+
+    def _start_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(
+                self._flush_timer(), name=f"loki_flusher_{id(self)}"
+            )
+
+    async def _flush_timer(self):
+        """没有新数据时也保证缓存不会超过 flush_timeout 秒"""
+        while True:
+            if not self.buffer:
+                await self._not_empty.wait()
+                continue
+            delay = self.oldest + self.flush_timeout - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await self.a_flush()
@@ -5,3 +5,620 @@
 @Author     : LeeCQ
 @Date-Time  : 2023/9/10 14:20
 """
+import asyncio
+import gzip
+import json
+
+import httpx
+import pytest
+
+from .client_loki import LokiBufferPush, LokiClient, Stream
+from .loki_proto import encode_push_request, format_labels, snappy_literal_block
+
+
+def _read_varint(buf: bytes, pos: int) -> tuple[int, int]:
+    shift = result = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf: bytes) -> list[tuple[int, int | bytes]]:
+    """最简单的 protobuf 解码, 只支持 varint 与 length-delimited"""
+    pos, rest = 0, []
+    while pos < len(buf):
+        key, pos = _read_varint(buf, pos)
+        if key & 7 == 0:
+            value, pos = _read_varint(buf, pos)
+        else:
+            size, pos = _read_varint(buf, pos)
+            value, pos = buf[pos : pos + size], pos + size
+        rest.append((key >> 3, value))
+    return rest
+
+
+def _unsnappy_literal(buf: bytes) -> bytes:
+    size, pos = _read_varint(buf, 0)
+    out = bytearray()
+    while pos < len(buf):
+        n = buf[pos] >> 2
+        pos += 1
+        if n >= 60:
+            extra = n - 59
+            n = int.from_bytes(buf[pos : pos + extra], "little")
+            pos += extra
+        out += buf[pos : pos + n + 1]
+        pos += n + 1
+    assert len(out) == size
+    return bytes(out)
+
+
+def decode_push_request(body: bytes) -> list[tuple[str, list[tuple[int, str]]]]:
+    streams = []
+    for _, stream in _fields(body):
+        labels, entries = "", []
+        for num, value in _fields(stream):
+            if num == 1:
+                labels = value.decode()
+                continue
+            ts, line = dict(), ""
+            for e_num, e_value in _fields(value):
+                if e_num == 1:
+                    ts = dict(_fields(e_value))
+                else:
+                    line = e_value.decode()
+            entries.append((ts.get(1, 0) * 1_000_000_000 + ts.get(2, 0), line))
+        streams.append((labels, entries))
+    return streams
+
+
+def test_format_labels():
+    assert format_labels({"b": 'x"y', "a": "1\n"}) == '{a="1\\n", b="x\\"y"}'
+
+
+def test_encode_push_request():
+    body = encode_push_request(
+        [({"type": "traffic"}, [("1694329200000000001", "上行"), (5, "")])]
+    )
+    assert decode_push_request(body) == [
+        ('{type="traffic"}', [(1694329200000000001, "上行"), (5, "")])
+    ]
+
+
+def test_snappy_literal_block():
+    for size in (0, 1, 60, 61, 300, 70000):
+        data = bytes(i % 251 for i in range(size))
+        assert _unsnappy_literal(snappy_literal_block(data)) == data
+
+
+def _mock_client(encoding: str, requests: list, **kwargs) -> LokiClient:
+    def handler(request: httpx.Request):
+        requests.append(request)
+        return httpx.Response(204)
+
+    return LokiClient(
+        "loki.test",
+        1,
+        "key",
+        encoding=encoding,
+        transport=httpx.MockTransport(handler),
+        **kwargs,
+    )
+
+
+def test_a_push_protobuf(monkeypatch):
+    monkeypatch.setattr("grafana.loki_proto.snappy", None)
+    requests = []
+    client = _mock_client("protobuf", requests, labels={"app": "test"})
+    data = [Stream(stream={"type": "logs"}, values=[("1000000000", "hello")])]
+
+    assert asyncio.run(client.a_push(data)) == 1
+    request = requests[0]
+    assert request.headers["Content-Type"] == "application/x-protobuf"
+    assert request.headers["Content-Encoding"] == "gzip"
+    body = _unsnappy_literal(gzip.decompress(request.content))
+    assert decode_push_request(body) == [
+        ('{app="test", type="logs"}', [(1000000000, "hello")])
+    ]
+
+
+def test_a_push_json():
+    requests = []
+    client = _mock_client("json", requests)
+    data = [Stream(stream={"type": "logs"}, values=[("1000000000", "hello")])]
+
+    assert asyncio.run(client.a_push(data)) == 1
+    payload = json.loads(gzip.decompress(requests[0].content))
+    assert payload == {
+        "streams": [{"stream": {"type": "logs"}, "values": [["1000000000", "hello"]]}]
+    }
+
+
+def test_coalesce():
+    client = LokiClient("loki.test", 1, "key", labels={"app": "test"})
+    data = [
+        Stream(stream={"type": "ping", "target": "a"}, values=[("3", "c")]),
+        Stream(stream={"target": "a", "type": "ping"}, values=[("1", "a")]),
+        Stream(stream={"type": "ping", "target": "b"}, values=[("2", "b")]),
+        Stream(stream={"type": "ping", "target": "a"}, values=[("2", "b")]),
+    ]
+    streams = client.coalesce(data)
+
+    assert [(s.stream, list(s.timestamps), s.lines) for s in streams] == [
+        ({"type": "ping", "target": "a", "app": "test"}, [1, 2, 3], ["a", "b", "c"]),
+        ({"type": "ping", "target": "b", "app": "test"}, [2], ["b"]),
+    ]
+    assert data[0].stream == {"type": "ping", "target": "a"}
+
+
+def test_a_push_spool_replay(tmp_path):
+    status = [500, 204]
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        return httpx.Response(status.pop(0) if status else 204)
+
+    async def main():
+        client = LokiClient(
+            "loki.test",
+            1,
+            "key",
+            spool_dir=tmp_path,
+            max_retries=0,
+            transport=httpx.MockTransport(handler),
+        )
+        data = [Stream(stream={"type": "logs"}, values=[("1", "hello")])]
+        assert await client.a_push(data) == 0
+        assert client.metrics()["spool_depth"] == 1
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if client.metrics()["spool_depth"] == 0:
+                break
+        client._replay_task.cancel()
+        return client
+
+    client = asyncio.run(main())
+    assert client.metrics()["spool_depth"] == 0
+    assert len(requests) == 2
+    assert requests[0].content == requests[1].content
+
+
+def test_spool_replay_on_start(tmp_path):
+    status = [500]
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        return httpx.Response(status.pop(0) if status else 204)
+
+    def client() -> LokiClient:
+        return LokiClient(
+            "loki.test",
+            1,
+            "key",
+            spool_dir=tmp_path,
+            max_retries=0,
+            transport=httpx.MockTransport(handler),
+        )
+
+    async def main():
+        first = client()
+        data = [Stream(stream={"type": "logs"}, values=[("1", "hello")])]
+        assert await first.a_push(data) == 0
+        await first.close()
+
+        # 重启后没有新的推送, 遗留的段也会被重放
+        second = client()
+        assert second.metrics()["spool_depth"] == 1
+        second.start()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if second.metrics()["spool_depth"] == 0:
+                break
+        await second.close()
+        return second
+
+    second = asyncio.run(main())
+    assert second.metrics()["spool_depth"] == 0
+    assert len(requests) == 2
+
+
+def _gauges(client: LokiClient) -> dict:
+    metrics = client.metrics()
+    return {k: metrics[k] for k in ("in_flight", "waiting", "queued_bytes")}
+
+
+def test_submit_backpressure():
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(request: httpx.Request):
+            await gate.wait()
+            return httpx.Response(204)
+
+        client = LokiClient(
+            "loki.test",
+            1,
+            "key",
+            max_in_flight=2,
+            transport=httpx.MockTransport(handler),
+        )
+        # 不同的标签集合之间并发推送
+        data = [
+            [Stream(stream={"type": f"logs{i}"}, values=[("1", "hello")])]
+            for i in range(3)
+        ]
+        tasks = [await client.submit(data[0]), await client.submit(data[1])]
+        assert client.saturated
+        blocked = asyncio.create_task(client.submit(data[2]))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        assert _gauges(client) == {"in_flight": 2, "waiting": 1, "queued_bytes": 15}
+
+        gate.set()
+        tasks.append(await blocked)
+        assert await asyncio.gather(*tasks) == [1, 1, 1]
+        assert _gauges(client) == {"in_flight": 0, "waiting": 0, "queued_bytes": 0}
+
+    asyncio.run(main())
+
+
+def test_push_in_order():
+    """同一标签集合的批次在前一个被接受后才发送, 退避时不会被后面的批次超过"""
+    status = [503]
+    requests = []
+
+    async def handler(request: httpx.Request):
+        payload = json.loads(gzip.decompress(request.content))
+        requests.append(payload["streams"][0]["values"][0][1])
+        await asyncio.sleep(0.01)
+        return httpx.Response(status.pop(0) if status else 204)
+
+    async def main():
+        client = LokiClient(
+            "loki.test",
+            1,
+            "key",
+            max_in_flight=4,
+            transport=httpx.MockTransport(handler),
+        )
+        client.rate.backoff = lambda attempt: 0.05
+        tasks = [
+            await client.submit([Stream({"type": "logs"}, [(i, str(i))])])
+            for i in range(3)
+        ]
+        other = await client.submit([Stream({"type": "other"}, [(1, "x")])])
+        assert await asyncio.gather(*tasks, other) == [1, 1, 1, 1]
+        await client.close()
+        return client
+
+    client = asyncio.run(main())
+    assert requests[0] == "0"
+    assert [r for r in requests if r != "x"] == ["0", "0", "1", "2"]
+    assert client.late_nudged == 0
+    assert not client._order_locks
+
+
+def test_high_water_after_accept():
+    status = [400, 204, 204, 204]
+
+    def handler(request: httpx.Request):
+        return httpx.Response(status.pop(0))
+
+    async def main():
+        client = LokiClient(
+            "loki.test", 1, "key", transport=httpx.MockTransport(handler)
+        )
+        client.max_high_water = 1
+        # 被拒绝的批次不移动高水位
+        assert await client.a_push([Stream({"type": "a"}, [(20, "x")])]) == 0
+        assert await client.a_push([Stream({"type": "a"}, [(10, "y")])]) == 1
+        assert client.late_nudged == 0
+        await client.a_push([Stream({"type": "a"}, [(5, "z")])])
+        assert client.late_nudged == 1
+        # 超出上限时淘汰最久未更新的标签集合
+        await client.a_push([Stream({"type": "b"}, [(1, "b")])])
+        return list(client._high_water.items())
+
+    assert asyncio.run(main()) == [((("type", "b"),), 1)]
+
+
+def test_spool_backlog_in_order(tmp_path):
+    """Spool 中有等待重放的段时, 新的批次排在它们后面由重放任务发送"""
+    status = [500]
+    requests = []
+
+    def handler(request: httpx.Request):
+        payload = json.loads(gzip.decompress(request.content))
+        requests.append(payload["streams"][0]["values"][0][1])
+        return httpx.Response(status.pop(0) if status else 204)
+
+    async def main():
+        client = LokiClient(
+            "loki.test",
+            1,
+            "key",
+            spool_dir=tmp_path,
+            max_retries=0,
+            transport=httpx.MockTransport(handler),
+        )
+        for line in ("a", "b"):
+            assert await client.a_push([Stream({"type": "logs"}, [(1, line)])]) == 0
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if client.metrics()["spool_depth"] == 0:
+                break
+        await client.close()
+
+    asyncio.run(main())
+    assert requests == ["a", "a", "b"]
+
+
+def test_buffer_push_nowait_saturated():
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(request: httpx.Request):
+            await gate.wait()
+            return httpx.Response(204)
+
+        client = LokiBufferPush(
+            100,
+            "loki.test",
+            1,
+            "key",
+            max_lines=1,
+            max_in_flight=1,
+            transport=httpx.MockTransport(handler),
+        )
+        client.put_nowait(Stream({"type": "logs"}, [(1, "a")]))  # 满一批, 后台推送
+        assert client.saturated
+        assert not client.push_nowait([Stream({"type": "logs"}, [(2, "b")])])
+        client.put_nowait(Stream({"type": "logs"}, [(3, "c")]))  # 留在缓存
+        with pytest.raises(asyncio.QueueFull):
+            client.put_nowait(Stream({"type": "logs"}, [(4, "d")]))
+        assert len(client._pushes) == 1
+        assert client.buffer_lines == 1
+
+        gate.set()
+        await client.close()
+        return client.metrics()
+
+    metrics = asyncio.run(main())
+    assert metrics["buffer_lines"] == 0
+
+
+def test_stream():
+    stream = Stream({"type": "logs"}, [("3", "c"), (1, "a")])
+    stream.append(2, "b")
+    stream.sort()
+
+    assert len(stream) == 3
+    assert stream.values == [("1", "a"), ("2", "b"), ("3", "c")]
+    assert stream.model_dump() == {
+        "stream": {"type": "logs"},
+        "values": [["1", "a"], ["2", "b"], ["3", "c"]],
+    }
+
+
+def test_a_push_dict():
+    requests = []
+    client = _mock_client("json", requests)
+    data = [{"stream": {"type": "logs"}, "values": [["1", "hello"]]}]
+
+    assert asyncio.run(client.a_push(data)) == 1
+    payload = json.loads(gzip.decompress(requests[0].content))
+    assert payload["streams"][0]["values"] == [["1", "hello"]]
+
+
+def _buffer_push(requests: list, **kwargs) -> LokiBufferPush:
+    def handler(request: httpx.Request):
+        requests.append(json.loads(gzip.decompress(request.content)))
+        return httpx.Response(204)
+
+    return LokiBufferPush(
+        100,
+        "loki.test",
+        1,
+        "key",
+        transport=httpx.MockTransport(handler),
+        **kwargs,
+    )
+
+
+def test_buffer_push_max_bytes():
+    async def main():
+        requests = []
+        client = _buffer_push(requests, max_bytes=250)
+        for i in range(3):
+            await client.put(Stream({"type": "logs"}, [(i, "x" * 60)]))
+        await asyncio.sleep(0.01)
+        return requests, client.metrics()
+
+    requests, metrics = asyncio.run(main())
+    assert [len(r["streams"][0]["values"]) for r in requests] == [2]
+    assert metrics["buffer_streams"] == 1 and metrics["buffer_lines"] == 1
+
+
+def test_buffer_push_flush_timeout():
+    async def main():
+        requests = []
+        client = _buffer_push(requests, flush_timeout=0.05)
+        await client.put(Stream({"type": "logs"}, [(1, "hello")]))
+        await asyncio.sleep(0.01)
+        assert requests == []
+        await asyncio.sleep(0.1)
+        client._flusher.cancel()
+        return requests
+
+    requests = asyncio.run(main())
+    assert requests[0]["streams"][0]["values"] == [["1", "hello"]]
+
+
+def test_iter_json_chunks():
+    data = [
+        Stream({"type": "a"}, [(i, f"行{i}") for i in range(5)]),
+        Stream({"type": "b"}),
+        Stream({"type": "c"}, [(9, '"')]),
+    ]
+    expected = {"streams": [s.model_dump() for s in data]}
+
+    assert json.loads(b"".join(LokiClient.iter_json(data, chunk_lines=2))) == expected
+    body, _ = LokiClient.encode_json(data, level=1)
+    assert json.loads(gzip.decompress(body)) == expected
+
+
+def test_a_encode_offload():
+    client = LokiClient("loki.test", 1, "key", compress_level=1, offload_threshold=0)
+    data = [Stream({"type": "logs"}, [(1, "hello")])]
+
+    body, headers = asyncio.run(client.a_encode(data, 5))
+    assert headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body))["streams"][0]["values"] == [["1", "hello"]]
+
+
+def test_a_push_streaming_body(tmp_path):
+    bodies = []
+
+    async def handler(request: httpx.Request):
+        assert "Content-Length" not in request.headers
+        bodies.append(json.loads(gzip.decompress(await request.aread())))
+        return httpx.Response(204)
+
+    async def main(**kwargs):
+        client = LokiClient(
+            "loki.test",
+            1,
+            "key",
+            offload_threshold=0,
+            transport=httpx.MockTransport(handler),
+            **kwargs,
+        )
+        data = [Stream({"type": "logs"}, [(i, "x" * 100) for i in range(3000)])]
+        return await client.a_push(data)
+
+    assert asyncio.run(main()) == 3000
+    assert asyncio.run(main(spool_dir=tmp_path)) == 3000
+    assert [len(b["streams"][0]["values"]) for b in bodies] == [3000, 3000]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_a_push_retry_after(monkeypatch):
+    monkeypatch.setattr("grafana.rate_control.random.uniform", lambda a, b: 0)
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "0.05"}),
+        httpx.Response(503),
+        httpx.Response(204),
+    ]
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request.content)
+        return responses.pop(0)
+
+    client = LokiClient("loki.test", 1, "key", transport=httpx.MockTransport(handler))
+    data = [Stream({"type": "logs"}, [(1, "hello")])]
+
+    assert asyncio.run(client.a_push(data)) == 1
+    assert len(requests) == 3 and requests[0] == requests[2]
+    metrics = client.metrics()
+    assert metrics["throttled_total"] == 2 and metrics["retries"] == 2
+    assert metrics["send_rate"] == 6.0  # 20 * 0.5 * 0.5 + 1
+
+
+def test_backoff_releases_slot(monkeypatch):
+    monkeypatch.setattr("grafana.rate_control.random.uniform", lambda a, b: 0.2)
+    order = []
+
+    def handler(request: httpx.Request):
+        line = json.loads(gzip.decompress(request.content))["streams"][0]["values"][0][1]
+        order.append(line)
+        if line == "slow" and order.count("slow") == 1:
+            return httpx.Response(503)
+        return httpx.Response(204)
+
+    async def main():
+        client = LokiClient(
+            "loki.test",
+            1,
+            "key",
+            max_in_flight=1,
+            max_push_rate=1000,
+            transport=httpx.MockTransport(handler),
+        )
+        slow = asyncio.create_task(client.a_push([Stream({"a": "1"}, [(1, "slow")])]))
+        await asyncio.sleep(0.05)
+        # 第一个批次退避期间不占用唯一的槽位
+        assert await asyncio.wait_for(
+            client.a_push([Stream({"a": "2"}, [(1, "fast")])]), 0.1
+        ) == 1
+        assert await slow == 1
+        return client.metrics()
+
+    metrics = asyncio.run(main())
+    assert order == ["slow", "fast", "slow"]
+    assert metrics["in_flight"] == 0 and metrics["retries"] == 1
+
+
+def test_a_push_rejected_not_retried():
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        return httpx.Response(400, text="entry too far behind")
+
+    client = LokiClient("loki.test", 1, "key", transport=httpx.MockTransport(handler))
+
+    assert asyncio.run(client.a_push([Stream({"type": "logs"}, [(1, "x")])])) == 0
+    assert len(requests) == 1
+    assert client.metrics()["dropped_lines"] == 1
+
+
+def _late_batches(policy: str) -> tuple[LokiClient, list[Stream]]:
+    client = LokiClient("loki.test", 1, "key", late_policy=policy)
+    client.order(client._coalesce([Stream({"type": "logs"}, [(10, "a"), (20, "b")])]))
+    data = [Stream({"type": "logs"}, [(25, "e"), (5, "c"), (20, "d")])]
+    return client, client.order(client._coalesce(data))
+
+
+def test_order_late_nudge():
+    client, streams = _late_batches("nudge")
+    assert [(s.stream, list(s.timestamps), s.lines) for s in streams] == [
+        ({"type": "logs"}, [20, 20, 25], ["c", "d", "e"])
+    ]
+    assert client.late_nudged == 1
+
+
+def test_order_late_route():
+    client, streams = _late_batches("route")
+    assert [(s.stream, list(s.timestamps), s.lines) for s in streams] == [
+        ({"type": "logs", "late": "true"}, [5], ["c"]),
+        ({"type": "logs"}, [20, 25], ["d", "e"]),
+    ]
+    assert client.late_routed == 1
+
+
+def test_order_late_drop():
+    client, streams = _late_batches("drop")
+    assert [s.lines for s in streams] == [["d", "e"]]
+    assert client.metrics()["late_dropped"] == 1
+
+
+def test_coalesce_label_guard():
+    client = LokiClient("loki.test", 1, "key", label_limits={"target": 1})
+    data = [
+        Stream({"type": "ping", "target": "a"}, [(1, "1.5")]),
+        Stream({"type": "ping", "target": "b"}, [(2, "2.5")]),
+    ]
+    streams = client.coalesce(data)
+
+    assert [(s.stream, s.lines) for s in streams] == [
+        ({"type": "ping", "target": "a"}, ["1.5"]),
+        ({"type": "ping"}, ['target="b" 2.5']),
+    ]
+    assert client.metrics()["label_cardinality_top"] == {"type": 1, "target": 1}
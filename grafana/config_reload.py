@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : config_reload.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/25 21:00
+
+收到 SIGHUP 或配置文件发生变化时重新加载 to_loki 配置.
+
+只有变化的输入、输出会被启动或停止, 其余部分与队列中的数据不受影响.
+新配置无法解析或创建失败时继续使用原配置.
+"""
+import asyncio
+import logging
+import signal
+from pathlib import Path
+
+import yaml
+
+from .push import Handler
+
+logger = logging.getLogger("host-service.grafana.config-reload")
+
+
+class ConfigReloader:
+    def __init__(self, path, handler: Handler, interval: float = 2):
+        """
+        :param interval: 检查配置文件修改时间的间隔(秒), 0 为只响应 SIGHUP
+        """
+        self.path = Path(path)
+        self.handler = handler
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self._signal = asyncio.Event()
+        self._stat = self._file_stat()
+
+    def _file_stat(self) -> tuple[int, int] | None:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self) -> dict:
+        return yaml.safe_load(self.path.read_text(encoding="utf8"))
+
+    async def reload(self) -> bool:
+        try:
+            config = await asyncio.to_thread(self.load)
+            if config.get("workers", 1) != 1:
+                logger.warning("workers 的修改需要重启进程才能生效")
+            await self.handler.reload(config)
+        except Exception as _e:
+            self.failures += 1
+            logger.error("重新加载配置 %s 失败, 继续使用原配置: %s", self.path, _e, exc_info=True)
+            return False
+        self.reloads += 1
+        logger.info("已重新加载配置 %s", self.path)
+        return True
+
+    def _changed(self) -> bool:
+        stat = self._file_stat()
+        if stat is None or stat == self._stat:
+            return False
+        self._stat = stat
+        return True
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self._signal.set)
+        except (NotImplementedError, AttributeError):
+            logger.info("当前平台不支持 SIGHUP, 只在配置文件修改时重新加载")
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._signal.wait(), self.interval or None)
+                except asyncio.TimeoutError:
+                    pass
+                by_signal = self._signal.is_set()
+                self._signal.clear()
+                if self._changed() or by_signal:
+                    await self.reload()
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGHUP)
+            except (NotImplementedError, AttributeError):
+                pass
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : config_reload_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/25 21:20
+"""
+import asyncio
+import os
+import signal
+
+import pytest
+import yaml
+
+from .config_reload import ConfigReloader
+from .push import Handler, InputBase
+
+
+class Recorder:
+    __output_type__ = "recorder"
+    closed = []
+    events = []
+
+    def __init__(self, name: str, filename: str = None):
+        self.name = name
+        self.received = []
+        Recorder.events.append(("create", name))
+
+    async def put(self, data):
+        self.received.append(data)
+
+    async def close(self):
+        await asyncio.sleep(0.05)
+        Recorder.closed.append(self.name)
+        Recorder.events.append(("close", self.name))
+
+
+class Counter(InputBase):
+    __input_type__ = "counter"
+    started = []
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def to_handle(self, queue):
+        Counter.started.append(self.name)
+        n = 0
+        while True:
+            await queue.put(f"{self.name}-{n}")
+            n += 1
+            await asyncio.sleep(0.01)
+
+
+def test_reload_diff(tmp_path, monkeypatch):
+    monkeypatch.setattr(Handler, "input_class", {"counter": Counter})
+    monkeypatch.setattr(Handler, "output_class", {"recorder": Recorder})
+    path = tmp_path / "config.yml"
+
+    def write(inputs, outputs):
+        config = {
+            "inputs": [{"type": "counter", "name": n} for n in inputs],
+            "outputs": [{"type": "recorder", "name": n} for n in outputs],
+        }
+        path.write_text(yaml.safe_dump(config))
+        return config
+
+    async def main():
+        handler = Handler.from_config(write(["a"], ["keep", "old"]))
+        keep = handler.outputs[0]
+        reloader = ConfigReloader(path, handler, interval=0.02)
+        tasks = [asyncio.create_task(handler.start()), asyncio.create_task(reloader.run())]
+        await asyncio.sleep(0.1)
+
+        write(["a", "b"], ["keep", "new"])
+        os.utime(path, ns=(1, 1))  # 确保修改时间变化
+        await asyncio.sleep(0.1)
+        assert Counter.started == ["a", "b"]  # a 没有被重启
+        assert handler.outputs[0] is keep
+        assert [o.name for o in handler.outputs] == ["keep", "new"]
+        assert Recorder.closed == ["old"]
+
+        path.write_text("inputs: [")  # 无法解析的配置
+        os.kill(os.getpid(), signal.SIGHUP)
+        await asyncio.sleep(0.1)
+        assert reloader.failures == 1 and reloader.reloads == 1
+        assert len(handler.inputs) == 2
+
+        await handler.supervisor.stop()
+        for t in tasks:
+            t.cancel()
+        for q in handler.output_queues:
+            q.task.cancel()
+        return keep, handler.outputs[1]
+
+    keep, new = asyncio.run(main())
+    assert any(d.startswith("b-") for d in new.received)
+    received = [d for d in keep.received if d.startswith("a-")]
+    assert received == [f"a-{n}" for n in range(len(received))]  # 没有中断
+
+
+def test_reload_same_path(monkeypatch):
+    """使用相同文件的新输出在旧输出关闭后才创建, 期间的数据暂存在它的队列中"""
+    monkeypatch.setattr(Handler, "input_class", {"counter": Counter})
+    monkeypatch.setattr(Handler, "output_class", {"recorder": Recorder})
+    Recorder.events.clear()
+
+    def config(name: str) -> dict:
+        return {
+            "inputs": [{"type": "counter", "name": "c"}],
+            "outputs": [{"type": "recorder", "name": name, "filename": "out.log"}],
+        }
+
+    async def main():
+        handler = Handler.from_config(config("x"))
+        old = handler.outputs[0]
+        task = asyncio.create_task(handler.start())
+        await asyncio.sleep(0.05)
+        await handler.reload(config("y"))
+        assert Recorder.events == [("create", "x")]
+        await asyncio.sleep(0.2)
+        assert Recorder.events == [("create", "x"), ("close", "x"), ("create", "y")]
+        await handler.supervisor.stop()
+        task.cancel()
+        for q in handler.output_queues:
+            q.task.cancel()
+        return old, handler.outputs
+
+    old, outputs = asyncio.run(main())
+    assert [o.name for o in outputs] == ["y"]
+    received = old.received + outputs[0].received
+    assert received == [f"c-{n}" for n in range(len(received))]  # 切换期间没有丢失数据
+
+
+def test_duplicate_items(monkeypatch):
+    monkeypatch.setattr(Handler, "input_class", {"counter": Counter})
+    config = {"inputs": [{"type": "counter", "name": "a"}, {"type": "counter", "name": "a"}]}
+    with pytest.raises(ValueError):
+        Handler.from_config(config)
+    handler = Handler.from_config({"inputs": config["inputs"][:1]})
+    with pytest.raises(ValueError):
+        asyncio.run(handler.reload(config))
+    assert len(handler.inputs) == 1
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : file_writer.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/23 21:30
+
+按大小或时间轮转的追加写文件, 轮转后的文件在后台线程中 gzip 压缩.
+
+write / sync / rotate 会阻塞在磁盘 IO 上, 应在线程中调用.
+"""
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger("host-service.grafana.file-writer")
+
+
+class RotatingFileWriter:
+    def __init__(
+        self,
+        filename,
+        mode: str = "a",
+        buffer_size: int = 1024**2,
+        fsync_interval: float = 10,
+        max_bytes: int = 100 * 1024**2,
+        rotate_interval: float = None,
+        backup_count: int = 10,
+        compress: bool = True,
+    ):
+        """
+        :param mode: 包含 w 时启动时清空文件, 否则追加
+        :param buffer_size: 用户态写缓存大小
+        :param fsync_interval: 两次 fsync 的最小间隔(秒), 0 为每次写入都 fsync
+        :param max_bytes: 文件超过该大小时轮转, 0 为不按大小轮转
+        :param rotate_interval: 文件打开超过该时间(秒)时轮转, None 为不按时间轮转
+        :param backup_count: 保留的轮转文件数量
+        :param compress: 轮转后的文件是否 gzip 压缩
+        """
+        self.path = Path(filename)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.buffer_size = buffer_size
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compress = compress
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="file-compress")
+        self._file = None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self.rotations = 0
+        self.written = 0
+        self._open("wb" if "w" in mode else "ab")
+        for p in self._backups():
+            if compress and p.suffix != ".gz":
+                self._executor.submit(self._compress, p)  # 上次退出时未压缩完成的文件
+
+    def _open(self, mode: str = "ab"):
+        self._file = open(self.path, mode, buffering=self.buffer_size)
+        self._size = self._file.tell()
+        self._opened = time.monotonic()
+
+    def _backups(self) -> list[Path]:
+        """轮转后的文件, 最旧的在前"""
+        return sorted(
+            p
+            for p in self.path.parent.glob(f"{self.path.name}.*")
+            if not p.name.endswith(".tmp")
+        )
+
+    def _should_rotate(self, incoming: int) -> bool:
+        if self.max_bytes and self._size and self._size + incoming > self.max_bytes:
+            return True
+        if self.rotate_interval and time.monotonic() - self._opened >= self.rotate_interval:
+            return self._size > 0
+        return False
+
+    def write(self, data: bytes):
+        with self._lock:
+            if self._should_rotate(len(data)):
+                self._rotate()
+            self._file.write(data)
+            self._size += len(data)
+            self.written += len(data)
+            self._dirty = True
+            self._sync()
+
+    def _sync(self, force: bool = False):
+        if not self._dirty:
+            return
+        if force or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+            self._last_sync = time.monotonic()
+
+    def sync(self, force: bool = False):
+        """写入缓存并按 fsync_interval fsync"""
+        with self._lock:
+            self._sync(force)
+
+    def rotate(self):
+        with self._lock:
+            self._rotate()
+
+    def _rotate(self):
+        self._sync(force=True)
+        self._file.close()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        target = self.path.with_name(f"{self.path.name}.{stamp}")
+        n = 0
+        while target.exists() or target.with_name(target.name + ".gz").exists():
+            n += 1
+            target = self.path.with_name(f"{self.path.name}.{stamp}.{n}")
+        self.path.rename(target)
+        self.rotations += 1
+        logger.info("轮转文件 %s -> %s", self.path, target.name)
+        self._open()
+        if self.compress:
+            self._executor.submit(self._compress, target)
+        else:
+            self._prune()
+
+    def _compress(self, path: Path):
+        gz = path.with_name(path.name + ".gz")
+        tmp = path.with_name(gz.name + ".tmp")
+        try:
+            with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024**2)
+            tmp.rename(gz)
+            path.unlink()
+        except OSError as _e:
+            logger.warning("压缩 %s 失败: %s", path, _e)
+            tmp.unlink(missing_ok=True)
+        self._prune()
+
+    def _prune(self):
+        backups = self._backups()
+        for p in backups[: max(0, len(backups) - self.backup_count)]:
+            p.unlink(missing_ok=True)
+            logger.info("删除旧文件 %s", p)
+
+    def close(self):
+        with self._lock:
+            self._sync(force=True)
+            self._file.close()
+        self._executor.shutdown(wait=True)
+
+    def metrics(self) -> dict:
+        return {
+            "file_bytes": self._size,
+            "written_bytes": self.written,
+            "rotations": self.rotations,
+        }
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : file_writer_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/23 21:50
+"""
+import gzip
+import time
+
+from .file_writer import RotatingFileWriter
+
+
+def test_rotate_by_size(tmp_path):
+    path = tmp_path / "out.ndjson"
+    writer = RotatingFileWriter(path, max_bytes=100, backup_count=2, fsync_interval=0)
+    for i in range(10):
+        writer.write(b"x" * 40 + b"\n")
+    writer.close()
+    backups = sorted(p.name for p in tmp_path.iterdir() if p != path)
+    assert len(backups) == 2
+    assert all(n.endswith(".gz") for n in backups)
+    assert gzip.decompress((tmp_path / backups[-1]).read_bytes()) == (b"x" * 40 + b"\n") * 2
+    assert path.read_bytes() == (b"x" * 40 + b"\n") * 2
+    assert writer.metrics()["rotations"] == 4
+
+
+def test_rotate_by_time(tmp_path):
+    path = tmp_path / "out.ndjson"
+    writer = RotatingFileWriter(path, rotate_interval=0.05, compress=False)
+    writer.write(b"a\n")
+    time.sleep(0.06)
+    writer.write(b"b\n")
+    writer.close()
+    (backup,) = [p for p in tmp_path.iterdir() if p != path]
+    assert backup.read_bytes() == b"a\n"
+    assert path.read_bytes() == b"b\n"
+
+
+def test_append_and_truncate(tmp_path):
+    path = tmp_path / "out.ndjson"
+    path.write_bytes(b"old\n")
+    writer = RotatingFileWriter(path, mode="a+")
+    writer.write(b"new\n")
+    writer.close()
+    assert path.read_bytes() == b"old\nnew\n"
+    RotatingFileWriter(path, mode="w").close()
+    assert path.read_bytes() == b""
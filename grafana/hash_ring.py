@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : hash_ring.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/15 11:30
+
+一致性哈希环: 增减节点时只有少量的键会改变归属.
+"""
+import bisect
+import hashlib
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+def hash64(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing(Generic[T]):
+    def __init__(self, nodes: dict[str, T], replicas: int = 128):
+        """nodes: 节点名称: 节点对象; replicas: 每个节点在环上的虚拟节点数"""
+        if not nodes:
+            raise ValueError("HashRing 至少需要一个节点")
+        self.nodes = nodes
+        ring = sorted(
+            (hash64(f"{name}#{i}"), name) for name in nodes for i in range(replicas)
+        )
+        self._keys = [k for k, _ in ring]
+        self._names = [n for _, n in ring]
+
+    def get_name(self, key: str) -> str:
+        i = bisect.bisect(self._keys, hash64(key)) % len(self._keys)
+        return self._names[i]
+
+    def get(self, key: str) -> T:
+        return self.nodes[self.get_name(key)]
@@ -0,0 +1,24 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : hash_ring_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/15 11:30
+"""
+from collections import Counter
+
+from .hash_ring import HashRing
+
+
+def test_hash_ring_balance_and_stability():
+    keys = [f"stream-{i}" for i in range(3000)]
+    ring = HashRing({"a": 1, "b": 2, "c": 3})
+    before = {k: ring.get_name(k) for k in keys}
+
+    assert all(800 < n < 1200 for n in Counter(before.values()).values())
+    assert {k: ring.get_name(k) for k in keys} == before
+
+    ring = HashRing({"a": 1, "b": 2, "c": 3, "d": 4})
+    moved = [k for k in keys if ring.get_name(k) != before[k]]
+    assert all(ring.get_name(k) == "d" for k in moved)
+    assert len(moved) < 1000
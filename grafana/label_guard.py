@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : label_guard.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/14 16:25
+
+Loki 标签基数保护.
+
+记录每个标签键最近 window 秒内出现过的值, 某个键的取值数量达到上限后,
+新出现的值不再作为标签发送, 而是折叠进日志行中. 超过 window 未出现的值过期,
+不再占用名额.
+"""
+import json
+import logging
+import time
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger("host-service.grafana.label-guard")
+
+
+def fold_line(line: str, folded: dict) -> str:
+    """将标签写入日志行: JSON 对象直接插入字段, 其他格式以 logfmt 前缀写入"""
+    if line.startswith("{") and _is_json_object(line):
+        fields = ", ".join(
+            f"{json.dumps(k)}: {json.dumps(v, ensure_ascii=False)}"
+            for k, v in folded.items()
+        )
+        rest = line[1:].lstrip()
+        return "{" + fields + ("" if rest.startswith("}") else ", ") + rest
+    prefix = " ".join(
+        f"{k}={json.dumps(v, ensure_ascii=False)}" for k, v in folded.items()
+    )
+    return f"{prefix} {line}"
+
+
+def _is_json_object(line: str) -> bool:
+    try:
+        return isinstance(json.loads(line), dict)
+    except ValueError:
+        return False
+
+
+def _expire(seen: OrderedDict, cutoff: float):
+    """按最后出现时间从旧到新删除早于 cutoff 的记录"""
+    while seen and next(iter(seen.values())) < cutoff:
+        seen.popitem(last=False)
+
+
+class LabelGuard:
+    def __init__(
+        self,
+        max_values: int = 0,
+        limits: dict[str, int] = None,
+        window: float = 3600,
+        max_streams: int = 1 << 16,
+    ):
+        """
+        :param max_values: 每个标签键默认的取值上限, 0 为不限制
+        :param limits: 单独配置的标签键上限
+        :param window: 取值与标签集合的存活时间(秒), 超过后不再计数
+        :param max_streams: 最多记录的活跃标签集合数量, 超出时淘汰最久未出现的
+        """
+        self.max_values = max_values
+        self.limits = limits or {}
+        self.window = window
+        self.max_streams = max_streams
+        # 标签键 -> {值: 最后出现时间}, 按最后出现时间排序
+        self._values: dict[str, OrderedDict[str, float]] = {}
+        self._streams: OrderedDict[tuple, float] = OrderedDict()  # 活跃的标签集合
+        self.folded: Counter = Counter()
+        self._expired_at = time.monotonic()
+
+    def limit(self, key: str) -> int:
+        return self.limits.get(key, self.max_values)
+
+    def apply(self, labels: dict, lines: int = 1) -> tuple[dict, dict]:
+        """返回 (保留的标签, 需要折叠进日志行的标签), lines 用于统计折叠的行数"""
+        now = time.monotonic()
+        if now - self._expired_at >= min(self.window, 60):
+            self.expire()
+        kept, folded = {}, {}
+        for k, v in labels.items():
+            values = self._values.setdefault(k, OrderedDict())
+            limit = self.limit(k)
+            if limit and v not in values and len(values) >= limit:
+                _expire(values, now - self.window)
+            if v in values or not limit or len(values) < limit:
+                values[v] = now
+                values.move_to_end(v)
+                kept[k] = v
+            else:
+                folded[k] = v
+        if folded:
+            if not self.folded.keys() & folded.keys():
+                logger.warning("标签基数达到上限, 折叠进日志行: %s", list(folded))
+            for k in folded:
+                self.folded[k] += lines
+        key = tuple(sorted(kept.items()))
+        self._streams[key] = now
+        self._streams.move_to_end(key)
+        if len(self._streams) > self.max_streams:
+            self._streams.popitem(last=False)
+        return kept, folded
+
+    def expire(self):
+        """删除超过 window 未出现的取值与标签集合"""
+        self._expired_at = time.monotonic()
+        cutoff = self._expired_at - self.window
+        for values in self._values.values():
+            _expire(values, cutoff)
+        _expire(self._streams, cutoff)
+
+    def top(self, n: int = 5) -> list[tuple[str, int]]:
+        """取值最多的标签键"""
+        return sorted(
+            ((k, len(v)) for k, v in self._values.items()),
+            key=lambda kv: kv[1],
+            reverse=True,
+        )[:n]
+
+    def metrics(self) -> dict:
+        self.expire()
+        return {
+            "label_sets": len(self._streams),
+            "label_cardinality_top": dict(self.top()),
+            "label_folded": dict(self.folded),
+        }
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : label_guard_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/14 16:25
+"""
+import json
+import time
+
+from .label_guard import LabelGuard, fold_line
+
+
+def test_fold_line():
+    assert json.loads(fold_line('{"a": 1}', {"target": "x"})) == {"target": "x", "a": 1}
+    assert json.loads(fold_line("{}", {"target": "x"})) == {"target": "x"}
+    assert fold_line("12.3", {"target": 'a"b'}) == 'target="a\\"b" 12.3'
+    # 以 { 开头但不是 JSON 对象的行按普通文本处理
+    assert fold_line("{not json} x", {"target": "x"}) == 'target="x" {not json} x'
+
+
+def test_label_guard():
+    guard = LabelGuard(max_values=10, limits={"target": 2})
+    for target in ("a", "b", "c", "a"):
+        kept, folded = guard.apply({"type": "ping", "target": target}, lines=3)
+    assert guard.apply({"type": "ping", "target": "c"}) == (
+        {"type": "ping"},
+        {"target": "c"},
+    )
+    assert kept == {"type": "ping", "target": "a"}
+    assert guard.top(1) == [("target", 2)]
+    assert guard.metrics()["label_folded"] == {"target": 4}
+    assert guard.metrics()["label_sets"] == 3
+
+
+def test_label_guard_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    guard = LabelGuard(limits={"target": 1}, window=10, max_streams=2)
+    assert guard.apply({"target": "a"}) == ({"target": "a"}, {})
+    assert guard.apply({"target": "b"}) == ({}, {"target": "b"})
+
+    now[0] += 11  # a 过期, 名额让给新值
+    assert guard.apply({"target": "b"}) == ({"target": "b"}, {})
+    assert guard.apply({"target": "a"}) == ({}, {"target": "a"})
+    assert guard.top() == [("target", 1)]
+
+    guard.apply({"type": "x"})
+    guard.apply({"type": "y"})
+    assert guard.metrics()["label_sets"] == 2  # 超出 max_streams 淘汰最久未出现的
+    now[0] += 11
+    assert guard.metrics()["label_sets"] == 0
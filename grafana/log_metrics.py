@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : log_metrics.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/19 21:10
+
+从日志 Stream 中提取数值字段作为指标.
+
+规则示例 (to_loki 配置中 graphite 输出的 rules):
+
+    - match: {type: traffic}       # 标签全部相等时生效
+      name: clash.traffic
+      fields: [up, down]           # JSON 日志行中的字段, a.b 表示嵌套字段, . 表示整行
+      kind: counter                # counter | gauge | timer | histogram
+    - match: {type: tailscale_ping}
+      name: tailscale.ping.ttl
+      fields: [.]
+      tags: [source, target]       # 从标签或日志行字段中取值作为指标标签
+      kind: timer
+"""
+import json
+import logging
+from typing import Iterator
+
+from .client_loki import Stream
+
+logger = logging.getLogger("host-service.grafana.log-metrics")
+
+KINDS = ("counter", "gauge", "timer", "histogram")
+WHOLE_LINE = "."
+
+
+def get_field(data, path: str):
+    """按 a.b 路径取值, 不存在时返回 None"""
+    if path == WHOLE_LINE:
+        return data
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def to_number(value) -> float | None:
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+class MetricRule:
+    __slots__ = ("match", "name", "fields", "tags", "kind")
+
+    def __init__(
+        self,
+        name: str,
+        fields: list[str],
+        match: dict = None,
+        tags: list[str] = None,
+        kind: str = "gauge",
+    ):
+        if kind not in KINDS:
+            raise ValueError(f"kind 必须是 {KINDS} 之一: {kind}")
+        if not fields:
+            raise ValueError(f"规则 {name} 没有配置 fields")
+        self.match = tuple((k, str(v)) for k, v in (match or {}).items())
+        self.name = name
+        self.fields = tuple(fields)
+        self.tags = tuple(tags or ())
+        self.kind = kind
+
+    def matches(self, labels: dict) -> bool:
+        return all(labels.get(k) == v for k, v in self.match)
+
+    def metric_name(self, field: str) -> str:
+        return self.name if field == WHOLE_LINE else f"{self.name}.{field}"
+
+    def extract(self, labels: dict, data) -> Iterator[tuple[str, float, dict]]:
+        """从一行已解析的日志中提取 (指标名称, 数值, 标签)"""
+        tags = {}
+        for t in self.tags:
+            v = labels.get(t)
+            if v is None:
+                v = get_field(data, t)
+            if v is not None:
+                tags[t] = v
+        for field in self.fields:
+            value = to_number(get_field(data, field))
+            if value is not None:
+                yield self.metric_name(field), value, tags
+
+
+class MetricExtractor:
+    def __init__(self, rules: list[dict]):
+        self.rules = [MetricRule(**r) for r in rules]
+        self.lines = 0  # 命中规则的日志行
+        self.errors = 0  # 无法解析的日志行
+
+    def extract(self, stream: Stream) -> Iterator[tuple[MetricRule, str, float, dict]]:
+        rules = [r for r in self.rules if r.matches(stream.stream)]
+        if not rules:
+            return
+        for line in stream.lines:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                self.errors += 1
+                continue
+            self.lines += 1
+            for rule in rules:
+                for name, value, tags in rule.extract(stream.stream, data):
+                    yield rule, name, value, tags
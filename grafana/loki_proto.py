@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : loki_proto.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/8 21:05
+
+手写的 Loki ``logproto.PushRequest`` 编码器, 不依赖 protoc 生成的代码.
+
+    message PushRequest   { repeated StreamAdapter streams = 1; }
+    message StreamAdapter { string labels = 1; repeated EntryAdapter entries = 2; }
+    message EntryAdapter  { Timestamp timestamp = 1; string line = 2; }
+    message Timestamp     { int64 seconds = 1; int32 nanos = 2; }
+
+Loki 要求 protobuf 请求体使用 snappy(block 格式) 压缩;
+安装了 python-snappy 时直接使用, 否则退化为只包含 literal 的 snappy 块,
+再由 HTTP 层的 gzip Content-Encoding 完成实际的压缩.
+"""
+import logging
+
+try:
+    import snappy
+except ImportError:  # pragma: no cover - 取决于运行环境
+    snappy = None
+
+logger = logging.getLogger("host-service.grafana.loki-proto")
+
+HAS_SNAPPY = snappy is not None
+
+_WIRE_VARINT = 0
+_WIRE_LEN = 2
+
+# 预先计算好的字段标识
+_TAG_STREAMS = bytes([1 << 3 | _WIRE_LEN])
+_TAG_LABELS = bytes([1 << 3 | _WIRE_LEN])
+_TAG_ENTRIES = bytes([2 << 3 | _WIRE_LEN])
+_TAG_TIMESTAMP = bytes([1 << 3 | _WIRE_LEN])
+_TAG_LINE = bytes([2 << 3 | _WIRE_LEN])
+_TAG_SECONDS = bytes([1 << 3 | _WIRE_VARINT])
+_TAG_NANOS = bytes([2 << 3 | _WIRE_VARINT])
+
+_SNAPPY_MAX_LITERAL = 1 << 16
+
+
+def encode_varint(value: int) -> bytes:
+    """编码无符号 varint"""
+    if value < 0x80:
+        return bytes((value,))
+    buf = bytearray()
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+    return bytes(buf)
+
+
+def _len_field(tag: bytes, payload: bytes) -> bytes:
+    return tag + encode_varint(len(payload)) + payload
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    """将标签转换为 Loki 识别的 ``{k="v", ...}`` 格式, 键按字典序排列"""
+    return (
+        "{"
+        + ", ".join(
+            f'{k}="{_escape_label_value(str(v))}"' for k, v in sorted(labels.items())
+        )
+        + "}"
+    )
+
+
+def encode_entry(time_ns: int, line: str) -> bytes:
+    """编码一条 EntryAdapter"""
+    seconds, nanos = divmod(time_ns, 1_000_000_000)
+    ts = b""
+    if seconds:
+        ts += _TAG_SECONDS + encode_varint(seconds)
+    if nanos:
+        ts += _TAG_NANOS + encode_varint(nanos)
+    return _len_field(_TAG_TIMESTAMP, ts) + _len_field(_TAG_LINE, line.encode())
+
+
+def encode_stream(labels: dict, values) -> bytes:
+    """编码一个 StreamAdapter, values 为 (time_ns, line) 序列"""
+    parts = [_len_field(_TAG_LABELS, format_labels(labels).encode())]
+    for time_ns, line in values:
+        parts.append(_len_field(_TAG_ENTRIES, encode_entry(int(time_ns), line)))
+    return b"".join(parts)
+
+
+def encode_push_request(streams) -> bytes:
+    """编码 PushRequest, streams 为 (labels, values) 序列"""
+    return b"".join(
+        _len_field(_TAG_STREAMS, encode_stream(labels, values))
+        for labels, values in streams
+    )
+
+
+def snappy_literal_block(data: bytes) -> bytes:
+    """不做压缩的 snappy block: 仅由 literal 组成, 任何 snappy 解码器都可以解开"""
+    out = [encode_varint(len(data))]
+    view = memoryview(data)
+    for i in range(0, len(data), _SNAPPY_MAX_LITERAL):
+        chunk = view[i : i + _SNAPPY_MAX_LITERAL]
+        n = len(chunk) - 1
+        if n < 60:
+            out.append(bytes((n << 2,)))
+        elif n < 0x100:
+            out.append(bytes((60 << 2, n)))
+        else:
+            out.append(bytes((61 << 2,)) + n.to_bytes(2, "little"))
+        out.append(bytes(chunk))
+    return b"".join(out)
+
+
+def snappy_block(data: bytes) -> tuple[bytes, bool]:
+    """snappy 压缩, 返回 (压缩后的内容, 是否进行了实际压缩)"""
+    if snappy is not None:
+        return snappy.compress(data), True
+    return snappy_literal_block(data), False
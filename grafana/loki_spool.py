@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : loki_spool.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/9 20:40
+
+Loki 推送的磁盘预写队列.
+
+每个批次在推送前被写成一个只追加、写完即不再修改的段文件,
+Loki 返回 204 之后删除; 推送失败或进程重启后由后台任务重放.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Iterable
+
+logger = logging.getLogger("host-service.grafana.loki-spool")
+
+SUFFIX = ".seg"
+
+
+class LokiSpool:
+    def __init__(self, directory, max_bytes: int = 256 * 1024**2):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._busy: set[str] = set()  # 正在推送中的段, 重放时跳过
+        self._segments: dict[str, int] = {}  # 段名称: 文件大小, 按写入顺序排列
+        for p in sorted(self.directory.glob(f"*{SUFFIX}")):
+            self._segments[p.name] = p.stat().st_size
+        for p in self.directory.glob("*.tmp"):
+            p.unlink()  # 写入过程中断的残留文件
+        self._seq = int(max(self._segments, default="0").removesuffix(SUFFIX)) + 1
+        self._event = asyncio.Event()
+        if self._segments:
+            logger.info(
+                "加载 Spool %s: %d 个段, %d bytes", self.directory, self.depth, self.size
+            )
+
+    @property
+    def depth(self) -> int:
+        return len(self._segments)
+
+    @property
+    def size(self) -> int:
+        return sum(self._segments.values())
+
+    def metrics(self) -> dict:
+        return {
+            "spool_depth": self.depth,
+            "spool_bytes": self.size,
+            "spool_dropped": self.dropped,
+        }
+
+    def write(
+        self, body: bytes | Iterable[bytes], headers: dict, lines: int = 0
+    ) -> str:
+        """写入一个段并标记为推送中, 返回段名称.
+
+        body 可以是分块的可迭代对象, 逐块写入磁盘. 会阻塞在 fsync 上, 应在线程中调用
+        """
+        with self._lock:
+            name = f"{self._seq:016d}{SUFFIX}"
+            self._seq += 1
+            self._busy.add(name)
+
+        meta = json.dumps({"headers": headers, "lines": lines}).encode() + b"\n"
+        tmp = self.directory.joinpath(name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(meta)
+            if isinstance(body, bytes):
+                f.write(body)
+            else:
+                f.writelines(body)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        tmp.rename(self.directory.joinpath(name))
+
+        with self._lock:
+            self._segments[name] = size
+            self._enforce_cap()
+        return name
+
+    def _enforce_cap(self):
+        """超出磁盘上限时丢弃最旧的段"""
+        size = self.size
+        for name in list(self._segments):
+            if size <= self.max_bytes:
+                break
+            if name in self._busy:
+                continue
+            size -= self._segments.pop(name)
+            self.directory.joinpath(name).unlink(missing_ok=True)
+            self.dropped += 1
+            logger.warning("Spool 超出上限 %d bytes, 丢弃段 %s", self.max_bytes, name)
+
+    def segment_size(self, name: str) -> int:
+        return self._segments.get(name, 0)
+
+    def read_meta(self, name: str) -> tuple[dict, int]:
+        """读取一个段的元数据, 返回 (请求头, 行数)"""
+        with open(self.directory.joinpath(name), "rb") as f:
+            meta = json.loads(f.readline())
+            return meta["headers"], meta["lines"]
+
+    async def aiter_body(self, name: str, chunk_size=64 * 1024) -> AsyncIterator[bytes]:
+        """分块读取一个段的请求体"""
+        f = await asyncio.to_thread(open, self.directory.joinpath(name), "rb")
+        try:
+            await asyncio.to_thread(f.readline)
+            while chunk := await asyncio.to_thread(f.read, chunk_size):
+                yield chunk
+        finally:
+            f.close()
+
+    def acquire(self, name: str) -> bool:
+        """标记为推送中, 段已被删除或正在推送时返回False"""
+        with self._lock:
+            if name not in self._segments or name in self._busy:
+                return False
+            self._busy.add(name)
+            return True
+
+    def release(self, name: str) -> None:
+        """推送失败, 交给重放任务处理"""
+        with self._lock:
+            self._busy.discard(name)
+        self._event.set()
+
+    def remove(self, name: str) -> None:
+        """推送成功, 删除段"""
+        with self._lock:
+            self._busy.discard(name)
+            self._segments.pop(name, None)
+        self.directory.joinpath(name).unlink(missing_ok=True)
+
+    def pending(self) -> list[str]:
+        """等待重放的段, 最旧的在前"""
+        with self._lock:
+            return [n for n in self._segments if n not in self._busy]
+
+    async def wait(self) -> None:
+        """等待新的失败段"""
+        await self._event.wait()
+        self._event.clear()
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : loki_spool_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/9 20:40
+"""
+import asyncio
+
+from .loki_spool import LokiSpool
+
+
+async def _read_body(spool: LokiSpool, name: str) -> bytes:
+    return b"".join([c async for c in spool.aiter_body(name, chunk_size=2)])
+
+
+def test_write_read_remove(tmp_path):
+    spool = LokiSpool(tmp_path)
+    name = spool.write(b"body", {"Content-Encoding": "gzip"}, 3)
+
+    assert spool.pending() == []
+    spool.release(name)
+    assert spool.pending() == [name]
+    assert spool.read_meta(name) == ({"Content-Encoding": "gzip"}, 3)
+    assert asyncio.run(_read_body(spool, name)) == b"body"
+    assert spool.acquire(name) and not spool.acquire(name)
+    spool.remove(name)
+    assert spool.depth == 0 and list(tmp_path.iterdir()) == []
+
+
+def test_reload_after_restart(tmp_path):
+    spool = LokiSpool(tmp_path)
+    names = [spool.write(b"x" * 10, {}) for _ in range(3)]
+
+    spool = LokiSpool(tmp_path)
+    assert spool.pending() == names
+    assert spool.write(b"y", {}) > names[-1]
+
+
+def test_max_bytes_drops_oldest(tmp_path):
+    spool = LokiSpool(tmp_path, max_bytes=300)
+    names = [spool.write(b"x" * 100, {}) for _ in range(3)]
+    [spool.release(n) for n in names]
+    spool.write(b"x" * 100, {})
+
+    assert spool.dropped == 2
+    assert spool.size <= 300
+    assert names[0] not in spool.pending()
+
+
+def test_write_chunks(tmp_path):
+    spool = LokiSpool(tmp_path)
+    name = spool.write(iter([b"ab", b"", b"cd"]), {}, 2)
+
+    assert asyncio.run(_read_body(spool, name)) == b"abcd"
+    assert spool.segment_size(name) == spool.size
@@ -1,36 +1,287 @@
-import asyncio.subprocess
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : ping.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/22 20:15
+
+并发 Ping 多个目标.
+
+一个任务通过一个 ICMP socket (优先使用无需 root 的 SOCK_DGRAM, 其次 SOCK_RAW)
+向所有目标发送 Echo 请求, 回复由事件循环的 reader 回调接收, 不会阻塞事件循环.
+两种 socket 都不可用时, 并发调用系统 ping 命令 (异步子进程) 作为后备.
+"""
+import asyncio
+import logging
 import os
 import re
-import subprocess
+import socket
+import struct
+import sys
 import time
+from dataclasses import dataclass, field
 
 from tools import getencoding
 
+logger = logging.getLogger("host-service.grafana.ping")
 
-class Ping:
-    RE_PING_WINDOWS = r"来自 (.*?) 的回复: 字节=.*? 时间=(.*?)ms TTL=.*"
-    RE_PING_UBUNTU = r"\d* bytes from (.*?) .*?: icmp_seq=\d+ ttl=\d+ time=(.*?) ms"
+ICMP_ECHO = {socket.AF_INET: (8, 0), socket.AF_INET6: (128, 129)}  # (请求, 回复)
+PROTO = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
 
-    def __init__(self, host):
-        self.host = host
-        self.popen_ping = subprocess.Popen(
-            ["ping", "-t", host],
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            universal_newlines=True,
-            encoding=getencoding(),
-        )
+RE_PING_RTT = re.compile(r"time[=<]([\d.]+) ?ms")
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    s = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    s = (s >> 16) + (s & 0xFFFF)
+    s += s >> 16
+    return ~s & 0xFFFF
+
+
+def echo_request(family: int, ident: int, seq: int, payload: bytes = b"host-svc") -> bytes:
+    """ICMPv6 的校验和由内核计算"""
+    type_ = ICMP_ECHO[family][0]
+    header = struct.pack("!BBHHH", type_, 0, 0, ident, seq)
+    if family == socket.AF_INET:
+        header = struct.pack("!BBHHH", type_, 0, checksum(header + payload), ident, seq)
+    return header + payload
+
+
+def parse_reply(family: int, data: bytes, raw: bool) -> tuple[int, int] | None:
+    """解析 Echo 回复, 返回 (ident, seq); 不是 Echo 回复时返回None
+
+    IPv4 的 raw socket 收到的数据包含 IP 头
+    """
+    if raw and family == socket.AF_INET:
+        data = data[(data[0] & 0x0F) * 4 :]
+    if len(data) < 8:
+        return None
+    type_, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+    if type_ != ICMP_ECHO[family][1]:
+        return None
+    return ident, seq
+
+
+@dataclass
+class PingResult:
+    target: str
+    sent: int = 0
+    rtts: list[float] = field(default_factory=list)  # 毫秒
+    error: str = None
+
+    @property
+    def loss(self) -> float:
+        return 1 - len(self.rtts) / self.sent if self.sent else 1.0
+
+    def to_dict(self) -> dict:
+        rtts = self.rtts
+        res = {
+            "target": self.target,
+            "sent": self.sent,
+            "received": len(rtts),
+            "loss": round(self.loss, 4),
+        }
+        if rtts:
+            res.update(
+                rtt_min=round(min(rtts), 3),
+                rtt_avg=round(sum(rtts) / len(rtts), 3),
+                rtt_max=round(max(rtts), 3),
+            )
+        if self.error:
+            res["error"] = self.error
+        return res
+
+
+class _IcmpSocket:
+    """一个地址族的 ICMP socket 与等待中的 Echo 请求"""
 
-    async def run(self):
+    def __init__(self, family: int, loop: asyncio.AbstractEventLoop):
+        self.family = family
+        self.loop = loop
+        try:
+            self.sock = socket.socket(family, socket.SOCK_DGRAM, PROTO[family])
+            self.raw = False
+        except PermissionError:
+            self.sock = socket.socket(family, socket.SOCK_RAW, PROTO[family])
+            self.raw = True
+        self.sock.setblocking(False)
+        self.ident = os.getpid() & 0xFFFF
+        # (地址, seq): (结果, 发送时间)
+        self.pending: dict[tuple[str, int], tuple[PingResult, float]] = {}
+        self.drained = asyncio.Event()  # 所有请求都已收到回复
+        self.loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def close(self):
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+
+    def send(self, result: PingResult, addr: str, seq: int):
+        packet = echo_request(self.family, self.ident, seq)
+        self.pending[(addr, seq)] = (result, time.perf_counter())
+        self.drained.clear()
+        result.sent += 1
+        try:
+            self.sock.sendto(packet, (addr, 0))
+        except OSError as _e:
+            self.pending.pop((addr, seq), None)
+            result.error = repr(_e)
+
+    def _on_readable(self):
         while True:
-            if self.popen_ping.poll() is not None:
-                break
-            res = re.findall(
-                self.RE_PING_WINDOWS if os.name == "nt" else self.RE_PING_UBUNTU,
-                self.popen_ping.stdout.readline(),
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as _e:
+                logger.debug("接收 ICMP 回复失败: %r", _e)
+                return
+            now = time.perf_counter()
+            reply = parse_reply(self.family, data, self.raw)
+            if reply is None:
+                continue
+            ident, seq = reply
+            # SOCK_DGRAM 的 ident 由内核改写, 内核只会投递属于本 socket 的回复
+            if self.raw and ident != self.ident:
+                continue
+            probe = self.pending.pop((address[0], seq), None)
+            if probe is not None:
+                result, sent_at = probe
+                result.rtts.append((now - sent_at) * 1000)
+                if not self.pending:
+                    self.drained.set()
+
+
+class Pinger:
+    def __init__(
+        self,
+        targets: list[str],
+        count: int = 3,
+        timeout: float = 1,
+        spacing: float = 0.2,
+        resolve_interval: float = 300,
+        use_command: bool = None,
+    ):
+        """
+        :param targets: 主机名或 IP
+        :param count: 每轮对每个目标发送的 Echo 请求数
+        :param timeout: 最后一个请求发出后等待回复的时间
+        :param spacing: 同一目标两次请求之间的间隔
+        :param resolve_interval: 重新解析主机名的间隔
+        :param use_command: 强制使用系统 ping 命令, None 为 ICMP socket 不可用时自动使用
+        """
+        self.targets = list(dict.fromkeys(targets))
+        self.count = count
+        self.timeout = timeout
+        self.spacing = spacing
+        self.resolve_interval = resolve_interval
+        self.use_command = use_command
+        self._sockets: dict[int, _IcmpSocket] = {}
+        self._resolved: dict[str, tuple[int, str, float]] = {}  # 目标: (地址族, 地址, 解析时间)
+        self._seq = 0
+
+    def close(self):
+        for s in self._sockets.values():
+            s.close()
+        self._sockets.clear()
+
+    def _socket(self, family: int) -> _IcmpSocket:
+        s = self._sockets.get(family)
+        if s is None:
+            s = self._sockets[family] = _IcmpSocket(family, asyncio.get_running_loop())
+            logger.info(
+                "使用 %s ICMP socket (%s)", family.name, "raw" if s.raw else "dgram"
             )
+        return s
+
+    async def _resolve(self, target: str) -> tuple[int, str]:
+        cached = self._resolved.get(target)
+        if cached and time.monotonic() - cached[2] < self.resolve_interval:
+            return cached[0], cached[1]
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            target, None, type=socket.SOCK_RAW
+        )
+        family, _, _, _, sockaddr = infos[0]
+        self._resolved[target] = (family, sockaddr[0], time.monotonic())
+        return family, sockaddr[0]
+
+    def _next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFFFF
+        return self._seq
+
+    async def _ping_socket(self, results: dict[str, PingResult]):
+        addrs = await asyncio.gather(
+            *(self._resolve(t) for t in self.targets), return_exceptions=True
+        )
+        probes = []
+        for target, addr in zip(self.targets, addrs):
+            if isinstance(addr, Exception):
+                results[target].error = f"resolve: {addr!r}"
+                continue
+            family, ip = addr
+            try:
+                sock = self._socket(family)
+            except OSError as _e:
+                # 例如主机不支持 ICMPv6, 只影响解析到该地址族的目标
+                results[target].error = f"socket: {_e!r}"
+                continue
+            probes.append((results[target], sock, ip))
 
-            if res:
-                ip, ttl = res[0]
-                _time = str(time.time_ns())
-                yield _time, (ip, ttl)
+        for i in range(self.count):
+            if i:
+                await asyncio.sleep(self.spacing)
+            for result, sock, ip in probes:
+                sock.send(result, ip, self._next_seq())
+
+        waiting = [s.drained.wait() for s in self._sockets.values() if s.pending]
+        if waiting:
+            try:
+                await asyncio.wait_for(asyncio.gather(*waiting), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+        for s in self._sockets.values():
+            s.pending.clear()  # 超时的请求计为丢包
+
+    async def _ping_command(self, result: PingResult, semaphore: asyncio.Semaphore):
+        """后备方案: 系统 ping 命令, 通过异步子进程读取输出"""
+        if sys.platform == "win32":
+            cmd = ["ping", "-n", str(self.count), "-w", str(int(self.timeout * 1000))]
+        else:
+            cmd = ["ping", "-c", str(self.count), "-W", str(max(1, round(self.timeout)))]
+            cmd += ["-i", str(max(0.2, self.spacing))]
+        async with semaphore:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    result.target,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                stdout, _ = await proc.communicate()
+            except OSError as _e:
+                result.error = repr(_e)
+                return
+        result.sent = self.count
+        result.rtts = [
+            float(r) for r in RE_PING_RTT.findall(stdout.decode(getencoding(), "replace"))
+        ][: self.count]
+
+    async def ping(self) -> list[PingResult]:
+        """对所有目标执行一轮 Ping"""
+        results = {t: PingResult(t) for t in self.targets}
+        if self.use_command is None:
+            try:
+                self._socket(socket.AF_INET)
+                self.use_command = False
+            except PermissionError:
+                logger.warning("没有创建 ICMP socket 的权限, 使用系统 ping 命令")
+                self.use_command = True
+        if self.use_command:
+            semaphore = asyncio.Semaphore(64)
+            await asyncio.gather(
+                *(self._ping_command(r, semaphore) for r in results.values())
+            )
+        else:
+            await self._ping_socket(results)
+        return list(results.values())
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : ping_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/22 20:35
+"""
+import asyncio
+import socket
+
+import pytest
+
+from .ping import Pinger, PingResult, checksum, echo_request, parse_reply
+
+
+def _can_icmp() -> bool:
+    for type_ in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            socket.socket(socket.AF_INET, type_, socket.IPPROTO_ICMP).close()
+            return True
+        except PermissionError:
+            pass
+    return False
+
+
+def test_echo_packet():
+    packet = echo_request(socket.AF_INET, 0x1234, 7)
+    assert checksum(packet) == 0
+    reply = b"\0" + packet[1:]
+    assert parse_reply(socket.AF_INET, reply, raw=False) == (0x1234, 7)
+    ip_header = b"\x45" + b"\0" * 19
+    assert parse_reply(socket.AF_INET, ip_header + reply, raw=True) == (0x1234, 7)
+    assert parse_reply(socket.AF_INET, packet, raw=False) is None
+
+
+def test_ping_result():
+    r = PingResult("a", sent=4, rtts=[1.0, 3.0])
+    assert r.to_dict() == {
+        "target": "a",
+        "sent": 4,
+        "received": 2,
+        "loss": 0.5,
+        "rtt_min": 1.0,
+        "rtt_avg": 2.0,
+        "rtt_max": 3.0,
+    }
+    assert PingResult("b").loss == 1
+
+
+@pytest.mark.skipif(not _can_icmp(), reason="没有创建 ICMP socket 的权限")
+def test_ping_loopback():
+    async def main():
+        pinger = Pinger(
+            [f"127.0.0.{i}" for i in range(1, 101)] + ["bad.invalid"],
+            count=2,
+            timeout=1,
+            spacing=0.01,
+        )
+        try:
+            return await pinger.ping()
+        finally:
+            pinger.close()
+
+    results = {r.target: r for r in asyncio.run(main())}
+    assert all(results[f"127.0.0.{i}"].loss == 0 for i in range(1, 101))
+    assert results["bad.invalid"].error.startswith("resolve")
+
+
+def test_socket_error_per_family(monkeypatch):
+    """某个地址族的 socket 不可用时只影响对应的目标"""
+
+    async def resolve(self, target):
+        return (socket.AF_INET6, "::1") if target == "v6" else (socket.AF_INET, target)
+
+    def make_socket(self, family):
+        raise PermissionError("no icmpv6")
+
+    monkeypatch.setattr(Pinger, "_resolve", resolve)
+    monkeypatch.setattr(Pinger, "_socket", make_socket)
+    pinger = Pinger(["v6"], count=1, timeout=0.1, use_command=False)
+    (result,) = asyncio.run(pinger.ping())
+    assert result.error.startswith("socket") and result.loss == 1
@@ -0,0 +1,335 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : processors.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/20 20:40
+
+Handler 中位于输入与输出之间的处理阶段.
+
+每个处理器接收一个 Stream, 返回处理后的 Stream 或 None(整个 Stream 被丢弃),
+按配置顺序串联. 配置在创建时编译 (正则、字段路径等), 处理时不再解析.
+
+    processors:
+      - type: filter        # 按标签或 JSON 字段匹配, drop 丢弃匹配的行 | keep 只保留匹配的行
+        action: drop
+        labels: {type: logs}
+        fields: {level: [debug, info]}
+      - type: relabel       # 设置、重命名、删除标签
+        set: {env: home}
+        rename: {type: kind}
+        drop: [source]
+      - type: project       # 只保留(或删除)JSON 日志行中的字段
+        fields: [type, up, down]
+      - type: sample        # 每个标签集合每秒最多保留 rate 行
+        rate: 10
+      - type: dedup         # window 秒内标签与内容相同的行只保留第一行
+        window: 60
+        labels: {type: logs}  # 可选, 只对匹配的 Stream 去重
+        fields: [metadata_host]  # 可选, 按字段去重, 没有任何一个字段的行不去重
+"""
+import abc
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from itertools import compress
+from typing import Callable
+
+from .client_loki import Stream, label_fingerprint
+from .log_metrics import get_field
+
+logger = logging.getLogger("host-service.grafana.processors")
+
+
+def compile_matcher(expected, regex: bool = False) -> Callable[[object], bool]:
+    """expected 为单个值或多个候选值, regex 为 True 时按正则完整匹配"""
+    values = expected if isinstance(expected, list) else [expected]
+    if regex:
+        patterns = [re.compile(str(v)) for v in values]
+        return lambda v: v is not None and any(p.fullmatch(str(v)) for p in patterns)
+    values = {str(v) for v in values}
+    return lambda v: v is not None and str(v) in values
+
+
+def select(stream: Stream, keep: list[bool]) -> Stream | None:
+    """按掩码选出部分日志行, 一行都不剩时返回None"""
+    if all(keep):
+        return stream
+    res = Stream(stream.stream)
+    res.timestamps.extend(compress(stream.timestamps, keep))
+    res.lines = list(compress(stream.lines, keep))
+    return res if res.lines else None
+
+
+def parse_line(line: str):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class Processor(metaclass=abc.ABCMeta):
+    __processor_type__: str
+
+    @classmethod
+    def from_config(cls, **conf) -> "Processor":
+        """按配置文件中的键创建"""
+        return cls(**conf)
+
+    @abc.abstractmethod
+    def process(self, stream: Stream) -> Stream | None:
+        """处理一个 Stream, 返回None表示整个 Stream 被丢弃"""
+
+
+class Filter(Processor):
+    __processor_type__ = "filter"
+
+    def __init__(
+        self,
+        action: str = "drop",
+        labels: dict = None,
+        fields: dict = None,
+        regex: bool = False,
+    ):
+        if action not in ("drop", "keep"):
+            raise ValueError(f"action 必须是 drop 或 keep: {action}")
+        if not labels and not fields:
+            raise ValueError("filter 需要配置 labels 或 fields")
+        self.drop = action == "drop"
+        self.labels = [(k, compile_matcher(v, regex)) for k, v in (labels or {}).items()]
+        self.fields = [(k, compile_matcher(v, regex)) for k, v in (fields or {}).items()]
+
+    def _match_fields(self, line: str) -> bool:
+        data = parse_line(line)
+        return all(m(get_field(data, k)) for k, m in self.fields)
+
+    def process(self, stream: Stream) -> Stream | None:
+        if not all(m(stream.stream.get(k)) for k, m in self.labels):
+            return None if not self.drop else stream
+        if not self.fields:
+            return None if self.drop else stream
+        return select(stream, [self._match_fields(l) != self.drop for l in stream.lines])
+
+
+class Relabel(Processor):
+    __processor_type__ = "relabel"
+
+    def __init__(self, set_labels: dict = None, rename: dict = None, drop: list = None):
+        self.set_labels = {k: str(v) for k, v in (set_labels or {}).items()}
+        self.rename = rename or {}
+        self.drop = drop or []
+        self._cache: dict[tuple, dict] = {}
+
+    def _relabel(self, labels: dict) -> dict:
+        labels = {self.rename.get(k, k): v for k, v in labels.items()}
+        for k in self.drop:
+            labels.pop(k, None)
+        labels.update(self.set_labels)
+        return labels
+
+    @classmethod
+    def from_config(cls, **conf) -> "Relabel":
+        """配置文件中使用 set 键"""
+        return cls(set_labels=conf.pop("set", None), **conf)
+
+    def process(self, stream: Stream) -> Stream | None:
+        fp = label_fingerprint(stream.stream)
+        labels = self._cache.get(fp)
+        if labels is None:
+            labels = self._relabel(stream.stream)
+            if len(self._cache) < 1 << 16:
+                self._cache[fp] = labels
+        res = Stream(labels)
+        res.timestamps, res.lines = stream.timestamps, stream.lines
+        return res
+
+
+class Project(Processor):
+    """非 JSON 的日志行保持不变"""
+
+    __processor_type__ = "project"
+
+    def __init__(self, fields: list[str] = None, exclude: list[str] = None):
+        if bool(fields) == bool(exclude):
+            raise ValueError("project 需要配置 fields 或 exclude 其中之一")
+        self.fields = [f.split(".") for f in fields or ()]
+        self.exclude = [f.split(".") for f in exclude or ()]
+
+    def _include(self, data: dict) -> dict:
+        res = {}
+        for path in self.fields:
+            value = get_field(data, ".".join(path))
+            if value is None:
+                continue
+            node = res
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = value
+        return res
+
+    def _exclude(self, data: dict) -> dict:
+        for path in self.exclude:
+            node = data
+            for key in path[:-1]:
+                node = node.get(key) if isinstance(node, dict) else None
+            if isinstance(node, dict):
+                node.pop(path[-1], None)
+        return data
+
+    def _project(self, line: str) -> str:
+        data = parse_line(line)
+        if not isinstance(data, dict):
+            return line
+        return json.dumps(self._include(data) if self.fields else self._exclude(data))
+
+    def process(self, stream: Stream) -> Stream | None:
+        res = Stream(stream.stream)
+        res.timestamps = stream.timestamps
+        res.lines = [self._project(l) for l in stream.lines]
+        return res
+
+
+class Sample(Processor):
+    """令牌桶限速: 每个标签集合(或 by 指定的标签)每秒最多保留 rate 行, 允许 burst 行突发"""
+
+    __processor_type__ = "sample"
+
+    def __init__(
+        self, rate: float, burst: float = None, by: list[str] = None, max_keys=10000
+    ):
+        if rate <= 0:
+            raise ValueError(f"rate 必须大于0: {rate}")
+        self.rate = rate
+        self.burst = burst or rate
+        self.by = by
+        self.max_keys = max_keys
+        # key: [令牌数, 上次更新时间], 超过 max_keys 时淘汰最久未使用的
+        self._buckets: OrderedDict[tuple, list[float]] = OrderedDict()
+
+    def _key(self, labels: dict) -> tuple:
+        if self.by is None:
+            return label_fingerprint(labels)
+        return tuple(labels.get(k) for k in self.by)
+
+    def process(self, stream: Stream) -> Stream | None:
+        now = time.monotonic()
+        key = self._key(stream.stream)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        allowed = min(len(stream), int(tokens))
+        bucket[0], bucket[1] = tokens - allowed, now
+        if allowed == len(stream):
+            return stream
+        return select(stream, [i < allowed for i in range(len(stream))])
+
+
+class Dedup(Processor):
+    """按日志时间戳计算窗口, window 秒内标签与内容(或 fields 指定的字段)相同的行只保留第一行
+
+    配置 fields 时, 不是 JSON 或没有任何一个字段的行原样保留.
+    """
+
+    __processor_type__ = "dedup"
+
+    def __init__(
+        self,
+        window: float = 60,
+        fields: list[str] = None,
+        labels: dict = None,
+        regex: bool = False,
+        max_keys=100000,
+    ):
+        self.window_ns = int(window * 1e9)
+        self.fields = fields
+        self.labels = [(k, compile_matcher(v, regex)) for k, v in (labels or {}).items()]
+        self.max_keys = max_keys
+        self._seen: OrderedDict[tuple, int] = OrderedDict()  # 键: 首次出现的时间戳
+
+    def _key(self, fp: tuple, line: str) -> tuple | None:
+        """去重的键, None 表示该行不参与去重; 整行内容只保存摘要"""
+        if not self.fields:
+            return fp, hashlib.blake2b(line.encode(), digest_size=16).digest()
+        data = parse_line(line)
+        values = [get_field(data, f) for f in self.fields]
+        if all(v is None for v in values):
+            return None
+        return (fp, *(json.dumps(v) for v in values))
+
+    def _evict(self, now_ns: int):
+        seen, expired = self._seen, now_ns - self.window_ns
+        while seen and (len(seen) > self.max_keys or next(iter(seen.values())) <= expired):
+            seen.popitem(last=False)
+
+    def process(self, stream: Stream) -> Stream | None:
+        if not all(m(stream.stream.get(k)) for k, m in self.labels):
+            return stream
+        fp = label_fingerprint(stream.stream)
+        keep = []
+        for ts, line in zip(stream.timestamps, stream.lines):
+            key = self._key(fp, line)
+            if key is None:
+                keep.append(True)
+                continue
+            first = self._seen.get(key)
+            if first is not None and ts - first < self.window_ns:
+                keep.append(False)
+                continue
+            self._seen.pop(key, None)
+            self._seen[key] = ts
+            keep.append(True)
+        if stream.timestamps:
+            self._evict(max(stream.timestamps))
+        return select(stream, keep)
+
+
+PROCESSORS: dict[str, type[Processor]] = {
+    p.__processor_type__: p for p in (Filter, Relabel, Project, Sample, Dedup)
+}
+
+
+class Pipeline:
+    def __init__(self):
+        self.processors: list[Processor] = []
+        self.lines_in = 0
+        self.lines_out = 0
+        self.dropped: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.processors)
+
+    def add(self, type_: str, **kwargs) -> Processor:
+        p = PROCESSORS[type_].from_config(**kwargs)
+        self.processors.append(p)
+        return p
+
+    def process(self, stream: Stream) -> Stream | None:
+        if not self.processors:
+            return stream
+        self.lines_in += len(stream)
+        for i, p in enumerate(self.processors):
+            before = len(stream)
+            stream = p.process(stream)
+            after = len(stream) if stream is not None else 0
+            if after < before:
+                name = f"{p.__processor_type__}_{i}"
+                self.dropped[name] = self.dropped.get(name, 0) + before - after
+            if not after:
+                return None
+        self.lines_out += len(stream)
+        return stream
+
+    def metrics(self) -> dict:
+        return {
+            "lines_in": self.lines_in,
+            "lines_out": self.lines_out,
+            "dropped": dict(self.dropped),
+        }
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : processors_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/20 21:00
+"""
+import json
+
+import pytest
+
+from .client_loki import Stream
+from .processors import Dedup, Filter, Pipeline, Project, Relabel, Sample
+
+
+def _stream(labels: dict, *lines: dict, start: int = 0) -> Stream:
+    return Stream(labels, [(start + i, json.dumps(l)) for i, l in enumerate(lines)])
+
+
+def test_filter():
+    s = _stream({"type": "logs"}, {"level": "debug"}, {"level": "error"})
+    assert Filter(labels={"type": "logs"}).process(s) is None
+    assert Filter(labels={"type": "traffic"}).process(s) is s
+    kept = Filter(labels={"type": "logs"}, fields={"level": "debug"}).process(s)
+    assert [json.loads(l)["level"] for l in kept.lines] == ["error"]
+    kept = Filter(action="keep", fields={"level": "err.*"}, regex=True).process(s)
+    assert list(kept.timestamps) == [1]
+    assert Filter(action="keep", labels={"type": "traffic"}).process(s) is None
+    with pytest.raises(ValueError):
+        Filter()
+
+
+def test_relabel():
+    s = _stream({"type": "logs", "source": "a"}, {"x": 1})
+    res = Relabel(set_labels={"env": "home"}, rename={"type": "kind"}, drop=["source"]).process(s)
+    assert res.stream == {"kind": "logs", "env": "home"}
+    assert s.stream == {"type": "logs", "source": "a"}
+    assert res.lines == s.lines
+
+
+def test_project():
+    s = Stream({}, [(0, json.dumps({"a": 1, "b": {"c": 2, "d": 3}})), (1, "plain")])
+    assert Project(fields=["a", "b.c"]).process(s).lines == ['{"a": 1, "b": {"c": 2}}', "plain"]
+    assert Project(exclude=["b.d"]).process(s).lines[0] == '{"a": 1, "b": {"c": 2}}'
+
+
+def test_sample():
+    sample = Sample(rate=1, burst=3)
+    s = _stream({"type": "logs"}, *({"n": i} for i in range(5)))
+    assert len(sample.process(s)) == 3
+    assert sample.process(s) is None
+    assert len(sample.process(_stream({"type": "other"}, {"n": 1}))) == 1
+
+
+def test_dedup():
+    dedup = Dedup(window=1, fields=["host"])
+    s = _stream({"type": "c"}, {"host": "a", "n": 1}, {"host": "a", "n": 2}, {"host": "b"})
+    assert [json.loads(l).get("n") for l in dedup.process(s).lines] == [1, None]
+    later = _stream({"type": "c"}, {"host": "a", "n": 3}, start=2 * 10**9)
+    assert len(dedup.process(later)) == 1
+
+
+def test_dedup_missing_fields():
+    dedup = Dedup(window=60, fields=["metadata_host"])
+    traffic = _stream({"type": "traffic"}, *({"up": n, "down": n} for n in range(5)))
+    assert len(dedup.process(traffic)) == 5
+    plain = Stream({"type": "logs"}, [(1, "not json"), (2, "not json")])
+    assert len(dedup.process(plain)) == 2
+
+    scoped = Dedup(window=60, labels={"type": "logs"})
+    assert len(scoped.process(plain)) == 1
+    assert len(scoped.process(Stream({"type": "other"}, [(1, "x"), (2, "x")]))) == 2
+
+
+def test_pipeline():
+    p = Pipeline()
+    assert p.process("not a stream") == "not a stream"
+    p.add("filter", labels={"type": "logs"}, fields={"level": "debug"})
+    p.add("relabel", set={"env": "home"})
+    s = _stream({"type": "logs"}, {"level": "debug"}, {"level": "info"})
+    res = p.process(s)
+    assert res.stream == {"type": "logs", "env": "home"} and len(res) == 1
+    assert p.process(_stream({"type": "logs"}, {"level": "debug"})) is None
+    assert p.metrics() == {"lines_in": 3, "lines_out": 1, "dropped": {"filter_0": 2}}
+
+
+def test_sample_max_keys():
+    sample = Sample(rate=1, by=["target"], max_keys=2)
+    for t in "abc":
+        sample.process(_stream({"target": t}, {"n": 1}))
+    assert list(sample._buckets) == [("b",), ("c",)]
@@ -1,11 +1,28 @@
 import abc
 import asyncio
+import json
 import logging
+import os
+import socket
+import time
+from functools import partial
+from itertools import repeat
 
-from tools import timestamp_s, human_timedelta
+from tools import timestamp_s, human_timedelta, ABatchQueue
+from .aggregator import MetricAggregator
 from .clash import AClash
+from .client_carbon import CarbonClient
+from .client_graphite import AGraphiteClient
 from .client_loki import LokiBufferPush
 from .client_loki import Stream
+from .client_loki import estimate_size, label_fingerprint
+from .file_writer import RotatingFileWriter
+from .hash_ring import HashRing
+from .log_metrics import MetricExtractor
+from .ping import Pinger
+from .processors import Pipeline
+from .supervisor import TaskSupervisor
+from .tail import FileTailer
 from .tailscale import Tailscale
 
 logger = logging.getLogger("host-service.grafana.handler")
@@ -26,19 +43,76 @@ class InputClash(InputBase, AClash):
         logger.info("开始加载 AClash 内容 ...")
         await self.run()
         logger.info("AClash加载成功, 准备向queue推送数据 ...")
+        forward = asyncio.create_task(self._forward(queue))
+        try:
+            # 所有 WebSocket task 都退出后结束, 由 Handler 的 supervisor 重启
+            await asyncio.wait(self.ws_tasks)
+        finally:
+            forward.cancel()
+            for t in self.ws_tasks:
+                t.cancel()
+        raise RuntimeError(f"AClash {self.host} 的所有 WebSocket 连接都已退出")
+
+    async def _forward(self, queue: asyncio.Queue):
         while True:
-            await asyncio.sleep(1)
-            for s in await self.create_streams():
+            for s in await self.create_streams(max_wait=1, timeout=None):
                 s: Stream
                 await queue.put(s)  # 目前直接写入的Stream对象
                 logger.debug("AClash %s -> Handler : %s", self.host, s)
 
 
-class InputPing(InputBase):
+class InputPing(InputBase, Pinger):
+    """每 interval 秒并发 Ping 所有目标, 每个目标输出一行 RTT 与丢包率, 一轮的结果一次写入队列"""
+
     __input_type__ = "ping"
 
+    def __init__(self, targets: list[str], interval: float = 10, **kwargs):
+        Pinger.__init__(self, targets, **kwargs)
+        self.interval = interval
+        self.source = socket.gethostname()
+
+    async def to_handle(self, queue: ABatchQueue):
+        logger.info("开始 Ping %d 个目标 ...", len(self.targets))
+        loop = asyncio.get_running_loop()
+        next_round = loop.time()
+        try:
+            while True:
+                time_ns = time.time_ns()
+                results = await self.ping()
+                await queue.put_many(
+                    Stream(
+                        {"type": "ping", "source": self.source, "target": r.target},
+                        [(time_ns, json.dumps(r.to_dict()))],
+                    )
+                    for r in results
+                )
+                next_round += self.interval
+                await asyncio.sleep(max(0.0, next_round - loop.time()))
+        finally:
+            self.close()
+
+
+class InputTail(InputBase, FileTailer):
+    """跟踪本地日志文件, 每次读到的新行作为一个 Stream
+
+    放入 Handler 队列后即记录 checkpoint, 不等待输出确认: 进程异常退出时,
+    仍在 Handler 队列、输出队列与输出缓存中的行会丢失 (最多一次).
+    Handler 队列有界, 下游阻塞时 put 等待, 不会无限读取文件.
+    """
+
+    __input_type__ = "tail"
+
+    def __init__(self, paths: list[str], labels: dict = None, **kwargs):
+        FileTailer.__init__(self, paths, **kwargs)
+        self.labels = labels or {}
+
     async def to_handle(self, queue: asyncio.Queue):
-        pass
+        logger.info("开始跟踪文件 %s ...", self.patterns)
+        async for path, lines in self.follow():
+            stream = Stream({"type": "tail", "filename": path, **self.labels})
+            stream.lines = lines
+            stream.timestamps.extend(repeat(time.time_ns(), len(lines)))
+            await queue.put(stream)  # 队列满时等待, 返回后才会记录 checkpoint
 
 
 class InputTailscale(InputBase, Tailscale):
@@ -47,93 +121,640 @@ class InputTailscale(InputBase, Tailscale):
     async def to_handle(self, queue: asyncio.Queue):
         logger.info("初始化 Tailscale 内容 ...")
         self.run()
-        await asyncio.sleep(1)
-        logger.info("开始加载 Tailscale 内容 ...")
-        async for s in self.to_loki():
-            s: Stream
-            await queue.put(s)
-            logger.debug("Tailscale -> Handler : %s", s)
+        try:
+            await asyncio.sleep(1)
+            logger.info("开始加载 Tailscale 内容 ...")
+            async for s in self.to_loki():
+                s: Stream
+                await queue.put(s)
+                logger.debug("Tailscale -> Handler : %s", s)
+        finally:
+            # 被删除或由 supervisor 重启时停止后台任务, 否则它们会继续写入无人读取的队列
+            self.stop()
 
 
 class OutputLoki(LokiBufferPush):
     __output_type__ = "loki"
 
     def __init__(
-        self, host, user_id, api_key, verify=True, labels: dict = None, **kwargs
+        self,
+        host,
+        user_id,
+        api_key,
+        verify=True,
+        labels: dict = None,
+        encoding: str = "json",
+        capacity: int = 40,
+        max_lines: int = 5000,
+        max_bytes: int = 1024**2,
+        flush_timeout: float = 5,
+        **kwargs,
     ):
         LokiBufferPush.__init__(
             self,
-            40,
+            capacity,
             host,
             user_id,
             api_key,
-            flush_timeout=5,
+            flush_timeout=flush_timeout,
+            max_lines=max_lines,
+            max_bytes=max_bytes,
             verify=verify,
             labels=labels,
+            encoding=encoding,
             **kwargs,
         )
         self.total_push = 0
 
 
+class OutputLokiSharded:
+    """按标签指纹的一致性哈希将 Stream 分配到多个 Loki 端点/租户
+
+    同一个标签集合总是发往同一个分片, 每个分片拥有独立的缓存、连接池与发送队列,
+    某个分片不可用时只会填满它自己的队列.
+    """
+
+    __output_type__ = "loki_sharded"
+
+    def __init__(self, shards: list[dict], queue_size: int = 10000, **common):
+        self.queue_size = queue_size
+        self.shards: dict[str, OutputLoki] = {}
+        for i, shard in enumerate(shards):
+            conf = {**common, **shard}
+            if conf.get("spool_dir"):
+                conf["spool_dir"] = f"{conf['spool_dir']}/shard_{i}"
+            name = f"{conf['host']}/{conf['user_id']}"
+            if name in self.shards:
+                raise ValueError(f"loki_sharded 中存在重复的分片: {name}")
+            self.shards[name] = OutputLoki(**conf)
+        self.ring: HashRing[OutputLoki] = HashRing(self.shards)
+        self.queues: dict[str, ABatchQueue] = {
+            name: ABatchQueue(queue_size) for name in self.shards
+        }
+        self.dropped: dict[str, int] = {name: 0 for name in self.shards}
+        self.workers: dict[str, asyncio.Task] = {}
+
+    def start(self):
+        self._start_workers()
+        for shard in self.shards.values():
+            shard.start()
+
+    def _start_workers(self):
+        for name in self.shards:
+            if name not in self.workers or self.workers[name].done():
+                self.workers[name] = asyncio.create_task(
+                    self._worker(name), name=f"output_loki_shard_{name}"
+                )
+
+    async def _worker(self, name: str):
+        shard, queue = self.shards[name], self.queues[name]
+        while True:
+            data = await queue.get()
+            try:
+                await shard.put(data)
+            except Exception as _e:
+                logger.warning("Loki 分片 %s 推送异常: %s", name, _e, exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def put(self, data: Stream):
+        self._start_workers()
+        name = self.ring.get_name(repr(label_fingerprint(data.stream)))
+        # 分片阻塞时丢弃最旧的数据, 不影响其他分片
+        self.dropped[name] += self.queues[name].put_drop_oldest(data)
+
+    async def close(self, timeout: float = 30):
+        """等待各分片的队列发送完成, 然后关闭每个分片"""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(q.join() for q in self.queues.values())), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Loki 分片在 %ds 内没有发送完队列: %s",
+                timeout,
+                {name: q.qsize() for name, q in self.queues.items()},
+            )
+        for task in self.workers.values():
+            task.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        for shard in self.shards.values():
+            await shard.close()
+
+    def metrics(self) -> dict:
+        return {
+            name: {
+                "queue": self.queues[name].qsize(),
+                "dropped": self.dropped[name],
+                **shard.metrics(),
+            }
+            for name, shard in self.shards.items()
+        }
+
+
+class OutputGraphite:
+    """按规则从 Stream 中提取数值指标, 聚合后推送到 Graphite
+
+    配置 url 时推送到 Grafana Cloud HTTP 接口, 配置 carbon_host 时使用 Carbon TCP 协议.
+    规则格式见 grafana.log_metrics.
+    """
+
+    __output_type__ = "graphite"
+
+    def __init__(
+        self,
+        rules: list[dict],
+        url: str = None,
+        user_id=None,
+        api_key=None,
+        carbon_host: str = None,
+        carbon_port: int = None,
+        protocol: str = "plaintext",
+        interval: float = 10,
+        prefix: str = "",
+        tags: dict = None,
+        **kwargs,
+    ):
+        if not url and not carbon_host:
+            raise ValueError("graphite 输出需要配置 url 或 carbon_host")
+        self.extractor = MetricExtractor(rules)
+        self.aggregator = MetricAggregator(interval, prefix, tags)
+        self._client_args = dict(
+            url=url,
+            user_id=user_id,
+            api_key=api_key,
+            carbon_host=carbon_host,
+            carbon_port=carbon_port,
+            protocol=protocol,
+            **kwargs,
+        )
+        self.client: AGraphiteClient | CarbonClient | None = None
+        self.task: asyncio.Task | None = None
+
+    @staticmethod
+    def _create_client(
+        url, user_id, api_key, carbon_host, carbon_port, protocol, **kwargs
+    ):
+        if carbon_host:
+            return CarbonClient(carbon_host, carbon_port, protocol, **kwargs)
+        return AGraphiteClient(url, user_id, api_key, **kwargs)
+
+    def _start(self):
+        """客户端需要在事件循环中创建"""
+        if self.client is None:
+            self.client = self._create_client(**self._client_args)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(
+                self.aggregator.run(self.client), name="output_graphite_flush"
+            )
+
+    async def put(self, data: Stream):
+        self._start()
+        for rule, name, value, tags in self.extractor.extract(data):
+            getattr(self.aggregator, rule.kind)(name, value, tags)
+
+    async def close(self):
+        """推送当前周期已聚合的数据点, 等待发送完成后关闭客户端"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.client is None:
+            return
+        points = self.aggregator.flush()
+        if points:
+            await self.client.pushes(points)
+        await self.client.aclose()
+
+    def metrics(self) -> dict:
+        return {
+            "extracted_lines": self.extractor.lines,
+            "invalid_lines": self.extractor.errors,
+            "series": len(self.aggregator),
+            **(self.client.metrics() if self.client else {}),
+        }
+
+
+class OutputFile:
+    """以 NDJSON 格式写入本地文件, 每行: {"ts": 纳秒时间戳, "labels": {...}, "line": "..."}
+
+    Stream 先在内存中累积, 达到 buffer_size 或每 flush_interval 秒
+    在线程中编码并写入文件, 磁盘 IO 与压缩都不占用事件循环.
+    """
+
+    __output_type__ = "file"
+
+    def __init__(
+        self,
+        filename: str,
+        encoding: str = "utf-8",
+        mode: str = "a",
+        buffer_size: int = 1024**2,
+        flush_interval: float = 1,
+        **kwargs,
+    ):
+        """kwargs 传递给 RotatingFileWriter: fsync_interval, max_bytes, rotate_interval ..."""
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.writer = RotatingFileWriter(filename, mode, buffer_size, **kwargs)
+        self.buffer: list[Stream] = []
+        self.buffer_bytes = 0
+        self.lines = 0
+        self._lock = asyncio.Lock()
+        self.task: asyncio.Task | None = None
+
+    def encode(self, streams: list[Stream]) -> bytes:
+        return "".join(
+            json.dumps(
+                {"ts": ts, "labels": s.stream, "line": line}, ensure_ascii=False
+            )
+            + "\n"
+            for s in streams
+            for ts, line in zip(s.timestamps, s.lines)
+        ).encode(self.encoding)
+
+    def _write(self, streams: list[Stream]):
+        self.writer.write(self.encode(streams))
+
+    async def put(self, data: Stream):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._flush_timer(), name="output_file_flush")
+        self.buffer.append(data)
+        self.buffer_bytes += estimate_size(data)
+        if self.buffer_bytes >= self.buffer_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            streams, self.buffer, self.buffer_bytes = self.buffer, [], 0
+            if streams:
+                await asyncio.to_thread(self._write, streams)
+                self.lines += sum(len(s) for s in streams)
+
+    async def _flush_timer(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                await asyncio.to_thread(self.writer.sync)
+            except OSError as _e:
+                logger.warning("写入文件失败: %s", _e, exc_info=True)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.flush()
+        await asyncio.to_thread(self.writer.close)
+
+    def metrics(self) -> dict:
+        return {"lines": self.lines, "buffered": len(self.buffer), **self.writer.metrics()}
+
+
+class OutputQueue:
+    """每个输出独立的有界队列与发送 task, 一个输出阻塞或异常不会影响其他输出
+
+    overflow: 队列满时的处理方式
+        drop_oldest 丢弃最旧的数据 | drop_newest 丢弃新数据 | block 等待队列空出
+    """
+
+    OVERFLOW = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, output, size: int = 10000, overflow: str = "drop_oldest"):
+        if overflow not in self.OVERFLOW:
+            raise ValueError(f"overflow 必须是 {self.OVERFLOW} 之一: {overflow}")
+        self.output = output
+        self.overflow = overflow
+        self.queue = ABatchQueue(size)  # (入队时间, 数据)
+        self.total = 0
+        self.dropped = 0
+        self.errors = 0
+        self.lag = 0.0  # 最近一条数据从入队到输出完成的耗时
+        self.task: asyncio.Task | None = None
+        self.name = getattr(output, "__output_type__", "output")
+
+    def start(self, name: str):
+        if self.task is None or self.task.done():
+            if hasattr(self.output, "start"):
+                self.output.start()
+            self.task = asyncio.create_task(self._worker(), name=name)
+
+    async def put(self, data):
+        item = (time.monotonic(), data)
+        if self.overflow == "block":
+            await self.queue.put(item)
+        elif self.overflow == "drop_oldest":
+            self.dropped += self.queue.put_drop_oldest(item)
+        elif self.queue.full():
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(item)
+
+    async def _worker(self):
+        while True:
+            enqueued, data = await self.queue.get()
+            try:
+                await self.output.put(data)
+                self.total += 1
+            except Exception as _e:
+                self.errors += 1
+                logger.warning(
+                    "输出 %s 异常: %s", self.output.__output_type__, _e, exc_info=True
+                )
+            finally:
+                self.queue.task_done()
+            self.lag = time.monotonic() - enqueued
+
+    @property
+    def oldest_age(self) -> float:
+        """队列中最旧数据的等待时间"""
+        if self.queue.empty():
+            return 0.0
+        return time.monotonic() - self.queue._queue[0][0]
+
+    def metrics(self) -> dict:
+        return {
+            "queue": self.queue.qsize(),
+            "total": self.total,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "lag_seconds": round(self.lag, 3),
+            "oldest_seconds": round(self.oldest_age, 3),
+        }
+
+
 class Handler:
     input_class = {
         "clash": InputClash,
+        "ping": InputPing,
+        "tail": InputTail,
         "tailscale": InputTailscale,
     }
     output_class = {
         "loki": OutputLoki,
+        "loki_sharded": OutputLokiSharded,
+        "graphite": OutputGraphite,
+        "file": OutputFile,
     }
 
-    def __init__(self):
+    def __init__(self, queue_size: int = 10000):
+        """queue_size: 输入与处理器之间的队列长度, 满时输入等待"""
         self.inputs = []
         self.outputs: list[OutputLoki] = []
-        self.started_task = {}
+        self.output_queues: list[OutputQueue] = []
+        self.pipeline = Pipeline()
+        self.supervisor = TaskSupervisor()
+        self.started = False
+
+        # 配置项(规范化后的 JSON): 由该配置创建的输入/输出, 用于重新加载时比较差异
+        self._input_items: dict[str, InputBase] = {}
+        self._output_items: dict[str, OutputQueue] = {}
+        self._processors_config: list[dict] = []
+        self._output_seq = 0
+        self._retiring: set[asyncio.Task] = set()  # 关闭中的输出, 以及等待它们关闭后创建的输出
 
         self.total_stream = 0
 
-        self.queue: asyncio.Queue = asyncio.Queue()
+        self.queue: ABatchQueue = ABatchQueue(queue_size)
+
+    @staticmethod
+    def config_key(conf: dict) -> str:
+        return json.dumps(conf, sort_keys=True, default=str)
+
+    @classmethod
+    def config_items(cls, config: dict, section: str) -> dict[str, dict]:
+        """按 config_key 索引 inputs / outputs, 完全相同的两项无法区分, 视为配置错误"""
+        items = {}
+        for conf in config.get(section) or []:
+            key = cls.config_key(conf)
+            if key in items:
+                raise ValueError(f"{section} 中存在重复的配置: {conf}")
+            items[key] = conf
+        return items
+
+    @staticmethod
+    def _split_type(conf: dict) -> tuple[str, dict]:
+        conf = dict(conf)
+        return conf.pop("type"), conf
 
-    def register_input(self, type_: str, *args, **kwargs):
+    @classmethod
+    def from_config(cls, config: dict) -> "Handler":
+        """按 to_loki 配置文件的 inputs / processors / outputs 创建"""
+        handler = cls(config.get("queue_size") or 10000)
+        inputs = cls.config_items(config, "inputs")
+        outputs = cls.config_items(config, "outputs")
+        for k, i in inputs.items():
+            type_, kwargs = cls._split_type(i)
+            handler._input_items[k] = handler.register_input(
+                type_, **kwargs
+            )
+            logger.info("注册输入: %s, %s", type_, kwargs)
+        handler._processors_config = list(config.get("processors") or [])
+        for p in handler._processors_config:
+            type_, kwargs = cls._split_type(p)
+            handler.register_processor(type_, **kwargs)
+            logger.info("注册处理器: %s, %s", type_, kwargs)
+        for k, o in outputs.items():
+            type_, kwargs = cls._split_type(o)
+            handler._output_items[k] = handler.register_output(
+                type_, **kwargs
+            )
+            logger.info("注册输出: %s, %s", type_, kwargs)
+        return handler
+
+    def register_input(self, type_: str, *args, **kwargs) -> InputBase:
         """注册输入"""
-        self.inputs.append(self.input_class[type_](*args, **kwargs))
+        i = self.input_class[type_](*args, **kwargs)
+        self.inputs.append(i)
+        if self.started:
+            self._start_input(i)
+        return i
 
-    def register_output(self, type_: str, *args, **kwargs):
-        """注册输出"""
-        self.outputs.append(self.output_class[type_](*args, **kwargs))
+    def register_processor(self, type_: str, **kwargs):
+        """注册处理器, 按注册顺序在分发到输出之前执行"""
+        self.pipeline.add(type_, **kwargs)
 
-    @property
-    def task_names(self):
-        return [t.get_name() for t in asyncio.all_tasks()]
+    def _output_queue(self, type_: str, queue: dict = None) -> "OutputQueue":
+        q = OutputQueue(None, **(queue or {}))
+        q.name = f"{type_}_{self._output_seq}"
+        self._output_seq += 1
+        return q
+
+    def _create_output(self, type_: str, *args, queue: dict = None, **kwargs):
+        q = self._output_queue(type_, queue)
+        q.output = self.output_class[type_](*args, **kwargs)
+        return q
+
+    @classmethod
+    def _output_paths(cls, conf: dict) -> set[str]:
+        """输出使用的 spool_dir 与文件, 使用相同路径的两个输出不能同时运行"""
+        paths = {
+            os.path.normpath(str(conf[k])) for k in ("spool_dir", "filename") if conf.get(k)
+        }
+        for shard in conf.get("shards") or []:
+            paths |= cls._output_paths(shard)
+        return paths
+
+    def register_output(self, type_: str, *args, **kwargs) -> "OutputQueue":
+        """注册输出, queue 为该输出的队列配置: {size, overflow}"""
+        q = self._create_output(type_, *args, **kwargs)
+        self.outputs.append(q.output)
+        self.output_queues.append(q)
+        if self.started:
+            q.start(f"output_{q.name}")
+        return q
+
+    def start_outputs(self):
+        for q in self.output_queues:
+            if q.output is not None:
+                q.start(f"output_{q.name}")
+
+    @staticmethod
+    def _input_name(i: InputBase) -> str:
+        return f"input_{i.__input_type__}_{i.__hash__()}"
+
+    def _start_input(self, i: InputBase):
+        self.supervisor.add(self._input_name(i), partial(i.to_handle, self.queue))
+
+    async def reload(self, config: dict):
+        """按新的配置增加、删除变化的输入/输出, 没有变化的部分继续运行
+
+        先创建全部新的组件, 创建失败时抛出异常且不影响正在运行的配置.
+        与删除的输出使用相同 spool_dir / 文件的新输出, 在旧输出关闭后才创建,
+        期间分发给它的数据暂存在它的队列中.
+        """
+        if self._retiring:
+            await asyncio.wait(self._retiring)  # 上一次重新加载的输出还在关闭
+        new_inputs = self.config_items(config, "inputs")
+        new_outputs = self.config_items(config, "outputs")
+        processors = list(config.get("processors") or [])
+
+        added_inputs, added_outputs, deferred = {}, {}, {}
+        for k, c in new_inputs.items():
+            if k not in self._input_items:
+                type_, kwargs = self._split_type(c)
+                added_inputs[k] = self.input_class[type_](**kwargs)
+        removed_outputs = [k for k in self._output_items if k not in new_outputs]
+        busy_paths = set()
+        for k in removed_outputs:
+            busy_paths |= self._output_paths(json.loads(k))
+        for k, c in new_outputs.items():
+            if k in self._output_items:
+                continue
+            type_, kwargs = self._split_type(c)
+            if self._output_paths(c) & busy_paths:
+                q = self._output_queue(type_, kwargs.pop("queue", None))
+                added_outputs[k] = q
+                deferred[k] = (q, type_, kwargs)
+            else:
+                added_outputs[k] = self._create_output(type_, **kwargs)
+        pipeline = None
+        if self.config_key(processors) != self.config_key(self._processors_config):
+            pipeline = Pipeline()
+            for p in processors:
+                type_, kwargs = self._split_type(p)
+                pipeline.add(type_, **kwargs)
+
+        # 输入
+        for k in [k for k in self._input_items if k not in new_inputs]:
+            i = self._input_items.pop(k)
+            self.inputs.remove(i)
+            await self.supervisor.remove(self._input_name(i))
+            logger.info("删除输入: %s", k)
+        for k, i in added_inputs.items():
+            self._input_items[k] = i
+            self.inputs.append(i)
+            if self.started:
+                self._start_input(i)
+            logger.info("增加输入: %s", k)
+
+        # 处理器
+        if pipeline is not None:
+            self.pipeline, self._processors_config = pipeline, processors
+            logger.info("更新处理器: %s", processors)
+
+        # 输出: 新的输出立即开始接收数据, 删除的输出在后台发送完剩余数据后关闭
+        retiring = []
+        for k in removed_outputs:
+            q = self._output_items.pop(k)
+            self.output_queues.remove(q)
+            self.outputs.remove(q.output)
+            retiring.append(self._background(self._retire_output(q)))
+            logger.info("删除输出: %s", k)
+        for k, q in added_outputs.items():
+            self._output_items[k] = q
+            self.output_queues.append(q)
+            if k in deferred:
+                continue
+            self.outputs.append(q.output)
+            if self.started:
+                q.start(f"output_{q.name}")
+            logger.info("增加输出: %s", k)
+        if deferred:
+            self._background(self._create_deferred(retiring, deferred))
+
+    def _background(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+        return task
+
+    @staticmethod
+    async def _retire_output(q: "OutputQueue", timeout: float = 30):
+        try:
+            await asyncio.wait_for(q.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("输出 %s 在 %ds 内没有发送完剩余数据", q.name, timeout)
+        if q.task is not None:
+            q.task.cancel()
+            await asyncio.gather(q.task, return_exceptions=True)
+        try:
+            await q.output.close()
+        except Exception as _e:
+            logger.warning("关闭输出 %s 失败: %s", q.name, _e, exc_info=True)
+
+    async def _create_deferred(self, retiring: list[asyncio.Task], deferred: dict):
+        """旧输出关闭后创建使用相同路径的新输出"""
+        await asyncio.wait(retiring)
+        for k, (q, type_, kwargs) in deferred.items():
+            try:
+                q.output = self.output_class[type_](**kwargs)
+            except Exception as _e:
+                logger.error("创建输出 %s 失败: %s", k, _e, exc_info=True)
+                self._output_items.pop(k, None)
+                self.output_queues.remove(q)
+                continue
+            self.outputs.append(q.output)
+            if self.started:
+                q.start(f"output_{q.name}")
+            logger.info("增加输出: %s", k)
 
     async def push_to_output(self):
-        """将输入的数据推送到输出"""
+        """将输入的数据分发到每个输出的队列"""
         while True:
-            data = await self.queue.get()
-            self.total_stream += 1
-            for o in self.outputs:
-                await o.put(data)
+            for data in await self.queue.get_batch(500):
+                self.total_stream += 1
+                data = self.pipeline.process(data)
+                if data is None:
+                    continue
+                for q in self.output_queues:
+                    await q.put(data)
 
     async def start(self):
         """启动"""
 
+        self.start_outputs()
         asyncio.create_task(self.push_to_output())
         logger.info("创建数据分发task成功 。")
 
         asyncio.current_task().set_name("Main")
-        logger.info("启动看门狗")
+        self.started = True
+        for i in self.inputs:
+            self._start_input(i)
+        logger.info("已启动 %d 个输入", len(self.inputs))
+
         start_time, _stream = timestamp_s(), 0
         while True:
-            for i in self.inputs:
-                i: InputBase
-                name = f"input_{i.__input_type__}_{i.__hash__()}"
-                if name in self.task_names:
-                    continue
-                asyncio.create_task(
-                    i.to_handle(self.queue),
-                    name=name,
-                )
-                logger.info(f"创建输入 task %s", i.__input_type__)
-
             await asyncio.sleep(60)
             logger.info(
                 "持续运行时间: %s, 转发数据: %d, 最近一分钟转发数据: %d, 注册的队列大小: %s",
@@ -143,14 +764,25 @@ class Handler:
                 ", ".join(f"{k}: {v}" for k, v in self.queue_size().items()),
             )
             _stream = self.total_stream
-            logger.debug("当前所有的task: %s", self.task_names)
+            if self.pipeline:
+                logger.info("处理器状态: %s", self.pipeline.metrics())
+            logger.info("输入状态: %s", self.supervisor.metrics())
+            logger.info("输出状态: %s", self.metrics())
+
+    def metrics(self) -> dict:
+        return {
+            q.name: {
+                "output_queue": q.metrics(),
+                **(q.output.metrics() if hasattr(q.output, "metrics") else {}),
+            }
+            for q in self.output_queues
+        }
 
     def queue_size(self) -> dict:
         rest = {self.__class__.__name__: self.queue.qsize()}
         for i in self.inputs:
             if hasattr(i, "queue"):
                 rest[i.__input_type__] = i.queue.qsize()
-        for o in self.outputs:
-            if hasattr(o, "queue"):
-                rest[o.__output_type__] = o.queue.qsize()
+        for q in self.output_queues:
+            rest[f"output_{q.name}"] = q.queue.qsize()
         return rest
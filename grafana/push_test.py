@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : push_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/15 11:30
+"""
+import asyncio
+import gzip
+import json
+
+import httpx
+import pytest
+
+from .client_loki import Stream
+from .push import (
+    Handler,
+    InputTailscale,
+    OutputFile,
+    OutputGraphite,
+    OutputLoki,
+    OutputLokiSharded,
+)
+
+
+def test_output_loki_sharded_isolation():
+    async def main():
+        received = []
+        gate = asyncio.Event()
+
+        async def ok(request: httpx.Request):
+            received.append(json.loads(gzip.decompress(await request.aread())))
+            return httpx.Response(204)
+
+        async def down(request: httpx.Request):
+            await gate.wait()
+            return httpx.Response(204)
+
+        output = OutputLokiSharded(
+            shards=[
+                {"host": "a", "user_id": 1, "transport": httpx.MockTransport(ok)},
+                {"host": "b", "user_id": 1, "transport": httpx.MockTransport(down)},
+            ],
+            api_key="key",
+            capacity=1,
+            max_in_flight=1,
+            max_push_rate=10000,
+            queue_size=5,
+        )
+        targets = [f"node-{i}" for i in range(40)]
+        for t in targets:
+            await output.put(Stream({"type": "ping", "target": t}, [(1, "1")]))
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.05)
+        for t in output.workers.values():
+            t.cancel()
+        gate.set()
+        return output, targets, received
+
+    output, targets, received = asyncio.run(main())
+    shard_a = [
+        t
+        for t in targets
+        if output.ring.get_name(repr((("target", t), ("type", "ping")))) == "a/1"
+    ]
+    sent = [s["stream"]["target"] for r in received for s in r["streams"]]
+    assert sorted(sent) == sorted(shard_a)
+    metrics = output.metrics()
+    assert metrics["a/1"]["dropped"] == 0
+    assert metrics["b/1"]["dropped"] > 0
+
+
+def test_output_loki_sharded_close_after_drop():
+    async def main():
+        async def ok(request: httpx.Request):
+            return httpx.Response(204)
+
+        output = OutputLokiSharded(
+            shards=[{"host": "a", "user_id": 1, "transport": httpx.MockTransport(ok)}],
+            api_key="key",
+            queue_size=1,
+        )
+        for n in range(3):
+            await output.put(Stream({"type": "ping"}, [(n, str(n))]))
+        # 丢弃数据后队列的 join() 仍然可以结束
+        await asyncio.wait_for(output.close(timeout=5), 2)
+        return output
+
+    output = asyncio.run(main())
+    assert output.dropped["a/1"] == 2
+
+
+def test_output_loki_sharded_duplicate():
+    with pytest.raises(ValueError):
+        OutputLokiSharded(
+            shards=[{"host": "a", "user_id": 1}, {"host": "a", "user_id": 1}],
+            api_key="key",
+        )
+
+
+def test_output_graphite_rules():
+    async def main():
+        received = []
+
+        async def handle(reader, writer):
+            while line := await reader.readline():
+                received.append(line.decode())
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        output = OutputGraphite(
+            rules=[
+                {
+                    "match": {"type": "traffic"},
+                    "name": "clash.traffic",
+                    "fields": ["up", "down"],
+                    "kind": "counter",
+                },
+                {
+                    "match": {"type": "tailscale_ping"},
+                    "name": "tailscale.ping.ttl",
+                    "fields": ["."],
+                    "tags": ["target"],
+                    "kind": "timer",
+                },
+            ],
+            carbon_host="127.0.0.1",
+            carbon_port=server.sockets[0].getsockname()[1],
+            interval=60,
+        )
+        traffic = Stream({"type": "traffic"})
+        for up, down in ((1, 10), (2, 20), (3, 30)):
+            traffic.append(1, json.dumps({"type": "traffic", "up": up, "down": down}))
+        await output.put(traffic)
+        await output.put(Stream({"type": "tailscale_ping", "target": "a"}, [(1, "12")]))
+        await output.put(Stream({"type": "logs"}, [(1, "not json")]))
+        await output.close()  # 推送未到刷新周期的数据点
+        assert output.task.done() and output.client.task.done()
+        await asyncio.sleep(0.05)
+        server.close()
+        return output, received
+
+    output, received = asyncio.run(main())
+    values = {line.split()[0]: float(line.split()[1]) for line in received}
+    assert values["clash.traffic.up.count"] == 6
+    assert values["clash.traffic.down.count"] == 60
+    assert values["tailscale.ping.ttl.max;target=a"] == 12
+    assert output.metrics()["extracted_lines"] == 4
+
+
+def test_output_loki_close(tmp_path):
+    async def main():
+        received = []
+
+        async def handle(request: httpx.Request):
+            received.append(json.loads(gzip.decompress(await request.aread())))
+            return httpx.Response(204)
+
+        output = OutputLoki(
+            "loki",
+            1,
+            "key",
+            spool_dir=str(tmp_path),
+            transport=httpx.MockTransport(handle),
+        )
+        await output.put(Stream({"type": "ping"}, [(1, "1")]))
+        await output.close()
+        assert output._flusher.done() and output._replay_task.done()
+        assert output.client.is_closed
+        return received
+
+    received = asyncio.run(main())
+    assert [s["stream"]["type"] for r in received for s in r["streams"]] == ["ping"]
+    assert not list(tmp_path.iterdir())
+
+
+def test_input_tailscale_stop(monkeypatch):
+    async def status(self):
+        self.active_nodes = {"100.64.0.2": "peer"}
+
+    async def noop(self, *args):
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(InputTailscale, "update_ts_status", status)
+    monkeypatch.setattr(InputTailscale, "netcheck", noop)
+    monkeypatch.setattr(InputTailscale, "ping", noop)
+
+    async def main():
+        i = InputTailscale()
+        i.active_nodes = {"100.64.0.2": "peer"}
+        task = asyncio.create_task(i.to_handle(asyncio.Queue()))
+        await asyncio.sleep(0.3)
+        tasks = set(i.tasks)
+        assert i.ping_tasks and len(tasks) >= 3
+        task.cancel()
+        await asyncio.gather(task, *tasks, return_exceptions=True)
+        return tasks, i
+
+    tasks, i = asyncio.run(main())
+    assert all(t.cancelled() for t in tasks)
+    assert not i.tasks and not i.ping_tasks
+
+
+def test_handler_output_isolation():
+    class Fast:
+        __output_type__ = "fast"
+
+        def __init__(self):
+            self.received = []
+
+        async def put(self, data):
+            self.received.append(data)
+
+    class Stuck(Fast):
+        __output_type__ = "stuck"
+
+        async def put(self, data):
+            await asyncio.Event().wait()
+
+    async def main():
+        handler = Handler()
+        handler.output_class = {"fast": Fast, "stuck": Stuck}
+        handler.register_output("stuck", queue={"size": 10})
+        handler.register_output("fast", queue={"size": 10, "overflow": "block"})
+        handler.start_outputs()
+        task = asyncio.create_task(handler.push_to_output())
+        for i in range(100):
+            await handler.queue.put(i)
+        await asyncio.sleep(0.05)
+        task.cancel()
+        for q in handler.output_queues:
+            q.task.cancel()
+        return handler
+
+    handler = asyncio.run(main())
+    assert handler.outputs[1].received == list(range(100))
+    metrics = handler.metrics()
+    assert metrics["stuck_0"]["output_queue"]["dropped"] == 89
+    assert metrics["stuck_0"]["output_queue"]["oldest_seconds"] > 0
+    assert metrics["fast_1"]["output_queue"]["total"] == 100
+
+
+def test_handler_queue_bounded():
+    """Handler 队列满时输入等待, 不会无限缓存"""
+
+    async def main():
+        handler = Handler.from_config({"queue_size": 2})
+        for i in range(2):
+            await handler.queue.put(i)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(handler.queue.put(2), 0.05)
+        return handler.queue.qsize()
+
+    assert asyncio.run(main()) == 2
+
+
+def test_output_file(tmp_path):
+    async def main():
+        output = OutputFile(str(tmp_path / "out.ndjson"), buffer_size=200, flush_interval=10)
+        await output.put(Stream({"type": "logs"}, [(1, "短"), (2, "b")]))
+        assert output.lines == 0  # 未达到 buffer_size
+        await output.put(Stream({"type": "traffic"}, [(3, "x" * 300)]))
+        assert output.lines == 3
+        await output.put(Stream({"type": "logs"}, [(4, "c")]))
+        await output.close()
+        return output
+
+    output = asyncio.run(main())
+    lines = (tmp_path / "out.ndjson").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(l) for l in lines[:2]] == [
+        {"ts": 1, "labels": {"type": "logs"}, "line": "短"},
+        {"ts": 2, "labels": {"type": "logs"}, "line": "b"},
+    ]
+    assert len(lines) == 4
+    assert output.metrics()["lines"] == 4
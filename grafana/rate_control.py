@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : rate_control.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/12 22:10
+
+AIMD 发送速率控制: 成功时线性提升速率与批次大小, 被限流时成倍降低.
+"""
+import asyncio
+import datetime
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger("host-service.grafana.rate-control")
+
+
+def parse_retry_after(value: str | None) -> float:
+    """解析 Retry-After 请求头(秒数或 HTTP 日期), 返回需要等待的秒数"""
+    if not value:
+        return 0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, when.timestamp() - time.time())
+
+
+class AimdController:
+    def __init__(
+        self,
+        max_rate: float = 20,
+        min_rate: float = 0.2,
+        increase: float = 1,
+        decrease: float = 0.5,
+        min_batch_scale: float = 0.1,
+        backoff_base: float = 1,
+        backoff_max: float = 60,
+    ):
+        self.max_rate = max_rate  # 每秒最多推送次数
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.min_batch_scale = min_batch_scale
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.rate = max_rate
+        self.batch_scale = 1.0  # 批次大小相对配置值的比例
+        self.blocked_until = 0.0  # Retry-After 要求的暂停截止时间 (monotonic)
+        self.throttled_total = 0
+        self.retries = 0
+        self._next_send = 0.0
+
+    @property
+    def throttled(self) -> bool:
+        return self.rate < self.max_rate or time.monotonic() < self.blocked_until
+
+    def metrics(self) -> dict:
+        return {
+            "throttled": self.throttled,
+            "send_rate": round(self.rate, 3),
+            "batch_scale": round(self.batch_scale, 3),
+            "throttled_total": self.throttled_total,
+            "retries": self.retries,
+        }
+
+    async def wait(self) -> None:
+        """等待到允许发送的时间"""
+        now = time.monotonic()
+        start = max(now, self._next_send, self.blocked_until)
+        self._next_send = start + 1 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.increase)
+        self.batch_scale = min(1.0, self.batch_scale + 0.1)
+
+    def on_throttle(self, retry_after: float = 0) -> None:
+        """收到 429 或 5xx"""
+        self.throttled_total += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self.batch_scale = max(self.min_batch_scale, self.batch_scale * self.decrease)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        logger.info(
+            "推送被限流, 速率降为 %.2f/s, 批次比例 %.2f, Retry-After: %.1fs",
+            self.rate,
+            self.batch_scale,
+            retry_after,
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """带抖动的指数退避 (full jitter)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : rate_control_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/12 22:10
+"""
+import time
+from email.utils import formatdate
+
+from .rate_control import AimdController, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) == 0
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after("bad") == 0
+    assert 8 < parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+
+
+def test_aimd():
+    rate = AimdController(max_rate=10, min_rate=1, min_batch_scale=0.2)
+    for _ in range(5):
+        rate.on_throttle()
+    assert rate.rate == 1 and rate.batch_scale == 0.2 and rate.throttled
+
+    for _ in range(20):
+        rate.on_success()
+    assert rate.rate == 10 and rate.batch_scale == 1 and not rate.throttled
+
+
+def test_retry_after_blocks():
+    rate = AimdController()
+    rate.on_throttle(30)
+    assert rate.blocked_until > time.monotonic() + 29
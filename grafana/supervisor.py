@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : supervisor.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/24 20:10
+
+事件驱动的 task 看护.
+
+task 结束时由 done callback 立即安排重启, 不需要周期性扫描 asyncio.all_tasks().
+连续快速退出时按指数退避重启, 短时间内重启次数过多时标记为 crash loop.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine
+
+logger = logging.getLogger("host-service.grafana.supervisor")
+
+Factory = Callable[[], Coroutine[Any, Any, Any]]
+
+
+class _Supervised:
+    __slots__ = (
+        "name",
+        "factory",
+        "task",
+        "handle",
+        "started",
+        "restarts",
+        "failures",
+        "recent",
+        "last_error",
+        "stopped",
+    )
+
+    def __init__(self, name: str, factory: Factory):
+        self.name = name
+        self.factory = factory
+        self.task: asyncio.Task | None = None
+        self.handle: asyncio.TimerHandle | None = None  # 等待中的重启
+        self.started = 0.0
+        self.restarts = 0
+        self.failures = 0  # 连续快速退出的次数, 用于计算退避
+        self.recent: deque[float] = deque()  # 最近的退出时间
+        self.last_error: str | None = None
+        self.stopped = False
+
+
+class TaskSupervisor:
+    def __init__(
+        self,
+        backoff_base: float = 1,
+        backoff_max: float = 60,
+        stable_after: float = 60,
+        crash_loop_restarts: int = 5,
+        crash_loop_window: float = 300,
+    ):
+        """
+        :param stable_after: 运行超过该时间(秒)后退出的 task 立即重启, 并清零退避
+        :param crash_loop_restarts: crash_loop_window 秒内退出超过该次数视为 crash loop,
+                                    按 backoff_max 间隔重启
+        """
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.crash_loop_restarts = crash_loop_restarts
+        self.crash_loop_window = crash_loop_window
+        self._tasks: dict[str, _Supervised] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def add(self, name: str, factory: Factory) -> None:
+        """添加并立即启动, factory 每次调用返回一个新的协程"""
+        if name in self._tasks:
+            raise ValueError(f"task {name} 已存在")
+        s = self._tasks[name] = _Supervised(name, factory)
+        self._spawn(s)
+
+    def _spawn(self, s: _Supervised):
+        s.handle = None
+        if s.stopped:
+            return
+        s.started = time.monotonic()
+        s.task = asyncio.create_task(s.factory(), name=s.name)
+        s.task.add_done_callback(lambda t: self._on_done(s, t))
+        logger.info("启动 task %s", s.name)
+
+    def _crash_loop(self, s: _Supervised, now: float) -> bool:
+        while s.recent and now - s.recent[0] > self.crash_loop_window:
+            s.recent.popleft()
+        return len(s.recent) > self.crash_loop_restarts
+
+    def _on_done(self, s: _Supervised, task: asyncio.Task):
+        if s.stopped or task is not s.task:
+            return
+        now = time.monotonic()
+        if task.cancelled():
+            s.last_error = "cancelled"
+        elif task.exception() is not None:
+            s.last_error = repr(task.exception())
+        else:
+            s.last_error = "exited"
+
+        if now - s.started >= self.stable_after:
+            s.failures = 0
+        s.recent.append(now)
+        if self._crash_loop(s, now):
+            delay = self.backoff_max
+            logger.error(
+                "task %s 在 %.0fs 内退出了 %d 次 (crash loop), %.0fs 后重启: %s",
+                s.name,
+                self.crash_loop_window,
+                len(s.recent),
+                delay,
+                s.last_error,
+            )
+        else:
+            delay = min(self.backoff_max, self.backoff_base * (2**s.failures - 1))
+            logger.warning(
+                "task %s 退出: %s, %.1fs 后重启",
+                s.name,
+                s.last_error,
+                delay,
+                exc_info=task.exception() if not task.cancelled() else None,
+            )
+        s.failures += 1
+        s.restarts += 1
+        s.handle = asyncio.get_running_loop().call_later(delay, self._spawn, s)
+
+    async def remove(self, name: str) -> None:
+        """停止并移除, 不再重启"""
+        s = self._tasks.pop(name, None)
+        if s is None:
+            return
+        s.stopped = True
+        if s.handle is not None:
+            s.handle.cancel()
+        if s.task is not None and not s.task.done():
+            s.task.cancel()
+            try:
+                await s.task
+            except (asyncio.CancelledError, Exception):
+                pass
+        logger.info("停止 task %s", name)
+
+    async def stop(self) -> None:
+        for name in list(self._tasks):
+            await self.remove(name)
+
+    def state(self, name: str) -> str:
+        s = self._tasks[name]
+        if s.task is not None and not s.task.done():
+            return "running"
+        if self._crash_loop(s, time.monotonic()):
+            return "crash_loop"
+        return "backoff"
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            name: {
+                "state": self.state(name),
+                "uptime": round(now - s.started, 1) if self.state(name) == "running" else 0,
+                "restarts": s.restarts,
+                "last_error": s.last_error,
+            }
+            for name, s in self._tasks.items()
+        }
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : supervisor_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/24 20:30
+"""
+import asyncio
+
+from .supervisor import TaskSupervisor
+
+
+def test_restart_on_failure():
+    async def main():
+        runs = []
+
+        async def flaky():
+            runs.append(asyncio.get_running_loop().time())
+            if len(runs) < 3:
+                raise RuntimeError("boom")
+            await asyncio.Event().wait()
+
+        sup = TaskSupervisor(backoff_base=0.02)
+        sup.add("flaky", flaky)
+        await asyncio.sleep(0.2)
+        metrics = sup.metrics()
+        await sup.stop()
+        return runs, metrics
+
+    runs, metrics = asyncio.run(main())
+    assert len(runs) == 3
+    assert runs[1] - runs[0] < 0.02  # 第一次退出立即重启
+    assert runs[2] - runs[1] >= 0.02  # 之后按指数退避
+    assert metrics["flaky"]["state"] == "running"
+    assert metrics["flaky"]["restarts"] == 2
+    assert metrics["flaky"]["last_error"] == "RuntimeError('boom')"
+
+
+def test_crash_loop_and_remove():
+    async def main():
+        runs = []
+
+        async def crash():
+            runs.append(1)
+            raise ValueError
+
+        sup = TaskSupervisor(backoff_base=0, backoff_max=10, crash_loop_restarts=3)
+        sup.add("crash", crash)
+        await asyncio.sleep(0.05)
+        state = sup.state("crash")
+        await sup.remove("crash")
+        return runs, state, sup
+
+    runs, state, sup = asyncio.run(main())
+    assert len(runs) == 4  # 第 4 次退出后进入 crash loop, 等待 backoff_max
+    assert state == "crash_loop"
+    assert "crash" not in sup
@@ -0,0 +1,397 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : tail.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/26 20:20
+
+跟踪多个文件(支持 glob)的追加内容, 类似 tail -F.
+
+- Linux 上通过 inotify 监听所在目录, 其他平台或 inotify 不可用时定期 stat 轮询.
+- 按大块读取, 只对完整的行解码一次, 行尾不完整的部分以 bytes 保留到下次读取.
+- 文件被轮转 (inode 变化) 时读完旧文件再打开新文件, 被截断时从头读取.
+- 已输出的字节偏移量定期写入 checkpoint 文件, 重启后从上次的位置继续.
+  偏移量在 follow() 的调用方取走一批行后就会提交, 不等待下游确认送达:
+  进程异常退出时, 已提交但仍在下游队列或缓存中的行会丢失 (最多一次).
+- checkpoint 在 follow() 开始时才读取, 重新加载配置时替换的实例可以读到旧实例关闭时写入的位置.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import glob
+import json
+import logging
+import os
+import struct
+import time
+from pathlib import Path
+from typing import AsyncIterator
+
+logger = logging.getLogger("host-service.grafana.tail")
+
+# inotify 事件
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """通过 ctypes 调用 libc 的 inotify, 不可用时构造函数抛出 OSError"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify 不可用")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.watches: dict[int, str] = {}  # wd: 目录
+
+    def add_watch(self, directory: str) -> None:
+        if directory in self.watches.values():
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            logger.warning("监听目录 %s 失败: errno %d", directory, ctypes.get_errno())
+            return
+        self.watches[wd] = directory
+
+    def read(self) -> list[tuple[str, int]]:
+        """读取事件, 返回 [(路径, mask)], 路径为空字符串表示事件队列溢出"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append(("", mask))
+                elif wd in self.watches and name:
+                    events.append((os.path.join(self.watches[wd], os.fsdecode(name)), mask))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _File:
+    __slots__ = ("path", "fp", "dev", "ino", "offset", "partial", "missing")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fp = None
+        self.dev = self.ino = 0
+        self.offset = 0  # 已输出的完整行之后的偏移量
+        self.partial = b""  # 不完整的行尾
+        self.missing = 0.0  # 发现文件被删除或改名的时间
+
+    def open(self, offset: int = 0) -> None:
+        self.close()
+        self.fp = open(self.path, "rb", buffering=0)
+        st = os.fstat(self.fp.fileno())
+        self.dev, self.ino = st.st_dev, st.st_ino
+        self.offset = min(offset, st.st_size)
+        self.partial = b""
+        self.fp.seek(self.offset)
+
+    def close(self) -> None:
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+class FileTailer:
+    def __init__(
+        self,
+        paths: list[str],
+        checkpoint: str = None,
+        from_beginning: bool = False,
+        chunk_size: int = 1024**2,
+        max_read: int = 8 * 1024**2,
+        max_line: int = 1024**2,
+        poll_interval: float = 1,
+        rescan_interval: float = 10,
+        checkpoint_interval: float = 5,
+        missing_grace: float = 5,
+        encoding: str = "utf-8",
+        use_inotify: bool = True,
+    ):
+        """
+        :param paths: 文件路径或 glob
+        :param checkpoint: 保存读取偏移量的文件, None 为不保存
+        :param from_beginning: 首次发现(没有 checkpoint)的已有文件是否从头读取, 否则从末尾开始.
+                               启动后新出现的文件总是从头读取
+        :param chunk_size: 每次读取的字节数
+        :param max_read: 每个文件每轮最多读取的字节数, 避免一个文件占满一轮
+        :param max_line: 单行的最大字节数, 超出时强制截断为一行
+        :param poll_interval: 没有 inotify 时 stat 轮询的间隔
+        :param rescan_interval: 重新匹配 glob 的间隔 (inotify 可用时还会在目录变化时立即匹配)
+        :param missing_grace: 文件被删除或改名后继续读取的时间(秒), 之后关闭并不再跟踪
+        """
+        self.patterns = [os.path.expanduser(p) for p in paths]
+        self.checkpoint = Path(checkpoint) if checkpoint else None
+        self.from_beginning = from_beginning
+        self.chunk_size = chunk_size
+        self.max_read = max_read
+        self.max_line = max_line
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.missing_grace = missing_grace
+        self.encoding = encoding
+        self.use_inotify = use_inotify
+
+        self.files: dict[str, _File] = {}
+        self.lines = 0
+        self.rotations = 0
+        self.truncations = 0
+        self._dirty: set[str] = set()
+        self._wake = asyncio.Event()
+        self._inotify: Inotify | None = None
+        self._saved: dict[str, dict] | None = None  # follow() 开始时从 checkpoint 读取
+        self._last_checkpoint = time.monotonic()
+
+    # checkpoint
+
+    def _load_checkpoint(self) -> dict[str, dict]:
+        if self.checkpoint is None or not self.checkpoint.exists():
+            return {}
+        try:
+            return json.loads(self.checkpoint.read_text(encoding="utf8"))
+        except (OSError, ValueError) as _e:
+            logger.warning("读取 checkpoint %s 失败: %s", self.checkpoint, _e)
+            return {}
+
+    def offsets(self) -> dict[str, dict]:
+        return {
+            f.path: {"dev": f.dev, "ino": f.ino, "offset": f.offset}
+            for f in self.files.values()
+            if f.fp is not None
+        }
+
+    def save_checkpoint(self) -> None:
+        if self.checkpoint is None:
+            return
+        self.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.checkpoint.with_name(self.checkpoint.name + ".tmp")
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(self.offsets(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(self.checkpoint)
+
+    # 文件发现
+
+    def _match(self) -> set[str]:
+        paths = set()
+        for pattern in self.patterns:
+            paths.update(p for p in glob.glob(pattern) if os.path.isfile(p))
+        return paths
+
+    def _watch_dirs(self) -> set[str]:
+        dirs = {os.path.dirname(p) or "." for p in self.files}
+        for pattern in self.patterns:
+            d = os.path.dirname(pattern) or "."
+            if not glob.has_magic(d) and os.path.isdir(d):
+                dirs.add(d)
+        return dirs
+
+    def _open_new(self, path: str, initial: bool) -> None:
+        f = _File(path)
+        try:
+            f.open()
+        except OSError as _e:
+            logger.warning("打开文件 %s 失败: %s", path, _e)
+            return
+        saved = self._saved.pop(path, None)
+        if saved and (saved["dev"], saved["ino"]) == (f.dev, f.ino):
+            f.open(saved["offset"])
+        elif initial and not self.from_beginning and not saved:
+            f.open(os.fstat(f.fp.fileno()).st_size)
+        self.files[path] = f
+        self._dirty.add(path)
+        logger.info("开始跟踪文件 %s, offset: %d", path, f.offset)
+
+    def rescan(self, initial: bool = False) -> None:
+        for path in self._match() - self.files.keys():
+            self._open_new(path, initial)
+        if self._inotify is not None:
+            for d in self._watch_dirs():
+                self._inotify.add_watch(d)
+
+    # 读取
+
+    def _split(self, f: _File, data: bytes) -> list[str]:
+        data = f.partial + data
+        end = data.rfind(b"\n")
+        if end < 0:
+            if len(data) < self.max_line:
+                f.partial = data
+                return []
+            end = len(data)  # 超长的行强制截断
+        f.partial = data[end + 1 :]
+        return data[:end].decode(self.encoding, "replace").split("\n")
+
+    def _read(self, f: _File) -> tuple[list[str], bool]:
+        """读取文件的新内容, 返回 (完整的行, 是否还有未读完的内容)"""
+        lines, read = [], 0
+        while read < self.max_read:
+            chunk = f.fp.read(self.chunk_size)
+            if not chunk:
+                return lines, False
+            read += len(chunk)
+            lines.extend(self._split(f, chunk))
+        return lines, True
+
+    def _check(self, f: _File) -> tuple[list[str], bool]:
+        """处理轮转/截断并读取, 在线程中执行"""
+        if f.fp is None:
+            f.open()  # 上次重新打开失败
+        lines, more = self._read(f)
+        if more:
+            return lines, True
+        try:
+            st = os.stat(f.path)
+        except FileNotFoundError:
+            # 已被删除或改名: 等待一段时间, 期间新文件出现时按轮转处理, 否则关闭
+            now = time.monotonic()
+            if not f.missing:
+                f.missing = now
+            elif now - f.missing >= self.missing_grace:
+                if f.partial:
+                    lines.append(f.partial.decode(self.encoding, "replace"))
+                    f.partial = b""
+                f.close()
+            return lines, False
+        f.missing = 0.0
+        if (st.st_dev, st.st_ino) != (f.dev, f.ino):
+            # 旧文件已读完, 换成新文件
+            if f.partial:
+                lines.append(f.partial.decode(self.encoding, "replace"))
+            self.rotations += 1
+            logger.info("文件 %s 已轮转, 打开新文件", f.path)
+            f.open()
+            return lines, True
+        if st.st_size < f.fp.tell():
+            self.truncations += 1
+            logger.info("文件 %s 被截断, 从头读取", f.path)
+            f.open()
+            return lines, True
+        return lines, False
+
+    def _commit(self, f: _File) -> None:
+        if f.fp is not None:
+            f.offset = f.fp.tell() - len(f.partial)
+
+    def _on_inotify(self) -> None:
+        for path, mask in self._inotify.read():
+            if not path:  # 事件队列溢出, 检查全部文件
+                self._dirty.update(self.files)
+                self._dirty.add("")
+            elif path in self.files:
+                self._dirty.add(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                self._dirty.add("")  # 新文件, 重新匹配 glob
+        self._wake.set()
+
+    def _start_inotify(self) -> None:
+        if not self.use_inotify:
+            return
+        try:
+            self._inotify = Inotify()
+        except OSError as _e:
+            logger.info("inotify 不可用 (%s), 使用 stat 轮询", _e)
+            return
+        asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_inotify)
+
+    def close(self) -> None:
+        """停止跟踪; 偏移量放回 _saved, 再次 follow() 时从 checkpoint 的位置继续"""
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+        if self._saved is None:
+            return  # 还没有开始跟踪, 不能用空的偏移量覆盖 checkpoint
+        self.save_checkpoint()
+        self._saved.update(self.offsets())
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+        self._dirty.clear()
+
+    async def follow(self) -> AsyncIterator[tuple[str, list[str]]]:
+        """持续产生 (文件路径, 新的行); 每次 yield 返回后对应的偏移量才会写入 checkpoint"""
+        self._wake = asyncio.Event()
+        if self._saved is None:
+            self._saved = await asyncio.to_thread(self._load_checkpoint)
+        self._start_inotify()
+        self.rescan(initial=True)
+        # 有 inotify 时轮询只作为兜底
+        poll = self.poll_interval if self._inotify is None else self.rescan_interval
+        last_rescan = time.monotonic()
+        try:
+            while True:
+                if not self._dirty:
+                    timeout = poll
+                    if any(f.missing for f in self.files.values()):
+                        timeout = min(poll, self.missing_grace)
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        self._dirty.update(self.files)
+                    self._wake.clear()
+                now = time.monotonic()
+                if "" in self._dirty or now - last_rescan >= self.rescan_interval:
+                    self._dirty.discard("")
+                    await asyncio.to_thread(self.rescan)
+                    last_rescan = now
+
+                dirty, self._dirty = self._dirty, set()
+                for path in dirty:
+                    f = self.files.get(path)
+                    if f is None:
+                        continue
+                    try:
+                        lines, more = await asyncio.to_thread(self._check, f)
+                    except OSError as _e:
+                        logger.warning("读取文件 %s 失败: %s", path, _e)
+                        continue
+                    if more:
+                        self._dirty.add(path)
+                    if lines:
+                        self.lines += len(lines)
+                        yield path, lines
+                    self._commit(f)
+                    if f.fp is None and f.missing:
+                        del self.files[path]
+                        logger.info("文件 %s 已被删除, 停止跟踪", path)
+
+                if now - self._last_checkpoint >= self.checkpoint_interval:
+                    await asyncio.to_thread(self.save_checkpoint)
+                    self._last_checkpoint = now
+        finally:
+            self.close()
+
+    def metrics(self) -> dict:
+        return {
+            "files": len(self.files),
+            "lines": self.lines,
+            "rotations": self.rotations,
+            "truncations": self.truncations,
+            "inotify": self._inotify is not None,
+        }
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : tail_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/26 20:40
+"""
+import asyncio
+import json
+import os
+
+import pytest
+
+from .tail import FileTailer
+
+
+async def _collect(tailer: FileTailer, n: int, timeout: float = 5) -> list[str]:
+    """从 follow() 中读取至少 n 行后停止"""
+    lines = []
+
+    async def consume():
+        async for _, batch in tailer.follow():
+            lines.extend(batch)
+
+    task = asyncio.create_task(consume())
+    try:
+        async with asyncio.timeout(timeout):
+            while len(lines) < n:
+                await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    return lines
+
+
+def _tailer(tmp_path, **kwargs) -> FileTailer:
+    kwargs.setdefault("checkpoint", str(tmp_path / "tail.json"))
+    return FileTailer([str(tmp_path / "*.log")], poll_interval=0.05, **kwargs)
+
+
+def test_split_partial_lines(tmp_path):
+    log = tmp_path / "a.log"
+    log.write_bytes(b"")
+
+    async def main():
+        t = _tailer(tmp_path, chunk_size=4)
+        task = asyncio.create_task(_collect(t, 3))
+        await asyncio.sleep(0.2)
+        with open(log, "ab") as f:
+            f.write("第一行\nsec".encode())
+            f.flush()
+            await asyncio.sleep(0.2)
+            f.write(b"ond\nthird\npart")
+        return await task
+
+    assert asyncio.run(main()) == ["第一行", "second", "third"]
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_rotation_and_truncation(tmp_path, use_inotify):
+    log = tmp_path / "app.log"
+    log.write_bytes(b"old\n")
+
+    async def main():
+        t = _tailer(tmp_path, use_inotify=use_inotify)
+        task = asyncio.create_task(_collect(t, 4))
+        await asyncio.sleep(0.2)
+        with open(log, "ab") as f:
+            f.write(b"a\nb\n")
+        os.rename(log, tmp_path / "app.log.1")
+        log.write_bytes(b"c1\n")
+        await asyncio.sleep(0.3)
+        log.write_bytes(b"d\n")  # 截断
+        return await task, t.rotations
+
+    lines, rotations = asyncio.run(main())
+    # 启动前已有的内容从末尾开始
+    assert lines == ["a", "b", "c1", "d"]
+    assert rotations == 1
+
+
+def test_checkpoint_resume(tmp_path):
+    log = tmp_path / "app.log"
+    log.write_bytes(b"1\n2\n3")
+
+    t = _tailer(tmp_path, from_beginning=True)
+    assert asyncio.run(_collect(t, 2)) == ["1", "2"]
+    saved = json.loads((tmp_path / "tail.json").read_text())
+    assert saved[str(log)]["offset"] == 4  # 不完整的行不计入
+
+    with open(log, "ab") as f:
+        f.write(b"\n4\n")
+    t = _tailer(tmp_path, from_beginning=True)
+    assert asyncio.run(_collect(t, 2)) == ["3", "4"]
+
+    # 停止期间被轮转的文件从头读取
+    os.rename(log, tmp_path / "app.log.1")
+    log.write_bytes(b"5\n")
+    t = _tailer(tmp_path)
+    assert asyncio.run(_collect(t, 1)) == ["5"]
+
+
+def test_restart_same_instance(tmp_path):
+    """supervisor 重启同一个 InputTail 时从上次的位置继续"""
+    log = tmp_path / "app.log"
+    log.write_bytes(b"1\n2\n")
+
+    async def main():
+        t = _tailer(tmp_path, from_beginning=True)
+        first = await _collect(t, 2)
+        with open(log, "ab") as f:
+            f.write(b"3\n")
+        return first, await _collect(t, 1)
+
+    assert asyncio.run(main()) == (["1", "2"], ["3"])
+
+
+def test_checkpoint_loaded_on_follow(tmp_path):
+    """重新加载配置时替换的实例先于旧实例关闭创建, 也从旧实例关闭时的位置继续"""
+    log = tmp_path / "app.log"
+    log.write_bytes(b"1\n2\n")
+
+    async def main():
+        old = _tailer(tmp_path, from_beginning=True)
+        new = _tailer(tmp_path, from_beginning=True)
+        first = await _collect(old, 2)
+        with open(log, "ab") as f:
+            f.write(b"3\n")
+        return first, await _collect(new, 1)
+
+    assert asyncio.run(main()) == (["1", "2"], ["3"])
+
+
+def test_deleted_file_closed(tmp_path):
+    log = tmp_path / "b.log"
+    log.write_bytes(b"")
+
+    async def main():
+        t = _tailer(tmp_path, missing_grace=0.1)
+        task = asyncio.create_task(_collect(t, 2))
+        await asyncio.sleep(0.2)
+        log.write_bytes(b"last\n")
+        await asyncio.sleep(0.2)
+        os.remove(log)
+        await asyncio.sleep(0.5)
+        tracked = str(log) in t.files
+        log.write_bytes(b"new\n")  # 重新出现的文件作为新文件从头读取
+        return await task, tracked
+
+    lines, tracked = asyncio.run(main())
+    assert lines == ["last", "new"]
+    assert not tracked
@@ -16,7 +16,7 @@ from typing import AsyncIterable
 
 from grafana.client_loki import Stream, LokiClient
 from health.ping import a_ping_ttl
-from tools import getencoding
+from tools import getencoding, ABatchQueue
 
 logger = logging.getLogger("host-service.tailscale.connect_status")
 
@@ -50,8 +50,10 @@ class Tailscale:
         self.name_prefix = f"tailscale_"
         logger.info("tailscale self IP: %s", self.self_ip)
 
-        self.queue = asyncio.Queue()
+        self.queue = ABatchQueue()
         self.active_nodes: dict[str, str] = {}  # ip: hostname
+        self.ping_tasks: dict[str, asyncio.Task] = {}  # ip: task
+        self.tasks: set[asyncio.Task] = set()  # run() 创建的后台任务
 
     async def update_ts_status(self):
         """更新Tailscale的状态"""
@@ -117,9 +119,10 @@ class Tailscale:
     async def create_pings(self):
         """上报当前节点与其他节点的连接状态"""
         for node in self.active_nodes.keys():
-            name = f"{self.name_prefix}_ping_{node}"
-            if name not in [t.get_name() for t in asyncio.all_tasks()]:
-                asyncio.create_task(self.ping(node), name=name)
+            task = self.ping_tasks.get(node)
+            if task is None or task.done():
+                name = f"{self.name_prefix}_ping_{node}"
+                self.ping_tasks[node] = self._create_task(self.ping(node), name)
                 logger.debug("创建一个ping任务: %s", name)
             await asyncio.sleep(0.1)
 
@@ -127,46 +130,56 @@ class Tailscale:
         """转换为loki格式"""
         logger.info("开始将Tailscale数据转换为Loki格式 ...")
         while True:
-            await asyncio.sleep(0.001)
             logger.debug("tailscale to_loki queue size: %d", self.queue.qsize())
-            try:
-                time_ns, data = await self.queue.get()
-                stream = dict(
-                    type=data["type"],
-                    source=self.hostname,
-                )
-                if "target" in data:
-                    stream.update(target=self.active_nodes.get(data["target"]))
-
-                value = json.dumps(data["ttl"]) if "ttl" in data else json.dumps(data)
-                logger.debug("tailscale to_loki stream=%s, data=%s", stream, value)
-                yield Stream(stream=stream, values=[(str(time_ns), value)])
-            except Exception as _e:
-                logger.warning("tailscale to_loki error: %s", _e, exc_info=True)
+            for time_ns, data in await self.queue.get_batch(500):
+                try:
+                    stream = dict(
+                        type=data["type"],
+                        source=self.hostname,
+                    )
+                    if "target" in data:
+                        stream.update(target=self.active_nodes.get(data["target"]))
+
+                    value = (
+                        json.dumps(data["ttl"]) if "ttl" in data else json.dumps(data)
+                    )
+                    logger.debug("tailscale to_loki stream=%s, data=%s", stream, value)
+                    yield Stream(stream, [(time_ns, value)])
+                except Exception as _e:
+                    logger.warning("tailscale to_loki error: %s", _e, exc_info=True)
+
+    def _create_task(self, coro, name: str) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
 
     def run(self):
         """每分钟创建一个ping任务"""
 
         async def _run():
             while True:
-                asyncio.create_task(
-                    self.update_ts_status(), name=f"{self.name_prefix}_update_status"
-                )
-                asyncio.create_task(
-                    self.netcheck(), name=f"{self.name_prefix}_netcheck"
+                self._create_task(
+                    self.update_ts_status(), f"{self.name_prefix}_update_status"
                 )
+                self._create_task(self.netcheck(), f"{self.name_prefix}_netcheck")
                 n = 5
                 while not self.active_nodes and n:
                     n -= 1
                     await asyncio.sleep(1)
-                asyncio.create_task(
-                    self.create_pings(), name=f"{self.name_prefix}_pings"
-                )
+                self._create_task(self.create_pings(), f"{self.name_prefix}_pings")
                 await asyncio.sleep(60)
 
-        asyncio.create_task(_run(), name=f"{self.name_prefix}_run")
+        self._create_task(_run(), f"{self.name_prefix}_run")
         logger.info("tailscale run() started success.")
 
+    def stop(self):
+        """取消 run() 创建的全部后台任务"""
+        for task in list(self.tasks):
+            task.cancel()
+        self.ping_tasks.clear()
+        logger.info("tailscale stopped.")
+
     async def get_all(self, lens=20) -> AsyncIterable[list]:
         """获取所有的ping信息"""
         rest, _len = [], 0
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : workers.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/21 19:50
+
+多进程运行 Handler.
+
+to_loki 配置中 workers 大于 1 时, inputs 按顺序轮流分配到各个进程,
+每个进程运行独立的事件循环与完整的 processors / outputs.
+多核上的加速比尚未测量, 调大 workers 之前先在目标机器上运行 bin/bench_workers.py.
+
+配置 worker_label: true 时, 各进程推送的 Stream 带有 worker 标签, 同一个 Stream
+只由一个进程推送, 保证每个 Stream 的时间戳顺序; 默认关闭, 此时需要保证不同进程的
+inputs 产生不同的标签集合. Graphite 指标在每个进程中独立聚合, 始终带有 worker 标签,
+避免不同进程同名的数据点互相覆盖.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Callable
+
+from .push import Handler
+
+logger = logging.getLogger("host-service.grafana.workers")
+
+WORKER_LABEL = "worker"
+
+
+def shard_inputs(inputs: list[dict], workers: int) -> list[list[dict]]:
+    """将 inputs 轮流分配到 workers 个进程, 进程数不超过 inputs 的数量"""
+    workers = max(1, min(workers, len(inputs)))
+    return [inputs[i::workers] for i in range(workers)]
+
+
+def worker_paths(output: dict, index: int) -> dict:
+    """每个进程使用独立的 spool_dir 与输出文件, 避免不同进程的段文件、轮转文件互相覆盖或删除"""
+    output = dict(output)
+    if output.get("spool_dir"):
+        output["spool_dir"] = f"{output['spool_dir']}/worker_{index}"
+    if output.get("filename"):
+        path = Path(output["filename"])
+        output["filename"] = str(path.with_name(f"{path.stem}.worker_{index}{path.suffix}"))
+    if output.get("shards"):
+        output["shards"] = [worker_paths(shard, index) for shard in output["shards"]]
+    return output
+
+
+def worker_tags(output: dict, index: int) -> dict:
+    """Graphite 输出的数据点带上 worker 标签"""
+    if output.get("type") != "graphite":
+        return output
+    tags = {**(output.get("tags") or {}), WORKER_LABEL: str(index)}
+    return {**output, "tags": tags}
+
+
+def worker_config(config: dict, index: int, inputs: list[dict]) -> dict:
+    """子进程的配置: 分配到的 inputs, 输出使用独立的路径与 worker 标签
+
+    worker_label 为 true 时在 processors 末尾追加 worker 标签
+    """
+    processors = list(config.get("processors") or [])
+    if config.get("worker_label"):
+        processors.append({"type": "relabel", "set": {WORKER_LABEL: index}})
+    outputs = [
+        worker_tags(worker_paths(o, index), index) for o in config.get("outputs") or []
+    ]
+    return {
+        **config,
+        "inputs": inputs,
+        "processors": processors,
+        "outputs": outputs,
+        "workers": 1,
+    }
+
+
+def run_worker(index: int, config: dict, setup: Callable[[str], None] = None):
+    """子进程入口"""
+    if setup is not None:
+        setup(f"worker-{index}")
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 由主进程统一处理 Ctrl-C
+    handler = Handler.from_config(config)
+    asyncio.run(handler.start())
+
+
+class WorkerPool:
+    """启动并看护子进程, 子进程退出时按指数退避重启"""
+
+    def __init__(
+        self,
+        config: dict,
+        workers: int,
+        setup: Callable[[str], None] = None,
+        backoff_max: float = 60,
+    ):
+        """
+        :param setup: 子进程中首先调用的函数, 参数为进程名称, 用于配置日志.
+                      子进程使用 spawn 方式启动, setup 需要可以被 pickle.
+        """
+        self.configs = [
+            worker_config(config, i, inputs)
+            for i, inputs in enumerate(shard_inputs(config["inputs"], workers))
+        ]
+        self.setup = setup
+        self.backoff_max = backoff_max
+        self.ctx = multiprocessing.get_context("spawn")
+        self.processes: list[multiprocessing.Process | None] = [None] * len(self.configs)
+        self.started: list[float] = [0.0] * len(self.configs)
+        self.restarts: list[int] = [0] * len(self.configs)
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        p = self.ctx.Process(
+            target=run_worker,
+            args=(index, self.configs[index], self.setup),
+            name=f"to-loki-worker-{index}",
+            daemon=True,
+        )
+        p.start()
+        self.processes[index] = p
+        self.started[index] = time.monotonic()
+        logger.info(
+            "启动子进程 %s (pid=%d), 输入: %s",
+            p.name,
+            p.pid,
+            [i["type"] for i in self.configs[index]["inputs"]],
+        )
+
+    def _delay(self, index: int) -> float:
+        """运行超过 backoff_max 秒后退出的进程立即重启, 否则按重启次数退避"""
+        if time.monotonic() - self.started[index] > self.backoff_max:
+            self.restarts[index] = 0
+        delay = min(self.backoff_max, 2 ** self.restarts[index] - 1)
+        self.restarts[index] += 1
+        return delay
+
+    def stop(self, *_):
+        self._stopping = True
+        for p in self.processes:
+            if p is not None and p.is_alive():
+                p.terminate()
+
+    def run(self):
+        """阻塞运行, 直到收到 SIGTERM / SIGINT"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for i in range(len(self.configs)):
+            self._spawn(i)
+        pending: dict[int, float] = {}  # 等待重启的子进程: 重启时间
+        while not self._stopping:
+            sentinels = {
+                p.sentinel: i
+                for i, p in enumerate(self.processes)
+                if i not in pending and p is not None
+            }
+            timeout = (
+                max(0.0, min(pending.values()) - time.monotonic()) if pending else None
+            )
+            for s in wait(list(sentinels), timeout):
+                if self._stopping:
+                    break
+                i = sentinels[s]
+                p = self.processes[i]
+                p.join()
+                delay = self._delay(i)
+                logger.error(
+                    "子进程 %s 退出 (exitcode=%s), %.0fs 后重启", p.name, p.exitcode, delay
+                )
+                pending[i] = time.monotonic() + delay
+            for i, at in list(pending.items()):
+                if at <= time.monotonic() and not self._stopping:
+                    del pending[i]
+                    self._spawn(i)
+        for p in self.processes:
+            if p is not None:
+                p.join(10)
+        logger.info("所有子进程已退出")
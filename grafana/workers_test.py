@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : workers_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/21 20:10
+"""
+import time
+from pathlib import Path
+
+from .workers import WorkerPool, shard_inputs, worker_config, worker_paths
+
+
+def test_shard_inputs():
+    inputs = [{"type": "clash", "host": str(i)} for i in range(5)]
+    shards = shard_inputs(inputs, 2)
+    assert [[i["host"] for i in s] for s in shards] == [["0", "2", "4"], ["1", "3"]]
+    assert len(shard_inputs(inputs, 8)) == 5
+    assert shard_inputs([], 4) == [[]]
+
+
+def test_worker_config():
+    config = {
+        "workers": 4,
+        "inputs": [{"type": "clash"}],
+        "processors": [{"type": "sample", "rate": 1}],
+        "outputs": [{"type": "loki"}],
+    }
+    res = worker_config(config, 2, [{"type": "ping"}])
+    assert res["inputs"] == [{"type": "ping"}]
+    assert res["processors"] == config["processors"]  # worker 标签默认关闭
+    assert res["workers"] == 1
+
+    res = worker_config({**config, "worker_label": True}, 2, [])
+    assert res["processors"][-1] == {"type": "relabel", "set": {"worker": 2}}
+    assert len(config["processors"]) == 1
+
+
+def test_worker_graphite_tags():
+    config = {
+        "inputs": [],
+        "outputs": [
+            {"type": "graphite", "url": "u", "tags": {"env": "prod"}},
+            {"type": "loki"},
+        ],
+    }
+    outputs = worker_config(config, 1, [])["outputs"]
+    assert outputs[0]["tags"] == {"env": "prod", "worker": "1"}
+    assert "tags" not in outputs[1]
+    assert config["outputs"][0]["tags"] == {"env": "prod"}
+
+
+def test_worker_paths():
+    config = {
+        "inputs": [{"type": "clash"}],
+        "outputs": [
+            {"type": "loki", "spool_dir": "spool/loki"},
+            {"type": "file", "filename": "logs/out.ndjson"},
+            {
+                "type": "loki_sharded",
+                "spool_dir": "spool/common",
+                "shards": [{"host": "a"}, {"host": "b", "spool_dir": "spool/b"}],
+            },
+        ],
+    }
+    outputs = [worker_config(config, i, [])["outputs"] for i in range(2)]
+    assert outputs[0][0]["spool_dir"] == "spool/loki/worker_0"
+    assert outputs[1][0]["spool_dir"] == "spool/loki/worker_1"
+    assert Path(outputs[1][1]["filename"]) == Path("logs/out.worker_1.ndjson")
+    sharded = outputs[1][2]
+    assert sharded["spool_dir"] == "spool/common/worker_1"
+    assert sharded["shards"] == [{"host": "a"}, {"host": "b", "spool_dir": "spool/b/worker_1"}]
+    assert config["outputs"][0]["spool_dir"] == "spool/loki"
+
+
+def test_restart_backoff():
+    pool = WorkerPool({"inputs": [{"type": "clash"}]}, 2, backoff_max=60)
+    assert len(pool.configs) == 1
+    pool.started[0] = time.monotonic()  # 刚启动就退出
+    assert [pool._delay(0) for _ in range(8)] == [0, 1, 3, 7, 15, 31, 60, 60]
+    pool.started[0] = time.monotonic() - 120  # 稳定运行后退出
+    assert pool._delay(0) == 0
@@ -14,3 +14,4 @@ from .time_helper import (
     human_timedelta,
 )
 from .gc_callback import gc_callback
+from .batch_queue import BatchQueue, ABatchQueue
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : batch_queue.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/16 20:15
+
+按批次取出数据的队列, 分为线程版本与 asyncio 版本.
+
+get_batch 在有数据到达或截止时间到达时被唤醒, 不会轮询.
+"""
+import asyncio
+import queue
+import time
+from typing import Any, Callable, Iterable
+
+
+def _zero(_) -> int:
+    return 0
+
+
+class BatchQueue(queue.Queue):
+    """线程安全的批量队列"""
+
+    def __init__(self, maxsize: int = 0, sizeof: Callable[[Any], int] = None):
+        """sizeof: 计算单个元素字节数的函数, 用于 get_batch 的 max_bytes"""
+        super().__init__(maxsize)
+        self.sizeof = sizeof or _zero
+
+    def get_batch(
+        self,
+        max_items: int = 1000,
+        max_bytes: int = None,
+        max_wait: float = None,
+        timeout: float = None,
+    ) -> list:
+        """取出一批数据
+
+        :param max_items: 每批最多的元素数量
+        :param max_bytes: 每批最多的字节数(按 sizeof 计算), 单个元素超出时单独成批
+        :param max_wait: 取到第一个元素后, 最多再等待多少秒以凑满批次; None 为不等待
+        :param timeout: 等待第一个元素的超时时间, 超时返回空列表; None 为一直等待
+        """
+        with self.not_empty:
+            if not self.not_empty.wait_for(self._qsize, timeout):
+                return []
+            deadline = time.monotonic() + (max_wait or 0)
+            batch, size = [], 0
+            while len(batch) < max_items:
+                if not self._qsize():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if not self.not_empty.wait_for(self._qsize, remaining):
+                        break
+                    continue
+                item_size = self.sizeof(self.queue[0])
+                if max_bytes and batch and size + item_size > max_bytes:
+                    break
+                batch.append(self._get())
+                size += item_size
+            self.not_full.notify(len(batch))
+            return batch
+
+    def get_all_nowait(self) -> list:
+        """立即取出队列中全部的数据"""
+        return self.get_batch(max_items=self.qsize() or 1, timeout=0)
+
+    def put_drop_oldest(self, item) -> int:
+        """队列已满时丢弃最旧的数据后写入, 返回丢弃的数量"""
+        dropped = 0
+        while True:
+            try:
+                self.put_nowait(item)
+                return dropped
+            except queue.Full:
+                try:
+                    self.get_nowait()
+                except queue.Empty:
+                    continue
+                self.task_done()
+                dropped += 1
+
+
+class ABatchQueue(asyncio.Queue):
+    """asyncio 批量队列"""
+
+    def __init__(self, maxsize: int = 0, sizeof: Callable[[Any], int] = None):
+        super().__init__(maxsize)
+        self.sizeof = sizeof or _zero
+        self._not_empty = asyncio.Event()
+
+    def _put(self, item):
+        super()._put(item)
+        self._not_empty.set()
+
+    def _get(self):
+        item = super()._get()
+        if not self._queue:
+            self._not_empty.clear()
+        return item
+
+    async def get_batch(
+        self,
+        max_items: int = 1000,
+        max_bytes: int = None,
+        max_wait: float = None,
+        timeout: float = None,
+    ) -> list:
+        """取出一批数据, 参数含义同 BatchQueue.get_batch"""
+        if self.empty():
+            try:
+                await asyncio.wait_for(self._not_empty.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (max_wait or 0)
+        batch, size = [], 0
+        while len(batch) < max_items:
+            if self.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._not_empty.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                continue
+            item_size = self.sizeof(self._queue[0])
+            if max_bytes and batch and size + item_size > max_bytes:
+                break
+            batch.append(self.get_nowait())
+            size += item_size
+        return batch
+
+    def get_all_nowait(self) -> list:
+        """立即取出队列中全部的数据"""
+        return [self.get_nowait() for _ in range(self.qsize())]
+
+    async def put_many(self, items: Iterable) -> None:
+        """依次写入多条数据, 队列有空间时不让出事件循环, 消费者可以一次取到整批"""
+        for item in items:
+            if self.full():
+                await self.put(item)
+            else:
+                self.put_nowait(item)
+
+    def put_drop_oldest(self, item) -> int:
+        """队列已满时丢弃最旧的数据后写入, 返回丢弃的数量"""
+        dropped = 0
+        while self.full():
+            self.get_nowait()
+            self.task_done()
+            dropped += 1
+        self.put_nowait(item)
+        return dropped
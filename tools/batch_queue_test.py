@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@File Name  : batch_queue_test.py
+@Author     : LeeCQ
+@Date-Time  : 2023/10/16 20:15
+"""
+import asyncio
+import threading
+import time
+
+from .batch_queue import ABatchQueue, BatchQueue
+
+
+def test_batch_queue_limits():
+    q = BatchQueue(sizeof=len)
+    for item in ("aa", "bb", "cccc", "d"):
+        q.put(item)
+
+    assert q.get_batch(max_items=3, max_bytes=5) == ["aa", "bb"]
+    assert q.get_batch(max_items=3, max_bytes=3) == ["cccc"]
+    assert q.get_all_nowait() == ["d"]
+    assert q.get_batch(timeout=0.01) == []
+
+
+def test_batch_queue_wakes_on_arrival():
+    q = BatchQueue()
+    threading.Timer(0.05, q.put, args=(1,)).start()
+    start = time.monotonic()
+
+    assert q.get_batch(max_wait=None, timeout=5) == [1]
+    assert time.monotonic() - start < 1
+
+
+def test_batch_queue_linger():
+    q = BatchQueue()
+    q.put(1)
+    threading.Timer(0.02, q.put, args=(2,)).start()
+
+    assert q.get_batch(max_items=2, max_wait=1) == [1, 2]
+
+
+def test_async_batch_queue():
+    async def main():
+        q = ABatchQueue(maxsize=2, sizeof=len)
+        assert await q.get_batch(timeout=0) == []
+
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.02, q.put_nowait, "a")
+        loop.call_later(0.04, q.put_nowait, "bb")
+        assert await q.get_batch(max_items=5, max_wait=0.2) == ["a", "bb"]
+
+        q.put_nowait("ccc")
+        q.put_nowait("d")
+        assert await q.get_batch(max_bytes=2) == ["ccc"]
+        assert q.get_all_nowait() == ["d"]
+
+    asyncio.run(main())
+
+
+def test_put_drop_oldest():
+    q = BatchQueue(maxsize=2)
+    assert [q.put_drop_oldest(i) for i in range(4)] == [0, 0, 1, 1]
+    assert q.get_all_nowait() == [2, 3]
+    assert q.unfinished_tasks == 2
+
+    async def main():
+        aq = ABatchQueue(maxsize=1)
+        assert [aq.put_drop_oldest(i) for i in range(3)] == [0, 1, 1]
+        assert aq.get_all_nowait() == [2]
+
+    asyncio.run(main())
+
+
+def test_put_many():
+    async def main():
+        q = ABatchQueue(maxsize=2)
+        task = asyncio.create_task(q.put_many(range(4)))
+        await asyncio.sleep(0)
+        assert await q.get_batch() == [0, 1]
+        await task
+        assert q.get_all_nowait() == [2, 3]
+
+    asyncio.run(main())
@@ -6,10 +6,13 @@ import threading
 
 from grafana.client_loki import LokiClient
 from grafana.client_loki import Stream
+from tools.batch_queue import BatchQueue
 
 
 class LokiHandler(logging.Handler):
-    def __init__(self, flush_level, capacity, host, user_id, api_key, **kwargs):
+    def __init__(
+        self, flush_level, capacity, host, user_id, api_key, max_buffer=10000, **kwargs
+    ):
         super().__init__()
         self.flushLevel: int = (
             flush_level
@@ -23,7 +26,8 @@ class LokiHandler(logging.Handler):
             api_key,
             **kwargs,
         )
-        self.buffer = asyncio.Queue()
+        self.buffer = BatchQueue(max_buffer)  # emit 可能来自任意线程
+        self.dropped = 0  # 缓存已满时丢弃的最旧日志数量
         self.thread_pool = None
 
     def shouldFlush(self, record):
@@ -31,14 +35,14 @@ class LokiHandler(logging.Handler):
         return record.levelno >= self.flushLevel or self.buffer.qsize() >= self.capacity
 
     def get_buffer(self) -> list:
-        return [self.buffer.get_nowait() for _ in range(self.buffer.qsize())]
+        return self.buffer.get_all_nowait()
 
     def flush(self) -> None:
         """将缓存的日志推送到loki"""
         if asyncio.get_event_loop().is_running():
-            asyncio.create_task(
-                self.loki_client.a_push(self.get_buffer())
-            )  # TODO 考虑推送失败的情况
+            if self.loki_client.saturated:
+                return  # 推送并发已满, 继续缓存(最多 max_buffer 条), 等待下一次flush
+            self.loki_client.push_nowait(self.get_buffer())  # TODO 考虑推送失败的情况
         else:
             threading.Thread(
                 target=self.loki_client.push, args=(self.get_buffer(),), daemon=False
@@ -63,11 +67,9 @@ class LokiHandler(logging.Handler):
             "funcName": record.funcName,
             "message": record.getMessage(),
         }
-        time_ns = str(int(record.created * 1000_000_000))
-        self.buffer.put_nowait(
-            Stream(
-                stream=stream, values=[(time_ns, json.dumps(value, ensure_ascii=False))]
-            )
+        time_ns = int(record.created * 1000_000_000)
+        self.dropped += self.buffer.put_drop_oldest(
+            Stream(stream, [(time_ns, json.dumps(value, ensure_ascii=False))])
         )
         if self.shouldFlush(record):
             self.flush()